@@ -2,19 +2,43 @@ import streamlit as st
 import os
 import tempfile
 from document_processor import DocumentProcessor
-from vector_store import VectorStore
+from vector_store import get_shared_store
 from llm_integration import LLMIntegration
 from chat_history_manager import ChatHistoryManager
-from config import APP_TITLE, APP_DESCRIPTION, SUPPORTED_FILE_TYPES, UPLOAD_DIR, CHAT_HISTORY_DIR
+from config import APP_TITLE, APP_DESCRIPTION, SUPPORTED_FILE_TYPES, UPLOAD_DIR, CHAT_HISTORY_DIR, MMR_SEARCH
+
+# 较重的资源每个进程只创建一次，所有会话和每次重新运行共用；解析库、OpenAI客户端等在第一次使用时才导入
+@st.cache_resource(show_spinner=False)
+def get_document_processor():
+    return DocumentProcessor()
+
+@st.cache_resource(show_spinner=False)
+def get_vector_store():
+    # 使用真实的嵌入模型，确保向量存储生成有意义的嵌入
+    return get_shared_store(use_mock=False)
+
+@st.cache_resource(show_spinner=False)
+def get_llm_integration():
+    return LLMIntegration()
+
+@st.cache_resource(show_spinner=False)
+def get_chat_history_manager():
+    return ChatHistoryManager()
+
+@st.cache_data(show_spinner=False, ttl=10)
+def list_uploaded_files():
+    """上传目录中的文件列表，本进程上传或删除文件后调用list_uploaded_files.clear()失效，其他进程的改动最迟10秒后可见"""
+    if not os.path.exists(UPLOAD_DIR):
+        return []
+    return os.listdir(UPLOAD_DIR)
 
 class KnowledgeBaseQA:
     def __init__(self):
         """初始化知识库问答系统"""
-        self.document_processor = DocumentProcessor()
-        # 使用真实的嵌入模型，确保向量存储生成有意义的嵌入
-        self.vector_store = VectorStore(use_mock=False)
-        self.llm_integration = LLMIntegration()
-        self.chat_history_manager = ChatHistoryManager()
+        self.document_processor = get_document_processor()
+        self.vector_store = get_vector_store()
+        self.llm_integration = get_llm_integration()
+        self.chat_history_manager = get_chat_history_manager()
         
         # 初始化会话状态
         if "chat_history" not in st.session_state:
@@ -28,11 +52,11 @@ class KnowledgeBaseQA:
         has_files = False
         
         # 检查上传目录是否有文件
-        if os.path.exists(UPLOAD_DIR) and os.listdir(UPLOAD_DIR):
+        if list_uploaded_files():
             has_files = True
         
         # 检查向量存储是否有数据
-        if getattr(self.vector_store, 'texts', None) and len(self.vector_store.texts) > 0:
+        if self.vector_store.count() > 0:
             has_files = True
         
         # 初始化files_uploaded状态
@@ -55,11 +79,11 @@ class KnowledgeBaseQA:
         has_files = False
         
         # 检查上传目录是否有文件
-        if os.path.exists(UPLOAD_DIR) and os.listdir(UPLOAD_DIR):
+        if list_uploaded_files():
             has_files = True
         
         # 检查向量存储是否有数据
-        if getattr(self.vector_store, 'texts', None) and len(self.vector_store.texts) > 0:
+        if self.vector_store.count() > 0:
             has_files = True
         
         # 更新files_uploaded状态
@@ -130,8 +154,8 @@ class KnowledgeBaseQA:
                 # 生成回答
                 with st.chat_message("assistant"):
                     with st.spinner("正在生成答案..."):
-                        # 检索相关上下文
-                        context = self.vector_store.similarity_search(prompt)
+                        # 检索相关上下文，MMR去掉内容重叠的文本块
+                        context = self.vector_store.similarity_search(prompt, mmr=MMR_SEARCH)
                         
                         # 生成答案
                         answer = self.llm_integration.generate_answer(prompt, context, chat_history=st.session_state.chat_history)
@@ -166,27 +190,49 @@ class KnowledgeBaseQA:
             # 处理上传的文件
             if uploaded_files:
                 with st.spinner("正在处理文件..."):
-                    all_chunks = []
-                    for uploaded_file in uploaded_files:
-                        # 保存文件到持久化目录
-                        file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
-                        with open(file_path, "wb") as f:
-                            f.write(uploaded_file.getvalue())
-                        
-                        # 处理文件
-                        chunks = self.document_processor.process_file(file_path)
-                        all_chunks.extend(chunks)
-                    
                     try:
-                        # 添加到向量存储
-                        self.vector_store.add_texts(all_chunks)
+                        indexed_files = 0
+                        total_chunks = 0
+                        changed_paths = []
+                        for uploaded_file in uploaded_files:
+                            file_path = os.path.join(UPLOAD_DIR, uploaded_file.name)
+                            content = uploaded_file.getvalue()
+                            # 内容未变化的文件既不重写也不重新索引
+                            if self.vector_store.is_document_current(file_path, content):
+                                continue
+                            
+                            # 保存文件到持久化目录
+                            with open(file_path, "wb") as f:
+                                f.write(content)
+                            changed_paths.append(file_path)
+                        if changed_paths:
+                            list_uploaded_files.clear()
+                        
+                        # 多个文件在进程池中并行解析，先解析完的文件先嵌入，新文本块替换该文件原有的文本块
+                        failed_files = []
+                        for file_path, chunks, error in self.document_processor.process_files(changed_paths):
+                            if error is not None:
+                                failed_files.append(f"{os.path.basename(file_path)}（{str(error)}）")
+                                continue
+                            try:
+                                total_chunks += self.vector_store.add_document_chunks(file_path, chunks)
+                            except Exception as e:
+                                # 单个文件在当前进程边解析边嵌入，解析错误也在这里出现；
+                                # 失败的文件没有登记，重新上传时只请求嵌入缓存中没有的文本块
+                                failed_files.append(f"{os.path.basename(file_path)}（{str(e)}）")
+                                continue
+                            indexed_files += 1
+                        
                         st.session_state.files_uploaded = True
-                        st.success(f"成功处理 {len(uploaded_files)} 个文件，生成 {len(all_chunks)} 个文本块")
+                        if indexed_files:
+                            st.success(f"成功处理 {indexed_files} 个文件，生成 {total_chunks} 个文本块")
+                        if failed_files:
+                            st.warning("以下文件处理失败：" + "；".join(failed_files))
                     except Exception as e:
                         st.error(f"文件处理失败：{str(e)}")
             
             # 显示已上传的文件
-            uploaded_file_list = os.listdir(UPLOAD_DIR)
+            uploaded_file_list = list_uploaded_files()
             if uploaded_file_list:
                 st.subheader("已上传的文件")
                 for file_name in uploaded_file_list:
@@ -197,7 +243,10 @@ class KnowledgeBaseQA:
                     # 删除所有已上传文件
                     for file_name in uploaded_file_list:
                         file_path = os.path.join(UPLOAD_DIR, file_name)
+                        # 同时删除该文件在向量存储中的文本块
+                        self.vector_store.delete_document(file_path)
                         os.remove(file_path)
+                    list_uploaded_files.clear()
                     st.success("已清除所有已上传文件")
                     st.rerun()
                 
@@ -210,7 +259,9 @@ class KnowledgeBaseQA:
                     with col2:
                         if st.button("🗑️", key=f"delete_file_{file_name}", help="删除文件"):
                             file_path = os.path.join(UPLOAD_DIR, file_name)
+                            self.vector_store.delete_document(file_path)
                             os.remove(file_path)
+                            list_uploaded_files.clear()
                             st.success(f"已删除文件: {file_name}")
                             st.rerun()
             
@@ -222,6 +273,7 @@ class KnowledgeBaseQA:
         """重置应用状态"""
         # 重置向量存储
         self.vector_store.reset()
+        list_uploaded_files.clear()
         
         # 清空聊天历史
         st.session_state.chat_history = []
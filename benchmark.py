@@ -0,0 +1,271 @@
+"""性能基准测试
+
+用法：
+    python benchmark.py search --rows 1000000 --dim 768 --shards 1 2 4 8
+        精确检索吞吐随分片（工作进程）数量的变化，分片数1为本进程单线程扫描的基线
+    python benchmark.py startup
+        应用首次加载（导入模块、创建文档处理器/向量存储/LLM客户端）和每次重新运行的耗时
+    python benchmark.py chunking --chars 5000000
+        按token预算切分大文本的吞吐：本项目的流式切分器与LangChain RecursiveCharacterTextSplitter
+        （长度函数为tiktoken编码）对比，并给出文本块token数的分布
+    python benchmark.py parsing --mb 100
+        大TXT/Markdown/HTML文件解析并切分的耗时和峰值内存：整文件读取（Markdown和HTML构建完整的
+        BeautifulSoup文档树）与流式读取对比，每次在全新的子进程中运行
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from vector_storage import MmapVectorStorage, WRITE_BATCH_ROWS
+
+
+def build_store(directory, rows, dim, seed=0):
+    """在目录中写入rows行随机归一化向量的存储"""
+    rng = np.random.default_rng(seed)
+
+    def blocks():
+        for start in range(0, rows, WRITE_BATCH_ROWS):
+            block = rng.standard_normal((min(WRITE_BATCH_ROWS, rows - start), dim), dtype=np.float32)
+            yield block / np.linalg.norm(block, axis=1, keepdims=True)
+
+    texts = (str(i) for i in range(rows))
+    MmapVectorStorage(directory).write(blocks(), texts, np.arange(rows), dim, "mock", rows)
+
+
+def measure(function, repeat):
+    """执行repeat次，返回每次的平均秒数"""
+    function()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench_search(args):
+    from vector_store import VectorStore
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((args.batch, args.dim), dtype=np.float32)
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"写入 {args.rows} 行 x {args.dim} 维的存储 ...")
+        build_store(directory, args.rows, args.dim)
+        print(f"CPU核数: {os.cpu_count()}")
+        print(f"{'分片数':>6} {'单查询延迟(ms)':>16} {'单查询QPS':>12} {'批量QPS':>12} {'加速比':>8}")
+        baseline = None
+        expected = None
+        for shards in args.shards:
+            store = VectorStore(use_mock=True, persist_directory=directory, search_shards=shards)
+            single = measure(lambda: store._search_by_vector(queries[0], args.k, exact=True), args.repeat)
+            batch = measure(lambda: store._search_batch_by_vectors(queries, args.k), max(1, args.repeat // 10))
+            rows = store._search_by_vector(queries[0], args.k, exact=True)
+            if expected is None:
+                expected = rows
+            elif not np.array_equal(rows, expected):
+                print(f"警告：分片数 {shards} 的检索结果与基线不一致")
+            baseline = baseline or single
+            print(f"{shards:>6} {single * 1000:>16.2f} {1 / single:>12.1f} {args.batch / batch:>12.1f} "
+                  f"{baseline / single:>8.2f}")
+            store.close()
+            del store
+
+
+STARTUP_SCRIPT = """
+import sys, tempfile, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+from document_processor import DocumentProcessor
+from vector_store import VectorStore
+from llm_integration import LLMIntegration
+imported = time.perf_counter()
+directory = tempfile.mkdtemp()
+def construct():
+    return DocumentProcessor(), VectorStore(use_mock=False, persist_directory=directory), LLMIntegration()
+construct()
+constructed = time.perf_counter()
+resources = construct()
+reconstructed = time.perf_counter()
+resources[0].process_file({sample!r})
+first_use = time.perf_counter()
+print(imported - start, constructed - imported, reconstructed - constructed, first_use - reconstructed)
+"""
+
+
+def bench_startup(args):
+    """在全新的子进程中测量导入和创建资源的耗时，取多次运行的中位数"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        sample = os.path.join(directory, "sample.md")
+        with open(sample, "w", encoding="utf-8") as f:
+            f.write("# 标题\n" + "测试文本。" * 500)
+        script = STARTUP_SCRIPT.format(root=root, sample=sample)
+        # 只创建客户端、不发送请求，没有配置密钥时使用占位密钥
+        env = dict(os.environ, OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "benchmark"))
+        runs = []
+        for _ in range(args.repeat):
+            output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                    cwd=directory, env=env).stdout
+            runs.append([float(value) for value in output.split()[-4:]])
+    imported, constructed, reconstructed, first_use = np.median(np.array(runs), axis=0) * 1000
+    print(f"导入模块: {imported:.0f} ms")
+    print(f"首次创建资源: {constructed:.0f} ms")
+    print(f"首次页面加载合计: {imported + constructed:.0f} ms")
+    print(f"重新创建资源（未缓存时每次重新运行的代价）: {reconstructed:.1f} ms")
+    print(f"首次解析并切分文档: {first_use:.0f} ms")
+
+
+def bench_chunking(args):
+    """两种切分器切分同一段中英文混合文本，比较耗时和文本块的token数"""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from text_splitter import StreamingTextSplitter, load_encoding
+    encoding = load_encoding()
+    if encoding is None:
+        print("tiktoken编码不可用，两种切分器都按字符计数")
+    paragraph = ("向量检索把文本映射到同一个向量空间，再按余弦相似度返回最接近的文本块。"
+                 "The index is built once, then every query only scans the compact matrix.\n")
+    text = (paragraph * (args.chars // len(paragraph) + 1))[:args.chars]
+    splitter = StreamingTextSplitter(args.chunk_size, args.chunk_overlap, encoding)
+    if encoding is None:
+        length = len
+    else:
+        length = lambda chunk: len(encoding.encode_ordinary(chunk))
+    baseline = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.chunk_overlap,
+                                              length_function=length)
+
+    native_time = measure(lambda: splitter.split_text(text), args.repeat)
+    baseline_time = measure(lambda: baseline.split_text(text), args.repeat)
+    native_tokens = np.array([tokens for _, tokens in splitter.split_text(text)])
+    baseline_tokens = np.array([length(chunk) for chunk in baseline.split_text(text)])
+    print(f"文本: {len(text) / 1e6:.1f}M 字符，块大小 {args.chunk_size}，重叠 {args.chunk_overlap}")
+    for name, seconds, tokens in [("流式切分器", native_time, native_tokens),
+                                  ("LangChain", baseline_time, baseline_tokens)]:
+        print(f"{name}: {seconds:.2f} s（{len(text) / seconds / 1e6:.2f}M 字符/秒），{len(tokens)} 块，"
+              f"token数 平均 {tokens.mean():.0f} / 最大 {tokens.max()}")
+
+
+PARSING_SCRIPT = """
+import resource
+import sys
+import time
+sys.path.insert(0, {root!r})
+from config import CHUNK_SIZE, CHUNK_OVERLAP
+from document_processor import DocumentProcessor
+from text_splitter import StreamingTextSplitter, load_encoding
+path = {path!r}
+
+
+def whole_file_chunks():
+    with open(path, "r", encoding="utf-8") as f:
+        content = f.read()
+    if path.endswith(".md"):
+        import markdown
+        from bs4 import BeautifulSoup
+        text = BeautifulSoup(markdown.markdown(content), "html.parser").get_text()
+    elif path.endswith(".html"):
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(content, "html.parser")
+        for tag in soup(["script", "style"]):
+            tag.decompose()
+        text = " ".join(soup.stripped_strings)
+    else:
+        text = content
+    return StreamingTextSplitter(CHUNK_SIZE, CHUNK_OVERLAP, load_encoding()).split_text(text)
+
+
+load_encoding()
+baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.perf_counter()
+if {mode!r} == "whole":
+    chunks = len(whole_file_chunks())
+else:
+    # cached使用默认配置，解析结果写入（或读取）工作目录下的解析缓存
+    chunks = sum(1 for _ in DocumentProcessor(use_cache={mode!r} == "cached").iter_chunks(path))
+elapsed = time.perf_counter() - start
+print(chunks, elapsed, baseline, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+"""
+
+
+def write_parsing_samples(directory, size):
+    """生成约size字节的TXT、Markdown和HTML样本"""
+    paragraph = "向量检索把文本映射到同一个向量空间，再按余弦相似度返回最接近的文本块。The index is built once. "
+    paths = {}
+    for extension in (".txt", ".md", ".html"):
+        path = os.path.join(directory, "sample" + extension)
+        with open(path, "w", encoding="utf-8") as f:
+            if extension == ".html":
+                f.write("<html><head><style>p { margin: 0 }</style></head><body>\n")
+            written, section = 0, 0
+            while written < size:
+                if extension == ".txt":
+                    block = f"2024-01-01 12:00:{section % 60:02d} INFO {paragraph}\n" * 20
+                elif extension == ".md":
+                    block = f"## 第{section}节\n\n" + (paragraph + "\n\n") * 10 + "```\nprint('code')\n```\n\n"
+                else:
+                    block = (f"<h2>第{section}节</h2>\n" + f"<p>{paragraph}</p>\n" * 10 +
+                             "<script>var tracking = {id: 1};</script>\n")
+                f.write(block)
+                written += len(block.encode("utf-8"))
+                section += 1
+            if extension == ".html":
+                f.write("</body></html>\n")
+        paths[extension] = path
+    return paths
+
+
+def bench_parsing(args):
+    """在全新的子进程中分别用整文件读取、流式读取和默认的带解析缓存的流式读取解析样本，比较耗时和峰值内存（RSS）"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_parsing_samples(directory, int(args.mb * 1024 ** 2))
+        for extension, path in paths.items():
+            print(f"{extension}（{os.path.getsize(path) / 1024 ** 2:.0f} MB）")
+            modes = [("整文件读取", "whole"), ("流式读取", "streaming"),
+                     ("流式读取并写入解析缓存", "cached"), ("命中解析缓存", "cached")]
+            for name, mode in modes:
+                script = PARSING_SCRIPT.format(root=root, path=path, mode=mode)
+                output = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                        cwd=directory).stdout
+                chunks, elapsed, baseline, peak = output.split()[-4:]
+                print(f"  {name}: {float(elapsed):.1f} s，{int(chunks)} 块，"
+                      f"峰值内存 {int(peak) / 1024:.0f} MB（解析前 {int(baseline) / 1024:.0f} MB）")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Personal RAG性能基准测试")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    search = commands.add_parser("search", help="分片精确检索的吞吐随进程数的变化")
+    search.add_argument("--rows", type=int, default=1000000)
+    search.add_argument("--dim", type=int, default=768)
+    search.add_argument("--k", type=int, default=4)
+    search.add_argument("--batch", type=int, default=64, help="批量检索的查询数")
+    search.add_argument("--repeat", type=int, default=20)
+    search.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    search.set_defaults(function=bench_search)
+
+    startup = commands.add_parser("startup", help="应用首次加载和重新运行的耗时")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.set_defaults(function=bench_startup)
+
+    chunking = commands.add_parser("chunking", help="按token预算切分大文本的吞吐")
+    chunking.add_argument("--chars", type=int, default=5000000)
+    chunking.add_argument("--chunk-size", type=int, default=500)
+    chunking.add_argument("--chunk-overlap", type=int, default=100)
+    chunking.add_argument("--repeat", type=int, default=1)
+    chunking.set_defaults(function=bench_chunking)
+
+    parsing = commands.add_parser("parsing", help="大TXT/Markdown/HTML文件解析的耗时和峰值内存")
+    parsing.add_argument("--mb", type=float, default=100, help="每种格式的样本大小（MB）")
+    parsing.set_defaults(function=bench_parsing)
+
+    args = parser.parse_args()
+    args.function(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""本地持久化的Chroma向量存储后端
+
+文本块、元数据和归一化向量保存在存储目录中的嵌入式Chroma集合里，检索使用Chroma的HNSW索引（余弦距离），
+不需要单独的服务进程。块ID、文档登记表等状态保存在同一目录的状态文件中。
+同一存储目录只应由一个进程写入。
+"""
+import os
+import chromadb
+from chromadb.config import Settings
+import numpy as np
+from config import CHROMA_STORE_PATH
+from chunk_metadata import FIELDS, normalize_record
+from vector_backends import ExternalBackend
+
+COLLECTION_NAME = "chunks"
+
+
+class ChromaVectorStore(ExternalBackend):
+    """嵌入式持久化Chroma集合作为向量存储后端"""
+    name = "chroma"
+
+    def __init__(self, use_mock=False, persist_directory=None):
+        persist_directory = persist_directory or CHROMA_STORE_PATH
+        os.makedirs(persist_directory, exist_ok=True)
+        super().__init__(use_mock, persist_directory)
+        self._client = chromadb.PersistentClient(path=persist_directory,
+                                                 settings=Settings(anonymized_telemetry=False))
+        self._collection = self._open_collection()
+        # 每次写入或删除请求最多包含的条数
+        self._batch_size = self._client.get_max_batch_size()
+
+    def _open_collection(self):
+        return self._client.get_or_create_collection(COLLECTION_NAME, metadata={"hnsw:space": "cosine"},
+                                                     embedding_function=None)
+
+    def _insert(self, ids, vectors, texts, metadatas):
+        metadatas = [normalize_record(metadata) for metadata in metadatas]
+        for start in range(0, len(ids), self._batch_size):
+            stop = start + self._batch_size
+            self._collection.add(ids=[str(i) for i in ids[start:stop]], embeddings=vectors[start:stop],
+                                 documents=texts[start:stop], metadatas=metadatas[start:stop])
+
+    def _remove(self, ids):
+        removed = 0
+        for start in range(0, len(ids), self._batch_size):
+            existing = self._collection.get(ids=[str(i) for i in ids[start:start + self._batch_size]],
+                                            include=[])["ids"]
+            if existing:
+                self._collection.delete(ids=existing)
+                removed += len(existing)
+        return removed
+
+    def _where(self, filter):
+        """把过滤条件转换为Chroma的where子句，返回 (子句, 是否必然为空)"""
+        clauses = []
+        for field, condition in (filter or {}).items():
+            if field not in FIELDS:
+                raise ValueError(f"不支持的元数据字段: {field}")
+            if callable(condition):
+                raise ValueError("Chroma后端不支持函数形式的过滤条件")
+            if isinstance(condition, (list, tuple, set, frozenset)):
+                values = [normalize_record({field: value})[field] for value in condition]
+                if not values:
+                    return None, True
+                clauses.append({field: {"$in": values}})
+            else:
+                clauses.append({field: normalize_record({field: condition})[field]})
+        if not clauses:
+            return None, False
+        return (clauses[0] if len(clauses) == 1 else {"$and": clauses}), False
+
+    def _query(self, vectors, k, filter=None):
+        where, empty = self._where(filter)
+        k = min(k, self._collection.count())
+        if empty or k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in vectors]
+        result = self._collection.query(query_embeddings=vectors, n_results=k, where=where, include=["distances"])
+        # 余弦距离转换为余弦相似度
+        return [(np.array(ids, dtype=np.int64), 1 - np.array(distances, dtype=np.float32))
+                for ids, distances in zip(result["ids"], result["distances"])]
+
+    def _fetch(self, ids):
+        if len(ids) == 0:
+            return [], [], np.empty((0, self._dim() or 0), dtype=np.float32)
+        result = self._collection.get(ids=[str(i) for i in ids], include=["documents", "metadatas", "embeddings"])
+        # Chroma不保证按请求的顺序返回
+        position = {int(i): p for p, i in enumerate(result["ids"])}
+        order = [position[int(i)] for i in ids]
+        vectors = np.asarray(result["embeddings"], dtype=np.float32)[order]
+        return [result["documents"][p] for p in order], [result["metadatas"][p] for p in order], vectors
+
+    def _rows(self, batch_size):
+        for offset in range(0, self._collection.count(), batch_size):
+            result = self._collection.get(limit=batch_size, offset=offset,
+                                          include=["documents", "metadatas", "embeddings"])
+            ids = np.array(result["ids"], dtype=np.int64)
+            order = np.argsort(ids)
+            yield (ids[order], np.asarray(result["embeddings"], dtype=np.float32)[order],
+                   [result["documents"][p] for p in order], [result["metadatas"][p] for p in order])
+
+    def _count(self):
+        return self._collection.count()
+
+    def _clear(self):
+        self._client.delete_collection(COLLECTION_NAME)
+        self._collection = self._open_collection()
@@ -0,0 +1,66 @@
+import os
+import tempfile
+import pytest
+from vector_store import VectorStore, create_vector_store
+from vector_backends import migrate_store
+
+
+class TestChromaVectorStore:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = create_vector_store("chroma", use_mock=True,
+                                         persist_directory=os.path.join(self.temp_dir.name, "chroma"))
+
+    def teardown_method(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def add_search_and_reload_test(self):
+        """测试Chroma后端的添加、过滤检索、按文档替换和重新加载"""
+        path = os.path.join(self.temp_dir.name, "a.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("内容")
+        assert self.store.add_document(path, ["数据库索引原理", "向量检索方法"], [{"section": "索引"}, {"page": 2}]) == 2
+        ids = self.store.add_texts(["今天天气很好"])
+
+        assert self.store.similarity_search("向量检索方法", k=1) == ["向量检索方法"]
+        results = self.store.similarity_search_with_metadata("向量检索方法", k=3, filter={"source": os.path.normpath(path)})
+        assert {result["text"] for result in results} == {"数据库索引原理", "向量检索方法"}
+        assert self.store.similarity_search("数据库", k=2, filter={"page": [2]}) == ["向量检索方法"]
+        with pytest.raises(ValueError):
+            self.store.similarity_search("数据库", filter={"page": lambda column: column > 1})
+        batch = self.store.similarity_search_batch(["今天天气很好", "数据库索引原理"], k=1)
+        assert [result["ids"] for result in batch] == [ids, [0]]
+
+        assert self.store.is_document_current(path)
+        assert self.store.add_document(path, ["新的内容"]) == 1
+        assert self.store.stats()["live"] == 2 and self.store.count() == 2
+
+        reloaded = create_vector_store("chroma", persist_directory=self.store.persist_directory)
+        assert reloaded.is_document_current(path)
+        assert reloaded.similarity_search("新的内容", k=1) == ["新的内容"]
+        assert reloaded.add_texts(["另一段文本"]) == [4]
+        reloaded.close()
+
+    def migrate_round_trip_test(self):
+        """测试NumPy后端和Chroma后端之间迁移保留块ID、元数据和文档登记表"""
+        source = VectorStore(use_mock=True, persist_directory=os.path.join(self.temp_dir.name, "numpy"))
+        path = os.path.join(self.temp_dir.name, "b.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("内容")
+        source.add_document(path, ["第一段", "第二段", "第三段"], [{"section": "一"}, {"section": "二"}, {}])
+        source.delete(source.add_texts(["已删除的文本"]))
+
+        assert migrate_store(source, self.store, batch_size=2) == 3
+        assert self.store.documents == source.documents
+        result = self.store.similarity_search_with_metadata("第二段", k=1)[0]
+        assert (result["id"], result["metadata"]["section"]) == (1, "二")
+        with pytest.raises(ValueError):
+            migrate_store(source, self.store)
+
+        target = VectorStore(persist_directory=os.path.join(self.temp_dir.name, "numpy2"))
+        assert migrate_store(self.store, target) == 3
+        assert target.similarity_search_with_metadata("第三段", k=1)[0]["id"] == 2
+        assert target.is_document_current(path)
+        del source, target
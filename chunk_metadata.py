@@ -0,0 +1,130 @@
+"""文本块的列式元数据：来源路径、章节、页码、文档ID和时间戳
+
+每个字段是一列与向量行一一对应的紧凑数组。字符串字段按字典编码保存为int32编码，
+过滤条件先在（很小的）取值字典上求值，再用编码数组一次向量化地得到行掩码。
+"""
+import json
+import numpy as np
+
+# 字段 -> 列类型，"category"表示字典编码的字符串
+FIELDS = {
+    "source": "category",
+    "section": "category",
+    "page": np.int32,
+    "document_id": np.int64,
+    "created_at": np.float64,
+    "modified_at": np.float64
+}
+DEFAULTS = {"source": "", "section": "", "page": -1, "document_id": -1, "created_at": 0.0, "modified_at": 0.0}
+
+
+def normalize_record(record):
+    """补齐缺少的字段并转换为列类型对应的Python值，多余的字段丢弃"""
+    normalized = {}
+    for field, kind in FIELDS.items():
+        value = record.get(field, DEFAULTS[field]) if record else DEFAULTS[field]
+        normalized[field] = str(value) if kind == "category" else np.dtype(kind).type(value).item()
+    return normalized
+
+
+class MetadataTable:
+    """与向量行一一对应的元数据列"""
+    def __init__(self):
+        self.count = 0
+        # 列字典整体替换，检索线程总能看到长度一致的各列
+        self._columns = {field: np.empty(0, dtype=np.int32 if kind == "category" else kind)
+                         for field, kind in FIELDS.items()}
+        # 字符串字段的取值字典，编码0固定为空字符串
+        self._categories = {field: [""] for field, kind in FIELDS.items() if kind == "category"}
+        self._codes = {field: {"": 0} for field in self._categories}
+
+    def _code(self, field, value):
+        value = str(value)
+        code = self._codes[field].get(value)
+        if code is None:
+            code = self._codes[field][value] = len(self._categories[field])
+            self._categories[field].append(value)
+        return code
+
+    def append(self, records, count):
+        """追加count行元数据，records为与行对应的字典列表，缺少的字段使用默认值"""
+        records = records if records is not None else [{}] * count
+        if len(records) != count:
+            raise ValueError(f"元数据数量 {len(records)} 与行数 {count} 不一致")
+        columns = {}
+        for field, kind in FIELDS.items():
+            values = [record.get(field, DEFAULTS[field]) for record in records]
+            if kind == "category":
+                new = np.array([self._code(field, value) for value in values], dtype=np.int32)
+            else:
+                new = np.array(values, dtype=kind)
+            columns[field] = np.concatenate([self._columns[field], new])
+        self._columns = columns
+        self.count += count
+
+    def mask(self, filters):
+        """把过滤条件求值为行掩码
+
+        条件可以是单个取值（相等）、列表/元组/集合（属于其中之一），或接收整列数组、
+        返回布尔数组的函数；字符串字段的函数在取值字典上逐个求值。多个字段之间为“且”。
+        """
+        columns = self._columns
+        count = len(columns["page"])
+        mask = np.ones(count, dtype=bool)
+        for field, condition in filters.items():
+            if field not in FIELDS:
+                raise ValueError(f"不支持的元数据字段: {field}")
+            column = columns[field]
+            if FIELDS[field] == "category":
+                categories = self._categories[field]
+                if callable(condition):
+                    matches = np.array([bool(condition(value)) for value in categories], dtype=bool)
+                else:
+                    values = condition if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+                    matches = np.zeros(len(categories), dtype=bool)
+                    for value in values:
+                        code = self._codes[field].get(str(value))
+                        if code is not None:
+                            matches[code] = True
+                mask &= matches[column]
+            elif callable(condition):
+                mask &= np.asarray(condition(column), dtype=bool)
+            elif isinstance(condition, (list, tuple, set, frozenset)):
+                mask &= np.isin(column, list(condition))
+            else:
+                mask &= column == condition
+        return mask
+
+    def rows(self, rows):
+        """取出若干行的元数据字典"""
+        columns = self._columns
+        records = [{} for _ in rows]
+        for field, kind in FIELDS.items():
+            values = columns[field][rows]
+            if kind == "category":
+                categories = self._categories[field]
+                values = [categories[code] for code in values]
+            else:
+                values = values.tolist()
+            for record, value in zip(records, values):
+                record[field] = value
+        return records
+
+    def to_arrays(self, live=None):
+        """保存为数组；传入live时去掉已删除的行"""
+        arrays = {}
+        for field, column in self._columns.items():
+            arrays[field] = column[:len(live)][live] if live is not None else column
+        for field, categories in self._categories.items():
+            arrays[f"{field}_categories"] = np.frombuffer(
+                json.dumps(categories, ensure_ascii=False).encode("utf-8"), dtype=np.uint8)
+        return arrays
+
+    def load_arrays(self, arrays):
+        for field, kind in FIELDS.items():
+            if kind == "category":
+                categories = json.loads(bytes(arrays[f"{field}_categories"]).decode("utf-8"))
+                self._categories[field] = categories
+                self._codes[field] = {value: code for code, value in enumerate(categories)}
+        self._columns = {field: np.array(arrays[field]) for field in FIELDS}
+        self.count = len(self._columns["page"])
@@ -0,0 +1,39 @@
+import numpy as np
+from chunk_metadata import MetadataTable
+
+
+class TestMetadataTable:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.table = MetadataTable()
+        self.table.append([
+            {"source": "a.pdf", "page": 1, "created_at": 10.0},
+            {"source": "a.pdf", "page": 2, "created_at": 20.0},
+            {"source": "b.md", "section": "安装", "created_at": 30.0}
+        ], 3)
+        self.table.append(None, 1)
+    
+    def mask_test(self):
+        """测试相等、属于和函数三种过滤条件"""
+        assert self.table.mask({"source": "a.pdf"}).tolist() == [True, True, False, False]
+        assert self.table.mask({"source": ["b.md", "不存在"]}).tolist() == [False, False, True, False]
+        assert self.table.mask({"source": "a.pdf", "page": 2}).tolist() == [False, True, False, False]
+        assert self.table.mask({"created_at": lambda column: column >= 20}).tolist() == [False, True, True, False]
+        assert self.table.mask({"section": lambda value: value.startswith("安")}).tolist() == [False, False, True, False]
+        try:
+            self.table.mask({"author": "x"})
+            assert False
+        except ValueError as e:
+            assert "不支持的元数据字段" in str(e)
+    
+    def rows_and_arrays_test(self):
+        """测试按行取出元数据，以及去掉删除行后保存、加载"""
+        assert self.table.rows([2, 3]) == [
+            {"source": "b.md", "section": "安装", "page": -1, "document_id": -1, "created_at": 30.0, "modified_at": 0.0},
+            {"source": "", "section": "", "page": -1, "document_id": -1, "created_at": 0.0, "modified_at": 0.0}
+        ]
+        loaded = MetadataTable()
+        loaded.load_arrays(self.table.to_arrays(np.array([False, True, True, False])))
+        assert loaded.count == 2
+        assert [row["page"] for row in loaded.rows([0, 1])] == [2, -1]
+        assert loaded.mask({"source": "b.md"}).tolist() == [False, True]
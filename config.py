@@ -1,16 +1,57 @@
 # 配置文件
 
 # 文档处理配置
-CHUNK_SIZE = 1000
-CHUNK_OVERLAP = 200
+CHUNK_SIZE = 500  # 每个文本块的token数上限（tiktoken编码不可用时按字符计）
+CHUNK_OVERLAP = 100  # 相邻文本块重叠的token数
+TOKENIZER_ENCODING = "cl100k_base"  # 切分文本块时计数使用的tiktoken编码
+INGEST_MAX_WORKERS = 0  # 批量上传时并行解析文件的进程数，0表示使用CPU核数
+INGEST_PENDING_PER_WORKER = 2  # 每个解析进程最多排队的文件数，限制已解析未索引的文本块占用的内存
+PARSE_CACHE_ENABLED = True  # 是否缓存文件的解析结果，同样内容的文件不再重新解析
+PARSE_CACHE_PATH = "./parse_cache/parsed.db"  # 解析缓存的SQLite文件
+PARSE_CACHE_MAX_BYTES = 1024 ** 3  # 解析缓存的总字节上限（压缩后），超过后淘汰最久未使用的文件
 
 # 文件存储配置
 UPLOAD_DIR = "./uploads"  # 上传文件保存目录
 CHAT_HISTORY_DIR = "./chat_histories"  # 对话历史保存目录
 
 # 向量存储配置
+VECTOR_BACKEND = "numpy"  # 向量存储后端："numpy"为内存映射文件加NumPy检索，"chroma"为本地持久化的Chroma集合（HNSW近似检索），"sqlite"为单个SQLite文件
 VECTOR_STORE_PATH = "./vector_store"
+CHROMA_STORE_PATH = "./chroma_store"  # Chroma后端的存储目录
+SQLITE_STORE_PATH = "./vector_store.db"  # SQLite后端的数据库文件
 EMBEDDING_MODEL = "deepseek-ai/text-embedding-v1"  # DeepSeek API支持的嵌入模型
+EMBEDDING_CACHE_ENABLED = True  # 是否在嵌入API前启用磁盘缓存
+EMBEDDING_CACHE_PATH = "./embedding_cache/embeddings.db"  # 嵌入缓存的SQLite文件
+EMBEDDING_CACHE_MAX_ENTRIES = 500000  # 缓存最多保存的向量条数
+EMBEDDING_CACHE_MAX_BYTES = 2 * 1024 ** 3  # 缓存向量的总字节上限，超过后淘汰最久未使用的条目
+EMBEDDING_BATCH_SIZE = 64  # 每次嵌入请求最多包含的文本条数
+EMBEDDING_BATCH_MAX_TOKENS = 50000  # 每次嵌入请求最多包含的token数
+EMBEDDING_MAX_IN_FLIGHT = 4  # 同时在途的嵌入请求数量
+EMBEDDING_MAX_RETRIES = 3  # 单个批次失败后的重试次数
+EMBEDDING_RETRY_BACKOFF = 1.0  # 重试的初始等待秒数，之后每次翻倍
+STREAM_EMBED_BATCH = EMBEDDING_BATCH_SIZE * EMBEDDING_MAX_IN_FLIGHT  # 边解析边索引时每批嵌入的文本块数，正好占满在途请求
+COMPACT_MIN_LOG_ROWS = 5000  # 日志段至少积累这么多行才触发自动合并
+COMPACT_LOG_RATIO = 0.5  # 日志段行数超过基础文件行数的该比例时触发自动合并
+BACKGROUND_COMPACTION = True  # 自动合并是否在后台线程中执行
+COMPACT_MIN_DEAD_ROWS = 1000  # 已删除行至少达到这么多才因删除触发自动合并
+COMPACT_DEAD_RATIO = 0.2  # 已删除行占全部行的比例超过该值时触发自动合并，合并会清除已删除的行
+SEARCH_ENGINE = "exact"  # 检索引擎："exact"为精确暴力检索，"ivf"为IVF-Flat近似最近邻检索
+IVF_NLIST = 0  # IVF倒排列表数量，0表示按行数自动取 sqrt(行数)
+IVF_NPROBE = 8  # 每次检索扫描的倒排列表数量，越大召回越高、延迟越高
+IVF_MIN_TRAIN_ROWS = 10000  # 行数达到该值才训练IVF索引，之前仍使用精确检索
+QUANTIZATION = None  # 嵌入压缩方式：None不压缩，"int8"为标量量化，"pq"为乘积量化
+PQ_SUBSPACES = 0  # 乘积量化的子空间数量，0表示每8维一个子空间
+QUANTIZATION_MIN_TRAIN_ROWS = 10000  # 行数达到该值才训练量化器
+HYBRID_SEARCH = True  # 是否维护BM25倒排索引，并与向量检索结果用倒数排名融合
+HYBRID_CANDIDATES = 50  # 融合时向量检索和BM25检索各取的候选数量
+RRF_K = 60  # 倒数排名融合的平滑常数
+RESCORE_FACTOR = 10  # 量化检索先取 k*该值 个候选，再用磁盘上的全精度向量重新打分；0表示不重新打分
+SEARCH_SHARDS = 0  # 精确检索的分片（工作进程）数量，0或1表示在本进程中检索
+SHARD_MIN_ROWS = 100000  # 基础文件行数达到该值才使用分片进程池
+STORE_REFRESH_INTERVAL = 1.0  # 检索前检查其他进程对同一存储的写入的最短间隔（秒）
+MMR_SEARCH = True  # 问答时是否用最大边际相关（MMR）对检索结果去冗余，避免把重叠的文本块都放进提示词
+MMR_FETCH_K = 20  # MMR重新排序的候选数量
+MMR_LAMBDA = 0.5  # MMR中相关性的权重，1为只看相关性，0为只看多样性
 
 # LLM配置
 LLM_MODEL = "deepseek-chat"
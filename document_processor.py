@@ -1,109 +1,400 @@
+import itertools
 import os
-from PyPDF2 import PdfReader
-from docx import Document
-import markdown
-from bs4 import BeautifulSoup
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from config import CHUNK_SIZE, CHUNK_OVERLAP
+import re
+from html.parser import HTMLParser
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+from config import (CHUNK_SIZE, CHUNK_OVERLAP, INGEST_MAX_WORKERS, INGEST_PENDING_PER_WORKER,
+                    PARSE_CACHE_ENABLED)
+from text_splitter import StreamingTextSplitter, load_encoding
 
-class DocumentProcessor:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=CHUNK_SIZE,
-            chunk_overlap=CHUNK_OVERLAP,
-            length_function=len
-        )
-    
-    def process_file(self, file_path):
-        """处理不同类型的文件，返回文本块列表"""
-        file_extension = os.path.splitext(file_path)[1].lower()
-        
-        # 读取文件内容
-        if file_extension == ".pdf":
-            text = self._read_pdf(file_path)
-        elif file_extension == ".txt":
-            text = self._read_txt(file_path)
-        elif file_extension == ".docx":
-            text = self._read_docx(file_path)
-        elif file_extension == ".md":
-            text = self._read_markdown(file_path)
-        elif file_extension == ".html" or file_extension == ".htm":
-            text = self._read_html(file_path)
+# 解析逻辑（读取器、片段划分、元数据）变化时加一，旧的解析缓存随之失效
+PARSER_VERSION = 3
+# 流式读取TXT/Markdown/HTML时每段的字符数，解析的内存占用与它成正比，与文件大小无关
+READ_BLOCK_CHARS = 256 * 1024
+
+# 解析进程中复用的处理器实例，按解析缓存路径区分
+_worker_processors = {}
+
+
+def _parse_file(file_path, cache_path):
+    """在解析进程中切分一个文件，返回 [(文本块, 元数据)]（要传回主进程，只能是完整的列表）；cache_path为None时不使用解析缓存"""
+    processor = _worker_processors.get(cache_path)
+    if processor is None:
+        if cache_path is None:
+            processor = DocumentProcessor(use_cache=False)
         else:
-            raise ValueError(f"不支持的文件类型: {file_extension}")
+            from parse_cache import ParseCache
+            processor = DocumentProcessor(ParseCache(cache_path))
+        _worker_processors[cache_path] = processor
+    return list(processor.iter_chunks(file_path))
+
+
+class HTMLTextExtractor(HTMLParser):
+    """事件驱动地提取HTML正文：跳过script/style，块级标签处换行，pre之外的连续空白合并为一个空格或换行
+
+    可以多次feed()，每次之后用take()取出已提取的文本，内存只与一次喂入的数据量有关。
+    """
+    SKIPPED_TAGS = {"script", "style", "noscript", "template"}
+    BLOCK_TAGS = {"p", "div", "br", "hr", "li", "ul", "ol", "dl", "dt", "dd", "tr", "table", "thead", "tbody",
+                  "section", "article", "header", "footer", "nav", "aside", "main", "blockquote", "pre",
+                  "h1", "h2", "h3", "h4", "h5", "h6", "title", "figure", "figcaption", "form", "body", "html"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self._parts = []
+        self._skipped = 0
+        self._preformatted = 0
+        # 当前行之前已输出的连续换行数，最多保留一个空行
+        self._newlines = 1
+
+    def handle_starttag(self, tag, attrs):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped += 1
+        elif tag in self.BLOCK_TAGS:
+            self._newline()
+            if tag == "pre":
+                self._preformatted += 1
+
+    def handle_endtag(self, tag):
+        if tag in self.SKIPPED_TAGS:
+            self._skipped = max(self._skipped - 1, 0)
+        elif tag in self.BLOCK_TAGS:
+            if tag == "pre":
+                self._preformatted = max(self._preformatted - 1, 0)
+            self._newline()
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in self.BLOCK_TAGS:
+            self._newline()
+
+    def handle_data(self, data):
+        if self._skipped:
+            return
+        if not self._preformatted:
+            data = re.sub(r"[^\S\n]+", " ", re.sub(r"[^\S\n]*\n\s*", "\n", data))
+            if self._newlines:
+                data = data.lstrip()
+        if data:
+            self._parts.append(data)
+            self._newlines = 1 if data.endswith("\n") else 0
+
+    def _newline(self):
+        if self._newlines < 2:
+            self._parts.append("\n")
+            self._newlines += 1
+
+    def take(self):
+        """取出自上次调用以来提取的文本"""
+        text = "".join(self._parts)
+        self._parts = []
+        return text
+
+
+# 各格式的解析库较重，第一次处理对应格式的文件时才导入
+class DocumentProcessor:
+    def __init__(self, parse_cache=None, use_cache=PARSE_CACHE_ENABLED):
+        self._parse_cache = parse_cache
+        self.use_cache = use_cache or parse_cache is not None
+    
+    @property
+    def parse_cache(self):
+        """解析结果的磁盘缓存，第一次解析时才打开；不使用缓存时为None"""
+        if self._parse_cache is None and self.use_cache:
+            from parse_cache import ParseCache
+            self._parse_cache = ParseCache()
+        return self._parse_cache
+    
+    def create_splitter(self):
+        """按token预算切分的分割器；分割器带有缓冲区，处理器在多个会话间共享，每次切分单独创建"""
+        return StreamingTextSplitter(CHUNK_SIZE, CHUNK_OVERLAP, load_encoding())
+    
+    def process_file(self, file_path, stream=False):
+        """处理不同类型的文件，返回文本块列表；stream=True时返回边解析边生成文本块的迭代器"""
+        if stream:
+            return (chunk for chunk, _ in self.iter_chunks(file_path))
+        return self.process_file_with_metadata(file_path)[0]
+    
+    def process_file_with_metadata(self, file_path):
+        """处理文件，返回 (文本块列表, 元数据列表)
+
+        元数据记录文本块所在的PDF页码（从1开始）或DOCX/Markdown的章节标题，以及文本块的token数（"tokens"），
+        每页/每个章节分别切分，文本块不会跨页或跨章节。
+        """
+        # 按页或章节合并读取到的片段
+        sections = []
+        for text, metadata, new_section in self._iter_sections(file_path):
+            if sections and not new_section and sections[-1][1] == metadata:
+                sections[-1][0].append(text)
+            else:
+                sections.append(([text], metadata))
+        sections = [("".join(texts), metadata) for texts, metadata in sections]
         
         # 确保文本不为空
-        if not text or text.strip() == "":
+        if not any(text and text.strip() for text, _ in sections):
             # 如果文本为空，返回一个默认文本块
-            return ["文件内容为空"]
+            return ["文件内容为空"], [{}]
         
         # 分割文本
-        chunks = self._split_text(text)
+        chunks, metadatas = [], []
+        splitter = self.create_splitter()
+        for text, metadata in sections:
+            if not text or text.strip() == "":
+                continue
+            for chunk, tokens in splitter.split_text(text):
+                chunks.append(chunk)
+                metadatas.append(dict(metadata, tokens=tokens))
         
         # 确保返回的文本块列表不为空
         if not chunks:
-            return ["文件处理成功，但未生成文本块"]
+            return ["文件处理成功，但未生成文本块"], [{}]
         
-        return chunks
+        return chunks, metadatas
     
-    def _read_pdf(self, file_path):
-        """读取PDF文件内容"""
-        text = ""
+    def iter_chunks(self, file_path):
+        """边解析边切分，逐个生成 (文本块, 元数据)
+
+        PDF逐页、DOCX逐段读取，凑够一个块就立即生成，调用方可以在解析完成之前开始嵌入。
+        相邻页之间的文本连续切分，重叠部分跨页携带，元数据取文本块起点所在的页，并记录文本块的token数；
+        DOCX/Markdown的章节边界处不跨越。内存占用只与块大小和单页大小有关。
+        """
+        splitter = self.create_splitter()
+        produced = False
+        for text, metadata, new_section in self._iter_sections(file_path):
+            if new_section:
+                for item in splitter.flush():
+                    produced = True
+                    yield item
+            for item in splitter.feed(text, metadata):
+                produced = True
+                yield item
+        for item in splitter.flush():
+            produced = True
+            yield item
+        if not produced:
+            yield "文件内容为空", {}
+    
+    def process_files(self, file_paths, max_workers=None):
+        """在进程池中并行解析多个文件，按完成顺序生成 (文件路径, (文本块, 元数据)的可迭代对象, 错误)
+
+        每个文件的错误单独返回（成功时错误为None，失败时文本块为None），不影响其他文件；
+        解析进程崩溃时只有当时在途的文件失败，剩余文件在新的进程池中继续。调用方可以在其他文件
+        仍在解析时索引已完成的文件；在途文件数限制为进程数的INGEST_PENDING_PER_WORKER倍。
+        单个文件或单核时不启动进程池，文本块是iter_chunks的生成器，边解析边索引，解析错误在迭代时抛出。
+        """
+        file_paths = list(file_paths)
+        workers = min(max_workers or INGEST_MAX_WORKERS or os.cpu_count() or 1, len(file_paths))
+        if workers <= 1:
+            # 单个文件或单核时直接在当前进程解析，省去启动进程的开销；文本块不先收集成列表
+            for file_path in file_paths:
+                yield file_path, self.iter_chunks(file_path), None
+            return
+        
+        # 使用spawn启动解析进程，避免在Streamlit等多线程进程中fork
+        context = multiprocessing.get_context("spawn")
+        cache_path = self.parse_cache.cache_path if self.parse_cache is not None else None
+        pending = list(reversed(file_paths))
+        futures = {}
+        executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        try:
+            while pending or futures:
+                while pending and len(futures) < workers * INGEST_PENDING_PER_WORKER:
+                    file_path = pending.pop()
+                    futures[executor.submit(_parse_file, file_path, cache_path)] = file_path
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in done:
+                    file_path = futures.pop(future)
+                    try:
+                        yield file_path, future.result(), None
+                    except BrokenProcessPool as e:
+                        broken = True
+                        yield file_path, None, e
+                    except Exception as e:
+                        yield file_path, None, e
+                if broken:
+                    # 进程池损坏后在途的文件都会失败，剩余文件换一个新的进程池
+                    for future, file_path in list(futures.items()):
+                        yield file_path, None, BrokenProcessPool("解析进程意外退出")
+                    futures.clear()
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+    
+    def _iter_sections(self, file_path):
+        """逐片段读取文件，生成 (文本, 元数据, 是否开始新章节)
+
+        同样内容的文件命中解析缓存时直接读取缓存，不再解析；未命中时边解析边生成并逐批写入缓存，
+        完整解析后才登记，内存中不保留整个文件的片段。
+        """
+        cache = self.parse_cache
+        if cache is None:
+            yield from self._parse_sections(file_path)
+            return
+        file_extension = os.path.splitext(file_path)[1].lower()
+        key = cache.key(file_path, f"{file_extension}:{PARSER_VERSION}")
+        cached = cache.get(key)
+        if cached is not None:
+            from parse_cache import CacheEntryEvicted
+            served = 0
+            try:
+                for section in cached:
+                    yield section
+                    served += 1
+                return
+            except CacheEntryEvicted as e:
+                # 解析是确定性的，重新解析并跳过已经生成的片段
+                print(str(e))
+            yield from itertools.islice(self._parse_sections(file_path), served, None)
+            return
+        writer = cache.writer(key)
+        try:
+            for section in self._parse_sections(file_path):
+                writer.add(section)
+                yield section
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+    
+    def _parse_sections(self, file_path):
+        """按文件类型逐片段解析，生成 (文本, 元数据, 是否开始新章节)"""
+        file_extension = os.path.splitext(file_path)[1].lower()
+        if file_extension == ".pdf":
+            yield from self._iter_pdf_pages(file_path)
+        elif file_extension == ".docx":
+            yield from self._iter_docx_paragraphs(file_path)
+        elif file_extension == ".md":
+            yield from self._iter_markdown_sections(file_path)
+        elif file_extension == ".txt":
+            for block in self._iter_text_blocks(file_path):
+                yield block, {}, False
+        elif file_extension == ".html" or file_extension == ".htm":
+            for text in self._iter_html_text(file_path):
+                yield text, {}, False
+        else:
+            raise ValueError(f"不支持的文件类型: {file_extension}")
+    
+    def _iter_pdf_pages(self, file_path):
+        """逐页提取PDF文本，同一时间只持有一页的文本"""
+        from PyPDF2 import PdfReader
         with open(file_path, "rb") as f:
             reader = PdfReader(f)
-            for page in reader.pages:
-                text += page.extract_text() or ""
-        return text
+            for number, page in enumerate(reader.pages, start=1):
+                # 页之间补一个换行，作为跨页切分时的优先切分点
+                yield (page.extract_text() or "") + "\n", {"page": number}, False
     
     def _read_txt(self, file_path):
         """读取TXT文件内容"""
+        return "".join(self._iter_text_blocks(file_path))
+    
+    def _iter_text_blocks(self, file_path):
+        """按块读取文本文件，每块约READ_BLOCK_CHARS个字符并补齐到行尾；没有换行的超长行按块大小切开"""
         with open(file_path, "r", encoding="utf-8") as f:
-            return f.read()
+            for block in iter(lambda: f.read(READ_BLOCK_CHARS), ""):
+                if not block.endswith("\n"):
+                    block += f.readline(READ_BLOCK_CHARS)
+                yield block
     
-    def _read_docx(self, file_path):
-        """读取DOCX文件内容"""
+    def _iter_docx_paragraphs(self, file_path):
+        """逐段读取DOCX，遇到标题样式的段落时开始新章节"""
+        from docx import Document
         doc = Document(file_path)
-        text = ""
+        title = ""
         for paragraph in doc.paragraphs:
-            text += paragraph.text + "\n"
-        return text
+            style = paragraph.style.name if paragraph.style is not None else ""
+            heading = style.startswith("Heading") or style == "Title"
+            if heading:
+                title = paragraph.text.strip()
+            yield paragraph.text + "\n", {"section": title}, heading
     
-    def _read_markdown(self, file_path):
-        """读取Markdown文件内容"""
+    def _iter_markdown_sections(self, file_path):
+        """逐行读取Markdown，按 # 标题开始新章节，生成 (章节纯文本, {"section": 标题}, 是否开始新章节)
+
+        超过READ_BLOCK_CHARS的章节在代码块之外的空行处分段转换，同一章节的后续段不开始新章节；
+        超过两倍仍找不到空行时（很长的代码块或没有空行的段落）在当前行之前强制分段，代码块在分段处结束并在下一段重新开始。
+        超长的行按READ_BLOCK_CHARS分成多次读取，每段的大小都有上限。
+        """
+        import markdown
+        # 同一个文件的各段复用一个转换器
+        converter = markdown.Markdown()
+        title, lines, size = "", [], 0
+        new_section = True
+        # 当前所在代码块的开始行，不在代码块中时为None
+        fence = None
+        line_start = True
+        with open(file_path, "r", encoding="utf-8") as f:
+            for line in iter(lambda: f.readline(READ_BLOCK_CHARS), ""):
+                # 超长行的后续部分不是行首，不识别标题和代码块标记
+                starts_line, line_start = line_start, line.endswith("\n")
+                open_fence = fence
+                if starts_line and line.lstrip().startswith("```"):
+                    fence = None if fence is not None else line
+                heading = starts_line and fence is None and re.match(r"#{1,6}\s+(.*)", line)
+                if heading:
+                    if lines:
+                        yield self._markdown_to_text("".join(lines), converter), {"section": title}, new_section
+                    title, lines, size, new_section = heading.group(1).strip().rstrip("#").strip(), [], 0, True
+                elif size >= READ_BLOCK_CHARS and (fence is None and not line.strip() or
+                                                   size >= 2 * READ_BLOCK_CHARS):
+                    if open_fence is not None:
+                        lines.append("```\n" if starts_line else "\n```\n")
+                    yield self._markdown_to_text("".join(lines), converter), {"section": title}, new_section
+                    lines = [open_fence] if open_fence is not None else []
+                    size, new_section = sum(len(part) for part in lines), False
+                lines.append(line)
+                size += len(line)
+        if lines:
+            yield self._markdown_to_text("".join(lines), converter), {"section": title}, new_section
+    
+    def _markdown_to_text(self, md_text, converter=None):
+        """把Markdown转换为纯文本，解析失败时返回原始内容"""
+        import markdown
         try:
-            with open(file_path, "r", encoding="utf-8") as f:
-                md_text = f.read()
-            # 将Markdown转换为HTML
-            html = markdown.markdown(md_text)
-            # 使用BeautifulSoup提取纯文本
-            soup = BeautifulSoup(html, 'html.parser')
-            return soup.get_text()
+            html = converter.reset().convert(md_text) if converter is not None else markdown.markdown(md_text)
+            extractor = HTMLTextExtractor()
+            extractor.feed(html)
+            extractor.close()
+            return extractor.take()
         except Exception as e:
             # 如果解析失败，直接返回原始内容
             print(f"解析Markdown时出错: {e}")
-            with open(file_path, "r", encoding="utf-8") as f:
-                return f.read()
+            return md_text
     
-    def _read_html(self, file_path):
-        """读取HTML文件内容"""
+    def _read_markdown(self, file_path):
+        """读取Markdown文件的纯文本"""
+        return "".join(text for text, _, _ in self._iter_markdown_sections(file_path))
+    
+    def _iter_html_text(self, file_path):
+        """按块读取HTML并增量提取正文，不构建文档树"""
+        extractor = HTMLTextExtractor()
+        produced = False
         try:
             with open(file_path, "r", encoding="utf-8") as f:
-                html = f.read()
-            # 使用BeautifulSoup提取纯文本
-            soup = BeautifulSoup(html, 'html.parser')
-            # 移除脚本和样式标签
-            for script in soup(['script', 'style']):
-                script.decompose()
-            # 获取文本并清理空白
-            text = ' '.join(soup.stripped_strings)
-            return text
+                for block in iter(lambda: f.read(READ_BLOCK_CHARS), ""):
+                    extractor.feed(block)
+                    text = extractor.take()
+                    if text:
+                        produced = True
+                        yield text
+            extractor.close()
+            text = extractor.take()
+            if text:
+                yield text
         except Exception as e:
             print(f"解析HTML时出错: {e}")
-            return "无法解析HTML文件"
+            if not produced:
+                yield "无法解析HTML文件"
+    
+    def _read_html(self, file_path):
+        """读取HTML文件的纯文本"""
+        return "".join(self._iter_html_text(file_path))
     
     def _split_text(self, text):
         """将文本分割成块"""
         # 如果文本为空，返回一个包含空字符串的列表，避免生成0个文本块
         if not text or text.strip() == "":
             return [" "]
-        return self.text_splitter.split_text(text)
\ No newline at end of file
+        return [chunk for chunk, _ in self.create_splitter().split_text(text)]
\ No newline at end of file
@@ -49,4 +49,119 @@ class TestDocumentProcessor:
             assert "不支持的文件类型" in str(e)
         finally:
             # 删除临时文件
-            os.unlink(temp_file_path)
\ No newline at end of file
+            os.unlink(temp_file_path)
+    
+    def process_markdown_sections_test(self):
+        """测试Markdown按标题切分，文本块元数据记录所在章节"""
+        with tempfile.NamedTemporaryFile(delete=False, suffix=".md", mode='w', encoding='utf-8') as temp_file:
+            temp_file.write("简介\n# 安装\npip install\n## 使用\n运行程序\n")
+            temp_file_path = temp_file.name
+        
+        try:
+            chunks, metadatas = self.processor.process_file_with_metadata(temp_file_path)
+            assert [metadata["section"] for metadata in metadatas] == ["", "安装", "使用"]
+            assert "运行程序" in chunks[2]
+            assert self.processor.process_file(temp_file_path) == chunks
+        finally:
+            os.unlink(temp_file_path)
+    
+    def iter_chunks_test(self):
+        """测试流式切分：块大小受限、相邻块重叠，DOCX章节边界不跨越"""
+        from config import CHUNK_SIZE
+        from docx import Document
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "doc.docx")
+            document = Document()
+            document.add_heading("第一章", level=1)
+            for i in range(60):
+                document.add_paragraph(f"第一章的第{i}个段落，包含一些用于切分的文字。")
+            document.add_heading("第二章", level=1)
+            document.add_paragraph("第二章的内容")
+            document.save(path)
+            
+            items = list(self.processor.iter_chunks(path))
+            chunks = [chunk for chunk, _ in items]
+            assert all(0 < metadata["tokens"] <= CHUNK_SIZE for _, metadata in items)
+            assert chunks[1][:20] in chunks[0]
+            assert [metadata["section"] for _, metadata in items][-2:] == ["第一章", "第二章"]
+            assert chunks[-1] == "第二章\n第二章的内容"
+            assert list(self.processor.process_file(path, stream=True)) == chunks
+    
+    def process_files_test(self):
+        """测试进程池并行解析多个文件，单个文件的错误不影响其他文件"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for name, content in [("a.txt", "第一个文件"), ("b.md", "# 标题\n第二个文件"), ("c.csv", "a,b")]:
+                paths.append(os.path.join(temp_dir, name))
+                with open(paths[-1], "w", encoding="utf-8") as f:
+                    f.write(content)
+            
+            results = {os.path.basename(path): (chunks, error)
+                       for path, chunks, error in self.processor.process_files(paths, max_workers=2)}
+            assert [chunk for chunk, _ in results["a.txt"][0]] == ["第一个文件"]
+            assert results["a.txt"][1] is None
+            assert [(chunk, metadata["section"]) for chunk, metadata in results["b.md"][0]] == [("标题\n\n第二个文件", "标题")]
+            assert results["c.csv"][0] is None
+            assert "不支持的文件类型" in str(results["c.csv"][1])
+            
+            # 单个文件在当前进程解析，文本块边解析边生成，不先收集成列表
+            [(path, chunks, error)] = self.processor.process_files(paths[:1])
+            assert error is None and not isinstance(chunks, list)
+            assert [chunk for chunk, _ in chunks] == ["第一个文件"]
+    
+    def streaming_readers_test(self, monkeypatch):
+        """测试TXT/HTML/Markdown按块读取：标签跨块时正文完整，跳过script/style，长章节在空行处分段"""
+        import document_processor
+        monkeypatch.setattr(document_processor, "READ_BLOCK_CHARS", 16)
+        processor = DocumentProcessor(use_cache=False)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            html_path = os.path.join(temp_dir, "page.html")
+            with open(html_path, "w", encoding="utf-8") as f:
+                f.write("<html><head><style>p {color: red}</style><script>var secret = 1;</script></head>"
+                        "<body><h1>标题</h1><p>第一段&amp;内容</p><p>第二段</p><pre>a\n  b</pre></body></html>")
+            text = processor._read_html(html_path)
+            assert "secret" not in text and "color" not in text
+            assert [line for line in text.split("\n") if line] == ["标题", "第一段&内容", "第二段", "a", "  b"]
+            
+            txt_path = os.path.join(temp_dir, "log.txt")
+            with open(txt_path, "w", encoding="utf-8") as f:
+                f.write("第一行日志内容\n" * 10)
+            blocks = list(processor._iter_text_blocks(txt_path))
+            assert len(blocks) > 1 and all(block.endswith("\n") for block in blocks)
+            assert "".join(blocks) == "第一行日志内容\n" * 10
+            
+            md_path = os.path.join(temp_dir, "notes.md")
+            with open(md_path, "w", encoding="utf-8") as f:
+                f.write("# 一\n" + "较长的段落内容。\n\n" * 6 + "```\n代码\n\n代码\n```\n# 二\n结尾\n")
+            sections = list(processor._iter_markdown_sections(md_path))
+            assert [(metadata["section"], new_section) for _, metadata, new_section in sections][0] == ("一", True)
+            assert len(sections) > 3 and not sections[1][2]
+            assert sections[-1] == ("\n二\n\n结尾\n", {"section": "二"}, True)
+            assert sum("代码" in text for text, _, _ in sections) == 1
+    
+    def unbounded_lines_test(self, monkeypatch):
+        """测试没有换行的文件和很长的代码块也按块读取，每次读取和转换的大小都有上限"""
+        import document_processor
+        monkeypatch.setattr(document_processor, "READ_BLOCK_CHARS", 16)
+        processor = DocumentProcessor(use_cache=False)
+        converted = []
+        convert = processor._markdown_to_text
+        monkeypatch.setattr(processor, "_markdown_to_text",
+                            lambda md_text, converter=None: converted.append(md_text) or convert(md_text, converter))
+        with tempfile.TemporaryDirectory() as temp_dir:
+            txt_path = os.path.join(temp_dir, "one_line.txt")
+            with open(txt_path, "w", encoding="utf-8") as f:
+                f.write("没有换行的日志" * 100)
+            blocks = list(processor._iter_text_blocks(txt_path))
+            assert len(blocks) > 10 and all(len(block) <= 32 for block in blocks)
+            assert "".join(blocks) == "没有换行的日志" * 100
+            
+            md_path = os.path.join(temp_dir, "long.md")
+            with open(md_path, "w", encoding="utf-8") as f:
+                f.write("# 标题\n" + "没有换行的段落" * 50 + "\n```python\n" + "print('代码')\n" * 30 + "```\n结尾\n")
+            sections = list(processor._iter_markdown_sections(md_path))
+            assert len(sections) > 10 and all(len(md_text) <= 64 for md_text in converted)
+            assert [metadata["section"] for _, metadata, _ in sections] == ["标题"] * len(sections)
+            text = "".join(text for text, _, _ in sections)
+            assert text.count("print('代码')") == 30 and "```" not in text
+            assert "".join(text.split()).startswith("标题" + "没有换行的段落" * 50)
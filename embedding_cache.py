@@ -0,0 +1,167 @@
+from langchain_core.embeddings import Embeddings
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import numpy as np
+from embedding_client import PartialEmbeddingError
+from config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_MAX_BYTES
+
+# SQLite单条语句允许的参数数量有限，按批查询
+LOOKUP_BATCH_SIZE = 500
+# 条数和字节数在进程内累计，每写入这么多条后重新统计一次，计入其他进程写入和淘汰的条目
+RECOUNT_INTERVAL = 10000
+
+
+class CachedEmbeddings(Embeddings):
+    """在嵌入后端前加一层磁盘缓存
+
+    以 (嵌入模型, 文本SHA-256) 为键把float32向量保存在SQLite中，
+    只有未命中的文本才会在一次批量调用中发送给后端；超过条数或字节上限时按最近使用时间淘汰。
+    """
+    def __init__(self, backend, model_name, cache_path=None, max_entries=None, max_bytes=None):
+        self.backend = backend
+        self.model_name = model_name
+        self.cache_path = cache_path or EMBEDDING_CACHE_PATH
+        self.max_entries = max_entries or EMBEDDING_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or EMBEDDING_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # Streamlit会在不同线程中调用，连接共享并用锁串行化
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "model TEXT NOT NULL, text_hash BLOB NOT NULL, vector BLOB NOT NULL, "
+            "last_access REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON embeddings (last_access)")
+        self._conn.commit()
+        # 写入时不扫描整个表，只按累计的条数和字节数判断是否需要淘汰
+        self._entries, self._bytes = self._count()
+        self._since_recount = 0
+
+    def _count(self):
+        """扫描整个表统计条数和字节数"""
+        return tuple(self._conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone())
+
+    def _hash(self, text):
+        return hashlib.sha256(text.encode("utf-8")).digest()
+
+    def _lookup(self, hashes):
+        """批量查询缓存，返回 {哈希: 向量}"""
+        found = {}
+        for start in range(0, len(hashes), LOOKUP_BATCH_SIZE):
+            batch = hashes[start:start + LOOKUP_BATCH_SIZE]
+            placeholders = ",".join("?" * len(batch))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model_name, *batch]
+            ).fetchall()
+            for text_hash, vector in rows:
+                found[bytes(text_hash)] = np.frombuffer(vector, dtype=np.float32)
+        return found
+
+    def embed_documents(self, texts):
+        """返回文本的嵌入，命中缓存的文本不会发送给后端"""
+        hashes = [self._hash(text) for text in texts]
+        with self._lock:
+            found = self._lookup(list(set(hashes)))
+
+        # 同一批中的重复文本只请求一次
+        missing = {}
+        for text, text_hash in zip(texts, hashes):
+            if text_hash not in found and text_hash not in missing:
+                missing[text_hash] = text
+        miss_count = sum(1 for text_hash in hashes if text_hash not in found)
+        self.hits += len(texts) - miss_count
+        self.misses += miss_count
+
+        if missing:
+            try:
+                vectors = self.backend.embed_documents(list(missing.values()))
+            except PartialEmbeddingError as e:
+                # 已成功的批次先写入缓存，重新导入时只需请求失败的部分
+                with self._lock:
+                    self._store({text_hash: np.asarray(vector, dtype=np.float32)
+                                 for text_hash, vector in zip(missing, e.embeddings) if vector is not None})
+                raise
+            new_entries = {}
+            for text_hash, vector in zip(missing, vectors):
+                new_entries[text_hash] = np.asarray(vector, dtype=np.float32)
+            found.update(new_entries)
+            with self._lock:
+                self._store(new_entries)
+
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE embeddings SET last_access = ? WHERE model = ? AND text_hash = ?",
+                [(now, self.model_name, text_hash) for text_hash in set(hashes) - set(missing)]
+            )
+            self._conn.commit()
+        return [found[text_hash].tolist() for text_hash in hashes]
+
+    def embed_query(self, text):
+        """查询嵌入同样走缓存"""
+        return self.embed_documents([text])[0]
+
+    def _store(self, entries):
+        """写入新向量并按上限淘汰最久未使用的条目"""
+        if not entries:
+            return
+        now = time.time()
+        rows = [(self.model_name, text_hash, vector.tobytes(), now) for text_hash, vector in entries.items()]
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, vector, last_access) VALUES (?, ?, ?, ?)", rows
+        )
+        # 只写入未命中的文本，覆盖已有条目很少见，多算只会让淘汰提前一点
+        self._entries += len(rows)
+        self._bytes += sum(len(row[2]) for row in rows)
+        self._since_recount += len(rows)
+        if self._since_recount >= RECOUNT_INTERVAL:
+            self._entries, self._bytes = self._count()
+            self._since_recount = 0
+        if self._entries > self.max_entries or self._bytes > self.max_bytes:
+            average_bytes = self._bytes / max(self._entries, 1)
+            keep = min(self.max_entries, int(self.max_bytes / average_bytes))
+            evict = max(self._entries - keep, 0)
+            # 按last_access索引只读取被淘汰的行
+            evicted_count, evicted_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM "
+                "(SELECT vector FROM embeddings ORDER BY last_access ASC LIMIT ?)", (evict,)
+            ).fetchone()
+            self._conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_access ASC LIMIT ?)",
+                (evict,)
+            )
+            self._entries -= evicted_count
+            self._bytes -= evicted_bytes
+        self._conn.commit()
+
+    def stats(self):
+        """缓存命中统计和占用情况"""
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": count,
+            "bytes": total_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings:
+    """记录调用次数的嵌入后端"""
+    def __init__(self):
+        self.calls = []
+    
+    def embed_documents(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 1.0] for text in texts]
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class TestCachedEmbeddings:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.temp_dir.name, "embeddings.db")
+        self.backend = CountingEmbeddings()
+        self.cache = CachedEmbeddings(self.backend, "test-model", cache_path=self.cache_path)
+    
+    def teardown_method(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+    
+    def only_misses_reach_backend_test(self):
+        """测试只有未命中的文本在一次批量调用中发送给后端"""
+        first = self.cache.embed_documents(["甲", "乙乙", "甲"])
+        assert self.backend.calls == [["甲", "乙乙"]]
+        assert first[0] == first[2]
+        
+        second = self.cache.embed_documents(["乙乙", "丙丙丙", "甲"])
+        assert self.backend.calls[-1] == ["丙丙丙"]
+        assert second == [[2.0, 1.0], [3.0, 1.0], [1.0, 1.0]]
+        
+        stats = self.cache.stats()
+        assert stats["hits"] == 2
+        assert stats["misses"] == 4
+        assert stats["entries"] == 3
+    
+    def persistent_and_model_scoped_test(self):
+        """测试缓存跨实例持久化，且不同嵌入模型互不命中"""
+        self.cache.embed_documents(["持久化"])
+        
+        reopened = CachedEmbeddings(self.backend, "test-model", cache_path=self.cache_path)
+        reopened.embed_documents(["持久化"])
+        assert len(self.backend.calls) == 1
+        reopened.close()
+        
+        other_model = CachedEmbeddings(self.backend, "other-model", cache_path=self.cache_path)
+        other_model.embed_documents(["持久化"])
+        assert len(self.backend.calls) == 2
+        other_model.close()
+    
+    def lru_eviction_test(self):
+        """测试超过条数上限时淘汰最久未使用的条目"""
+        small = CachedEmbeddings(self.backend, "test-model", cache_path=self.cache_path, max_entries=2)
+        small.embed_documents(["一"])
+        small.embed_documents(["二二"])
+        small.embed_documents(["一"])
+        small.embed_documents(["三三三"])
+        assert small.stats()["entries"] == 2
+        
+        self.backend.calls.clear()
+        small.embed_documents(["一", "二二"])
+        assert self.backend.calls == [["二二"]]
+        small.close()
+    
+    def no_table_scan_on_insert_test(self):
+        """测试写入时按累计的条数和字节数淘汰，不扫描整个表，累计值与实际统计一致"""
+        small = CachedEmbeddings(self.backend, "test-model", cache_path=self.cache_path, max_entries=100,
+                                 max_bytes=40)
+        statements = []
+        small._conn.set_trace_callback(statements.append)
+        for text in ["一", "二二", "三三三", "四四四四", "五五五五五", "六"]:
+            small.embed_query(text)
+        assert not [statement for statement in statements if statement.rstrip().endswith("FROM embeddings")]
+        small._conn.set_trace_callback(None)
+        assert (small._entries, small._bytes) == small._count() == (5, 40)
+        self.backend.calls.clear()
+        small.embed_documents(["六", "二二"])
+        assert self.backend.calls == []
+        small.close()
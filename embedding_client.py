@@ -0,0 +1,132 @@
+from langchain_core.embeddings import Embeddings
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import logging
+import random
+import threading
+import time
+from config import (EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS, EMBEDDING_MAX_IN_FLIGHT,
+                    EMBEDDING_MAX_RETRIES, EMBEDDING_RETRY_BACKOFF)
+
+logger = logging.getLogger(__name__)
+
+
+class PartialEmbeddingError(Exception):
+    """部分批次重试后仍然失败；embeddings中已完成的位置有向量，失败的位置为None"""
+    def __init__(self, embeddings, failures):
+        self.embeddings = embeddings
+        self.failures = failures
+        first_error = failures[0][2]
+        super().__init__(f"{len(failures)} 个嵌入批次失败，首个错误: {first_error}")
+
+
+def _is_rate_limited(error):
+    """判断是否为限流错误（HTTP 429）"""
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    return status == 429 or type(error).__name__ == "RateLimitError"
+
+
+def _retry_after(error):
+    """读取服务端返回的Retry-After秒数，没有时返回None"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class BatchedEmbeddings(Embeddings):
+    """并发、分批的嵌入客户端
+
+    把文本按条数和token数拆成多个批次，在线程池中并发请求（最多max_in_flight个同时在途），
+    每个批次独立地按指数退避重试；遇到限流时所有线程共同等待，避免继续触发429。
+    """
+    def __init__(self, backend, batch_size=None, max_batch_tokens=None, max_in_flight=None,
+                 max_retries=None, retry_backoff=None):
+        self.backend = backend
+        self.batch_size = batch_size or EMBEDDING_BATCH_SIZE
+        self.max_batch_tokens = max_batch_tokens or EMBEDDING_BATCH_MAX_TOKENS
+        self.max_in_flight = max_in_flight or EMBEDDING_MAX_IN_FLIGHT
+        self.max_retries = EMBEDDING_MAX_RETRIES if max_retries is None else max_retries
+        self.retry_backoff = EMBEDDING_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self._encoding = None
+        # 限流后所有批次都要等到该时间点之后再发送
+        self._cooldown_until = 0.0
+        self._cooldown_lock = threading.Lock()
+
+    def _count_tokens(self, text):
+        """估算文本的token数，tiktoken不可用时按字符数估算"""
+        if self._encoding is None:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception:
+                self._encoding = False
+        if self._encoding:
+            return len(self._encoding.encode(text, disallowed_special=()))
+        return len(text)
+
+    def _make_batches(self, texts):
+        """按条数和token数上限切分，返回 (起始下标, 结束下标) 列表"""
+        batches = []
+        start = 0
+        tokens = 0
+        for i, text in enumerate(texts):
+            text_tokens = self._count_tokens(text)
+            if i > start and (i - start >= self.batch_size or tokens + text_tokens > self.max_batch_tokens):
+                batches.append((start, i))
+                start = i
+                tokens = 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, len(texts)))
+        return batches
+
+    def _wait_for_cooldown(self):
+        delay = self._cooldown_until - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def _call_with_retry(self, func, *args):
+        """调用后端，失败时按指数退避重试；限流时优先使用服务端给出的等待时间"""
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_cooldown()
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * (1 + random.random() * 0.25)
+                if _is_rate_limited(e):
+                    delay = _retry_after(e) or delay
+                    with self._cooldown_lock:
+                        self._cooldown_until = max(self._cooldown_until, time.monotonic() + delay)
+                logger.warning(f"嵌入请求失败 (第 {attempt + 1}/{self.max_retries + 1} 次)，{delay:.1f}秒后重试: {str(e)}")
+                time.sleep(delay)
+
+    def embed_documents(self, texts):
+        """分批并发嵌入；部分批次最终失败时抛出PartialEmbeddingError，其中保留已完成的结果"""
+        texts = list(texts)
+        batches = self._make_batches(texts)
+        if len(batches) <= 1:
+            return self._call_with_retry(self.backend.embed_documents, texts) if texts else []
+
+        embeddings = [None] * len(texts)
+        failures = []
+        with ThreadPoolExecutor(max_workers=min(self.max_in_flight, len(batches))) as pool:
+            futures = {
+                pool.submit(self._call_with_retry, self.backend.embed_documents, texts[start:end]): (start, end)
+                for start, end in batches
+            }
+            for future in as_completed(futures):
+                start, end = futures[future]
+                try:
+                    embeddings[start:end] = future.result()
+                except Exception as e:
+                    failures.append((start, end, e))
+
+        if failures:
+            raise PartialEmbeddingError(embeddings, sorted(failures, key=lambda failure: failure[0]))
+        return embeddings
+
+    def embed_query(self, text):
+        return self._call_with_retry(self.backend.embed_query, text)
@@ -0,0 +1,121 @@
+import os
+import tempfile
+import threading
+import time
+from embedding_cache import CachedEmbeddings
+from embedding_client import BatchedEmbeddings, PartialEmbeddingError
+from vector_store import VectorStore
+
+
+class FlakyEmbeddings:
+    """可配置失败次数、带延迟的嵌入后端"""
+    def __init__(self, failures=None, delay=0.0):
+        # {批次第一个文本: 剩余失败次数}
+        self.failures = dict(failures or {})
+        self.delay = delay
+        self.calls = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+    
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            with self._lock:
+                if self.failures.get(texts[0], 0) > 0:
+                    self.failures[texts[0]] -= 1
+                    raise RuntimeError(f"模拟失败: {texts[0]}")
+            return [[float(len(text)), 1.0] for text in texts]
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+    
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+class TestBatchedEmbeddings:
+    def batches_run_concurrently_test(self):
+        """测试按条数切分批次，并在限定的并发数内同时请求"""
+        backend = FlakyEmbeddings(delay=0.05)
+        client = BatchedEmbeddings(backend, batch_size=2, max_in_flight=3, retry_backoff=0)
+        texts = [f"文本{i}" * (i + 1) for i in range(12)]
+        
+        started = time.perf_counter()
+        result = client.embed_documents(texts)
+        elapsed = time.perf_counter() - started
+        
+        assert result == [[float(len(text)), 1.0] for text in texts]
+        assert all(len(batch) <= 2 for batch in backend.calls)
+        assert backend.max_in_flight == 3
+        # 6个批次、并发3，约两轮往返时间
+        assert elapsed < 6 * 0.05
+    
+    def token_budget_splits_batches_test(self):
+        """测试token数上限也会切分批次"""
+        client = BatchedEmbeddings(FlakyEmbeddings(), batch_size=100, max_batch_tokens=10)
+        client._count_tokens = len
+        assert client._make_batches(["aaaa", "bbbb", "cccc", "d"]) == [(0, 2), (2, 4)]
+    
+    def failed_batch_retried_alone_test(self):
+        """测试失败的批次单独重试，其他批次不受影响"""
+        backend = FlakyEmbeddings(failures={"c": 2})
+        client = BatchedEmbeddings(backend, batch_size=2, max_retries=2, retry_backoff=0)
+        result = client.embed_documents(["a", "b", "c", "d", "e"])
+        
+        assert len(result) == 5
+        assert backend.calls.count(["c", "d"]) == 3
+        assert backend.calls.count(["a", "b"]) == 1
+    
+    def partial_results_cached_test(self):
+        """测试重试耗尽时保留已完成批次，缓存后重新导入只请求失败的部分"""
+        backend = FlakyEmbeddings(failures={"c": 10})
+        client = BatchedEmbeddings(backend, batch_size=2, max_retries=1, retry_backoff=0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = CachedEmbeddings(client, "test-model", cache_path=os.path.join(temp_dir, "cache.db"))
+            try:
+                cache.embed_documents(["a", "b", "c", "d", "e"])
+                assert False, "应当抛出PartialEmbeddingError"
+            except PartialEmbeddingError as e:
+                assert e.embeddings[0] is not None
+                assert e.embeddings[2] is None
+                assert [(start, end) for start, end, _ in e.failures] == [(2, 4)]
+            
+            backend.failures.clear()
+            backend.calls.clear()
+            cache.embed_documents(["a", "b", "c", "d", "e"])
+            assert backend.calls == [["c", "d"]]
+            cache.close()
+    
+    def partial_failure_keeps_real_store_test(self):
+        """测试写入时部分批次失败不会切换到MockEmbeddings，重新导入只请求失败的批次，成功的向量保留"""
+        backend = FlakyEmbeddings(failures={"ccc": 10})
+        client = BatchedEmbeddings(backend, batch_size=2, max_retries=1, retry_backoff=0)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = CachedEmbeddings(client, "test-model", cache_path=os.path.join(temp_dir, "cache.db"))
+            store = VectorStore(use_mock=False, persist_directory=os.path.join(temp_dir, "store"))
+            store.embeddings = cache
+            texts = ["a", "bb", "ccc", "dddd", "eeeee"]
+            try:
+                store.add_texts(texts)
+                assert False, "应当抛出PartialEmbeddingError"
+            except PartialEmbeddingError:
+                pass
+            assert store.embeddings is cache
+            assert store.stats()["live"] == 0
+            
+            backend.failures.clear()
+            backend.calls.clear()
+            store.add_texts(texts)
+            assert backend.calls == [["ccc", "dddd"]]
+            assert store._embeddings_type() == "real"
+            # 存储的是后端返回的 [文本长度, 1] 向量，不是Mock向量
+            result = store.similarity_search_batch(["a"], k=5)[0]
+            assert result["texts"][0] == "a" and result["scores"][0] > 0.999
+            assert sorted(result["texts"]) == texts
+            cache.close()
+            store.close()
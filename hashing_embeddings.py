@@ -0,0 +1,106 @@
+"""确定性的本地哈希嵌入，不依赖网络，可用于离线回退、测试和基准测试
+
+特征为分词后的词项（中文相邻两字、英文单词）以及英文单词的字符三元组。每个特征的
+64位哈希决定它投影到的若干个维度和符号（稀疏随机投影），整批文本用NumPy一次累加成稠密矩阵。
+同一文本在任何进程中得到相同的向量，查询与包含相同词项的文档向量相似。
+"""
+from collections import Counter
+import math
+import zlib
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from lexical_index import tokenize, CJK_PATTERN
+
+# 英文单词的字符n-gram长度
+CHAR_NGRAM = 3
+# 计算IDF时的哈希桶数量
+IDF_BUCKETS = 1 << 20
+
+
+def _mix(values):
+    """splitmix64混合函数，把哈希值打散到全部64位（uint64乘法按模2^64回绕）"""
+    values = values.copy()
+    values ^= values >> np.uint64(30)
+    values *= np.uint64(0xBF58476D1CE4E5B9)
+    values ^= values >> np.uint64(27)
+    values *= np.uint64(0x94D049BB133111EB)
+    values ^= values >> np.uint64(31)
+    return values
+
+
+class HashingEmbeddings(Embeddings):
+    """特征哈希嵌入：子线性词频加权，可选IDF加权，稀疏特征投影到dim维稠密向量并归一化"""
+    def __init__(self, dim=1536, projections=2, char_ngrams=True):
+        self.dim = dim
+        # 每个特征投影到的维度数，大于1时可以减轻哈希冲突的影响
+        self.projections = projections
+        self.char_ngrams = char_ngrams
+        # IDF权重（按哈希桶），调用fit()之前不使用IDF
+        self.idf = None
+
+    @property
+    def embedding_dim(self):
+        return self.dim
+
+    def _features(self, text):
+        """提取文本的特征：词项，以及长度超过n-gram的英文单词的字符n-gram"""
+        features = []
+        for token in tokenize(text):
+            features.append(token)
+            if self.char_ngrams and len(token) > CHAR_NGRAM and not CJK_PATTERN.match(token):
+                padded = f"<{token}>"
+                features.extend("#" + padded[i:i + CHAR_NGRAM] for i in range(len(padded) - CHAR_NGRAM + 1))
+        return features
+
+    def _hash_features(self, texts):
+        """返回整批文本的 (行号, 特征哈希, 词频) 数组，同一批中重复的特征只计算一次哈希"""
+        cache = {}
+        rows, hashes, counts = [], [], []
+        for row, text in enumerate(texts):
+            for feature, count in Counter(self._features(text)).items():
+                feature_hash = cache.get(feature)
+                if feature_hash is None:
+                    feature_hash = cache[feature] = zlib.crc32(feature.encode("utf-8"))
+                rows.append(row)
+                hashes.append(feature_hash)
+                counts.append(count)
+        return (np.array(rows, dtype=np.int64), np.array(hashes, dtype=np.uint64),
+                np.array(counts, dtype=np.float32))
+
+    def fit(self, texts):
+        """根据语料的文档频率计算IDF权重，之后生成的向量都使用这组权重"""
+        rows, hashes, _ = self._hash_features(texts)
+        buckets = (hashes % np.uint64(IDF_BUCKETS)).astype(np.int64)
+        # 同一文档中的同一个桶只计一次
+        pairs = np.unique(rows * IDF_BUCKETS + buckets)
+        document_frequency = np.bincount(pairs % IDF_BUCKETS, minlength=IDF_BUCKETS)
+        self.idf = (np.log((1 + len(texts)) / (1 + document_frequency)) + 1).astype(np.float32)
+        return self
+
+    def embed_array(self, texts):
+        """把一批文本嵌入为 (文本数, dim) 的float32矩阵，每行已归一化"""
+        texts = list(texts)
+        if not texts:
+            return np.empty((0, self.dim), dtype=np.float32)
+        rows, hashes, counts = self._hash_features(texts)
+        weights = 1 + np.log(counts)
+        if self.idf is not None:
+            weights *= self.idf[(hashes % np.uint64(IDF_BUCKETS)).astype(np.int64)]
+
+        matrix = np.zeros(len(texts) * self.dim, dtype=np.float64)
+        scale = 1 / math.sqrt(self.projections)
+        for projection in range(self.projections):
+            mixed = _mix(hashes + np.uint64(projection) * np.uint64(0x9E3779B97F4A7C15))
+            columns = (mixed % np.uint64(self.dim)).astype(np.int64)
+            signs = np.where(mixed >> np.uint64(63), -scale, scale)
+            matrix += np.bincount(rows * self.dim + columns, weights=weights * signs, minlength=len(matrix))
+        matrix = matrix.reshape(len(texts), self.dim).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def embed_documents(self, texts):
+        return self.embed_array(texts).tolist()
+
+    def embed_query(self, text):
+        return self.embed_array([text])[0].tolist()
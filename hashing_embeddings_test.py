@@ -0,0 +1,38 @@
+import numpy as np
+from hashing_embeddings import HashingEmbeddings
+
+
+class TestHashingEmbeddings:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.embeddings = HashingEmbeddings(dim=256)
+        self.documents = [
+            "向量数据库支持近似最近邻检索",
+            "The quick brown fox jumps over the lazy dog",
+            "知识库问答系统使用关键词检索",
+            "今天天气很好"
+        ]
+    
+    def deterministic_test(self):
+        """测试同一文本在不同实例中得到相同的归一化向量"""
+        first = np.array(self.embeddings.embed_documents(self.documents))
+        second = HashingEmbeddings(dim=256).embed_array(self.documents)
+        assert first.shape == (4, 256)
+        assert np.allclose(first, second)
+        assert np.allclose(np.linalg.norm(first, axis=1), 1.0, atol=1e-5)
+        assert self.embeddings.embed_array([]).shape == (0, 256)
+    
+    def related_texts_are_similar_test(self):
+        """测试查询与包含相同词项（或相近英文词形）的文档最相似"""
+        matrix = self.embeddings.embed_array(self.documents)
+        assert np.argmax(matrix @ np.array(self.embeddings.embed_query("最近邻检索"))) == 0
+        assert np.argmax(matrix @ np.array(self.embeddings.embed_query("foxes jumping"))) == 1
+        assert np.argmax(matrix @ np.array(self.embeddings.embed_query("天气"))) == 3
+    
+    def idf_weighting_test(self):
+        """测试IDF加权降低常见词项的影响"""
+        corpus = ["系统 苹果", "系统 香蕉", "系统 橘子", "系统 葡萄"]
+        plain = self.embeddings.embed_array(corpus)
+        weighted = HashingEmbeddings(dim=256).fit(corpus).embed_array(corpus)
+        # 只共享常见词项“系统”的两段文本，加权后相似度下降
+        assert weighted[0] @ weighted[1] < plain[0] @ plain[1]
@@ -0,0 +1,190 @@
+"""BM25词法检索：中英文分词、增量倒排索引和倒数排名融合
+
+倒排索引由若干段组成，每段以压缩行（CSR）数组保存：排序后的词项哈希（64位，冲突概率可忽略）、
+每个词项倒排列表的起止位置，以及按词项排序的行号和词频数组，不为每个词项保留Python对象。每次加入一批行生成一个新段，相近大小的段合并（类似二进制计数），
+段数保持在对数级别。查询只访问查询词项的倒排列表，代价与语料规模基本无关。
+"""
+from collections import Counter
+import hashlib
+import math
+import re
+import numpy as np
+
+# 中日韩统一表意文字（含扩展A区和兼容区）
+CJK_RANGES = "\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff"
+CJK_PATTERN = re.compile(f"[{CJK_RANGES}]")
+TOKEN_PATTERN = re.compile(f"[{CJK_RANGES}]+|[^\\W{CJK_RANGES}_]+")
+# 超过该长度的英文/数字词项截断，避免个别超长字符串撑大词表
+MAX_TOKEN_LENGTH = 32
+
+
+def tokenize(text):
+    """分词：中文按相邻两字切分（单字成段时保留单字），其他文字按字母数字串切分并转小写"""
+    tokens = []
+    for match in TOKEN_PATTERN.finditer(text.lower()):
+        run = match.group()
+        if CJK_PATTERN.match(run):
+            if len(run) == 1:
+                tokens.append(run)
+            else:
+                tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run[:MAX_TOKEN_LENGTH])
+    return tokens
+
+
+def term_hash(term):
+    """词项的稳定64位哈希，跨进程一致，可以持久化"""
+    return int.from_bytes(hashlib.blake2b(term.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """倒数排名融合：每个结果的得分为各排名列表中 1/(k+名次) 之和，返回按融合得分降序的结果"""
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            item = int(item)
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda item: -scores[item])
+
+
+def _pack(keys, rows, freqs):
+    """把 (词项哈希, 行号, 词频) 条目按哈希稳定排序，打包成段 (词项哈希, offsets, rows, freqs)"""
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    boundaries = np.flatnonzero(keys[1:] != keys[:-1]) + 1
+    starts = np.concatenate([[0], boundaries]) if len(keys) else np.empty(0, dtype=np.int64)
+    offsets = np.concatenate([starts, [len(keys)]]).astype(np.int64)
+    return keys[starts], offsets, rows[order], freqs[order]
+
+
+def _merge_segments(segments, live=None):
+    """合并多个段（按行号先后排列）；传入live时去掉已删除的行并把行号重新编号"""
+    keys = np.concatenate([np.empty(0, dtype=np.uint64)] +
+                          [np.repeat(terms, np.diff(offsets)) for terms, offsets, _, _ in segments])
+    rows = np.concatenate([np.empty(0, dtype=np.int32)] + [segment[2] for segment in segments])
+    freqs = np.concatenate([np.empty(0, dtype=np.int32)] + [segment[3] for segment in segments])
+    if live is not None:
+        keep = live[rows]
+        keys, rows, freqs = keys[keep], (np.cumsum(live) - 1)[rows[keep]].astype(np.int32), freqs[keep]
+    # 稳定排序：同一词项内较早的段在前，行号保持升序
+    return _pack(keys, rows, freqs)
+
+
+class BM25Index:
+    """增量BM25倒排索引，行号与向量存储中的行一一对应"""
+    K1 = 1.5
+    B = 0.75
+    # 文档长度数组首次分配的最小行数，之后按倍数扩容
+    MIN_CAPACITY = 1024
+
+    def __init__(self):
+        # 段列表整体替换，检索线程总能看到一致的段集合；倒排列表中的行号以int32保存
+        self._segments = []
+        # 每行的词项数，只有前 self.count 个有效
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self.count = 0
+        self._total_length = 0
+
+    def add(self, texts):
+        """按行号顺序加入新行，生成一个新段"""
+        if not texts:
+            return
+        vocabulary = {}
+        term_ids, rows, freqs, lengths = [], [], [], []
+        for row, text in enumerate(texts, start=self.count):
+            counts = Counter(tokenize(text))
+            term_ids.extend(vocabulary.setdefault(term, len(vocabulary)) for term in counts)
+            rows.extend([row] * len(counts))
+            freqs.extend(counts.values())
+            lengths.append(sum(counts.values()))
+        hashes = np.array([term_hash(term) for term in vocabulary], dtype=np.uint64)
+        segment = _pack(hashes[np.array(term_ids, dtype=np.int64)], np.array(rows, dtype=np.int32),
+                        np.array(freqs, dtype=np.int32))
+
+        needed = self.count + len(texts)
+        if needed > len(self._lengths):
+            grown = np.zeros(max(needed, 2 * len(self._lengths), self.MIN_CAPACITY), dtype=np.int32)
+            grown[:self.count] = self._lengths[:self.count]
+            self._lengths = grown
+        self._lengths[self.count:needed] = lengths
+        self._total_length += sum(lengths)
+
+        if len(segment[2]) == 0:
+            self.count = needed
+            return
+        # 新段不小于前一段的一半时合并，段的大小从旧到新大致按倍数递减
+        segments = self._segments + [segment]
+        while len(segments) > 1 and 2 * len(segments[-1][2]) >= len(segments[-2][2]):
+            segments[-2:] = [_merge_segments(segments[-2:])]
+        self._segments = segments
+        self.count = needed
+
+    def _postings(self, term, segments):
+        """返回词项在各段中的全部 (行号, 词频)"""
+        key = np.uint64(term_hash(term))
+        rows, freqs = [], []
+        for terms, offsets, segment_rows, segment_freqs in segments:
+            index = np.searchsorted(terms, key)
+            if index < len(terms) and terms[index] == key:
+                start, end = offsets[index], offsets[index + 1]
+                rows.append(segment_rows[start:end])
+                freqs.append(segment_freqs[start:end])
+        if not rows:
+            return None, None
+        if len(rows) == 1:
+            return rows[0], freqs[0]
+        return np.concatenate(rows), np.concatenate(freqs)
+
+    def search(self, query, k, deleted=None):
+        """返回BM25得分最高的k个 (行号数组, 得分数组)，deleted为行删除标记"""
+        n = self.count
+        if n == 0 or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        segments = self._segments
+        average_length = self._total_length / n or 1.0
+        lengths = self._lengths
+        row_parts, score_parts = [], []
+        for term in set(tokenize(query)):
+            rows, freqs = self._postings(term, segments)
+            if rows is None:
+                continue
+            idf = math.log(1 + (n - len(rows) + 0.5) / (len(rows) + 0.5))
+            norm = self.K1 * (1 - self.B + self.B * lengths[rows] / average_length)
+            row_parts.append(rows)
+            score_parts.append(idf * freqs * (self.K1 + 1) / (freqs + norm))
+        if not row_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        rows, inverse = np.unique(np.concatenate(row_parts), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(score_parts))
+        if deleted is not None:
+            inside = rows < len(deleted)
+            keep = np.ones(len(rows), dtype=bool)
+            keep[inside] = ~deleted[rows[inside]]
+            rows, scores = rows[keep], scores[keep]
+        k = min(k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k] if k < len(rows) else np.arange(len(rows))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        return rows[top].astype(np.int64), scores[top].astype(np.float32)
+
+    def to_arrays(self, live=None):
+        """把全部段合并为一个段的数组；传入live时去掉已删除的行并把行号重新编号"""
+        terms, offsets, rows, freqs = _merge_segments(self._segments, live)
+        lengths = self._lengths[:self.count]
+        if live is not None:
+            lengths = lengths[live]
+        return {
+            "terms": terms,
+            "offsets": offsets,
+            "rows": rows,
+            "freqs": freqs,
+            "lengths": np.ascontiguousarray(lengths, dtype=np.int32)
+        }
+
+    def load_arrays(self, arrays):
+        terms = arrays["terms"]
+        self._segments = [(terms, arrays["offsets"], arrays["rows"], arrays["freqs"])] if len(terms) else []
+        self._lengths = np.array(arrays["lengths"], dtype=np.int32)
+        self.count = len(self._lengths)
+        self._total_length = int(self._lengths.sum())
@@ -0,0 +1,50 @@
+import numpy as np
+from lexical_index import BM25Index, reciprocal_rank_fusion, tokenize
+
+
+class TestLexicalIndex:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.index = BM25Index()
+        self.index.add([
+            "向量数据库支持近似最近邻检索",
+            "The quick brown fox jumps over the lazy dog",
+            "知识库问答系统使用向量检索和关键词检索",
+            "今天天气很好"
+        ])
+    
+    def tokenize_test(self):
+        """测试中文按两字切分、英文按单词切分并转小写"""
+        assert tokenize("人工智能AI的Hello, World") == ["人工", "工智", "智能", "ai", "的", "hello", "world"]
+        assert tokenize("") == []
+    
+    def search_test(self):
+        """测试BM25检索只返回包含查询词项的行，并按得分排序"""
+        rows, scores = self.index.search("关键词检索", k=4)
+        assert rows.tolist()[0] == 2
+        assert set(rows.tolist()) == {0, 2}
+        assert scores[0] > scores[1]
+        assert self.index.search("QUICK fox", k=4)[0].tolist() == [1]
+        assert len(self.index.search("完全无关", k=4)[0]) == 0
+        
+        deleted = np.array([False, False, True, False])
+        assert self.index.search("关键词检索", k=4, deleted=deleted)[0].tolist() == [0]
+    
+    def persistence_test(self):
+        """测试压缩保存后增量加入新行，以及去掉已删除行后行号重新编号"""
+        restored = BM25Index()
+        restored.load_arrays(self.index.to_arrays())
+        restored.add(["狐狸 fox"])
+        assert restored.search("fox", k=4)[0].tolist() in ([4, 1], [1, 4])
+        assert len(restored.search("fox", k=4)[0]) == 2
+        
+        live = np.array([True, False, True, True, True])
+        compacted = BM25Index()
+        compacted.load_arrays(restored.to_arrays(live))
+        assert compacted.count == 4
+        assert compacted.search("fox", k=4)[0].tolist() == [3]
+        assert compacted.search("天气", k=4)[0].tolist() == [2]
+    
+    def reciprocal_rank_fusion_test(self):
+        """测试在两个排名中都靠前的结果融合后排在最前"""
+        assert reciprocal_rank_fusion([[1, 2, 3], [3, 1, 4]]) == [1, 3, 2, 4]
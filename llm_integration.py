@@ -1,5 +1,3 @@
-from openai import OpenAI
-from openai import APITimeoutError, APIError
 import os
 import time
 import logging
@@ -18,23 +16,36 @@ class LLMIntegration:
         """初始化LLM集成"""
         self.use_fallback = use_fallback
         self.openai_api_key = os.getenv("OPENAI_API_KEY")
-        
-        # 只有当API密钥存在时才初始化OpenAI客户端
-        if self.openai_api_key:
-            try:
-                # 使用DeepSeek API配置
-                self.client = OpenAI(
-                    api_key=self.openai_api_key,
-                    base_url=BASE_URL,
-                    timeout=30  # 设置30秒超时
-                )
-                logger.info(f"DeepSeek客户端初始化成功，base_url: {BASE_URL}")
-            except Exception as e:
-                logger.error(f"DeepSeek客户端初始化失败: {str(e)}")
-                self.client = None
-        else:
+        # openai库导入较慢，客户端在第一次生成答案时才创建
+        self._client = None
+        self._client_initialized = False
+        if not self.openai_api_key:
             logger.warning("未设置OPENAI_API_KEY，将使用本地回退机制")
-            self.client = None
+    
+    @property
+    def client(self):
+        """DeepSeek客户端；只有当API密钥存在时才初始化，初始化失败时为None"""
+        if not self._client_initialized:
+            self._client_initialized = True
+            if self.openai_api_key:
+                try:
+                    from openai import OpenAI
+                    # 使用DeepSeek API配置
+                    self._client = OpenAI(
+                        api_key=self.openai_api_key,
+                        base_url=BASE_URL,
+                        timeout=30  # 设置30秒超时
+                    )
+                    logger.info(f"DeepSeek客户端初始化成功，base_url: {BASE_URL}")
+                except Exception as e:
+                    logger.error(f"DeepSeek客户端初始化失败: {str(e)}")
+                    self._client = None
+        return self._client
+    
+    @client.setter
+    def client(self, client):
+        self._client = client
+        self._client_initialized = True
     
     def generate_answer(self, query, context, chat_history=None, max_retries=None):
         """根据查询、上下文和对话历史生成答案，支持重试机制和多轮对话"""
@@ -47,6 +58,7 @@ class LLMIntegration:
         # 如果没有DeepSeek客户端，使用回退机制
         if not self.client and self.use_fallback:
             return self._fallback_generate_answer(query, context, chat_history)
+        from openai import APITimeoutError, APIError
         
         # 尝试调用DeepSeek API，支持重试
         for attempt in range(retry_count + 1):
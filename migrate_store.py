@@ -0,0 +1,49 @@
+"""在向量存储后端之间迁移数据
+
+用法：
+    python migrate_store.py --source numpy --target chroma
+    python migrate_store.py --source chroma --target numpy --source-path ./chroma_store --target-path ./vector_store
+
+文本块按原块ID连同向量和元数据复制，不重新调用嵌入API；文档登记表一并复制，
+迁移后已索引的文件不会被重新索引。目标存储必须为空。迁移完成后修改config.py中的VECTOR_BACKEND即可切换。
+"""
+import argparse
+import os
+import sys
+import time
+
+# 添加当前目录到Python路径
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from vector_store import create_vector_store, BACKEND_PATHS
+from vector_backends import migrate_store
+
+
+def main():
+    parser = argparse.ArgumentParser(description="在向量存储后端之间迁移数据")
+    parser.add_argument("--source", required=True, choices=sorted(BACKEND_PATHS))
+    parser.add_argument("--target", required=True, choices=sorted(BACKEND_PATHS))
+    parser.add_argument("--source-path", help="源存储路径，默认使用该后端的配置路径")
+    parser.add_argument("--target-path", help="目标存储路径，默认使用该后端的配置路径")
+    parser.add_argument("--batch-size", type=int, default=10000, help="每批复制的文本块数")
+    args = parser.parse_args()
+
+    source_path = os.path.abspath(args.source_path or BACKEND_PATHS[args.source])
+    target_path = os.path.abspath(args.target_path or BACKEND_PATHS[args.target])
+    if source_path == target_path:
+        parser.error("源存储和目标存储不能是同一路径")
+
+    source = create_vector_store(args.source, persist_directory=source_path)
+    target = create_vector_store(args.target, persist_directory=target_path)
+    start = time.perf_counter()
+    try:
+        copied = migrate_store(source, target, args.batch_size)
+    finally:
+        source.close()
+        target.close()
+    print(f"已从 {args.source}（{source_path}）迁移 {copied} 个文本块和 {len(source.documents)} 个文档到 "
+          f"{args.target}（{target_path}），耗时 {time.perf_counter() - start:.1f} 秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+import zlib
+from config import PARSE_CACHE_PATH, PARSE_CACHE_MAX_BYTES
+
+# 计算文件内容哈希时每次读取的字节数
+HASH_BLOCK_BYTES = 1024 * 1024
+COMPRESSION_LEVEL = 6
+# 命中时每批从数据库读取的片段数
+READ_BATCH_SECTIONS = 64
+# 边解析边写入时每批提交的压缩字节数，写入期间只在内存中保留这一批
+WRITE_BATCH_BYTES = 1024 * 1024
+# 写入中的片段以临时的解析器名保存，进程中途退出时遗留的临时片段超过这个时间后清理
+STALE_PENDING_SECONDS = 24 * 3600
+
+
+class CacheEntryEvicted(Exception):
+    """命中的条目在分批读取途中被淘汰，已读取的片段仍然有效"""
+
+
+class ParseCache:
+    """文件解析结果的磁盘缓存
+
+    以 (文件内容SHA-256, 解析器版本) 为键，把解析出的片段序列（页、段落或章节的文本、元数据和章节边界）
+    压缩后保存在SQLite中。同样的字节不再解析，修改块大小后重新切分也只需要切分本身；
+    超过字节上限时按最近使用时间淘汰整个文件的条目。
+    """
+    def __init__(self, cache_path=None, max_bytes=None):
+        self.cache_path = cache_path or PARSE_CACHE_PATH
+        self.max_bytes = max_bytes or PARSE_CACHE_MAX_BYTES
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.cache_path)), exist_ok=True)
+        # 解析进程和Streamlit线程可能同时访问，连接在进程内共享并用锁串行化，进程之间由SQLite加锁
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.cache_path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "content_hash BLOB NOT NULL, parser TEXT NOT NULL, bytes INTEGER NOT NULL, "
+            "last_access REAL NOT NULL, PRIMARY KEY (content_hash, parser))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sections ("
+            "content_hash BLOB NOT NULL, parser TEXT NOT NULL, seq INTEGER NOT NULL, payload BLOB NOT NULL, "
+            "PRIMARY KEY (content_hash, parser, seq))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries (last_access)")
+        self._conn.commit()
+        self._remove_stale_pending()
+
+    def key(self, file_path, parser):
+        """缓存键：分块读取文件计算内容哈希，parser区分文件类型和解析器版本"""
+        digest = hashlib.sha256()
+        with open(file_path, "rb") as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_BYTES), b""):
+                digest.update(block)
+        return digest.digest(), parser
+
+    def get(self, key):
+        """命中时返回片段的迭代器（按批读取、逐个解压），未命中返回None"""
+        with self._lock:
+            found = self._conn.execute(
+                "SELECT 1 FROM entries WHERE content_hash = ? AND parser = ?", key
+            ).fetchone()
+            if found is None:
+                self.misses += 1
+                return None
+            # 先更新最近使用时间，读取期间的淘汰会优先选择其他文件
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE content_hash = ? AND parser = ?",
+                               (time.time(), *key))
+            self._conn.commit()
+            self.hits += 1
+        return self._iter_sections(key)
+
+    def _iter_sections(self, key):
+        """按seq分批读取压缩后的片段，内存中只保留一批；每批和条目是否存在在同一个读事务中检查"""
+        seq = 0
+        while True:
+            with self._lock:
+                self._conn.execute("BEGIN")
+                try:
+                    found = self._conn.execute(
+                        "SELECT 1 FROM entries WHERE content_hash = ? AND parser = ?", key
+                    ).fetchone()
+                    payloads = [row[0] for row in self._conn.execute(
+                        "SELECT payload FROM sections WHERE content_hash = ? AND parser = ? AND seq >= ? "
+                        "ORDER BY seq LIMIT ?", (*key, seq, READ_BATCH_SECTIONS)
+                    )]
+                finally:
+                    self._conn.commit()
+            if found is None:
+                raise CacheEntryEvicted(f"解析缓存的条目在读取途中被淘汰（已读取 {seq} 个片段）")
+            for payload in payloads:
+                yield tuple(json.loads(zlib.decompress(payload).decode("utf-8")))
+            seq += len(payloads)
+            if len(payloads) < READ_BATCH_SECTIONS:
+                return
+
+    def writer(self, key):
+        """边解析边写入一个文件的片段，见CacheWriter"""
+        return CacheWriter(self, key)
+
+    def put(self, key, sections):
+        """保存一个文件的全部片段并按字节上限淘汰最久未使用的文件"""
+        writer = self.writer(key)
+        try:
+            for section in sections:
+                writer.add(section)
+        except BaseException:
+            writer.abort()
+            raise
+        writer.commit()
+
+    def _remove_stale_pending(self):
+        """清理进程中途退出时遗留的临时片段"""
+        deadline = time.time() - STALE_PENDING_SECONDS
+        with self._lock:
+            stale = [row for row in self._conn.execute(
+                "SELECT DISTINCT content_hash, parser FROM sections WHERE parser LIKE '%#pending:%'"
+            ) if float(row[1].rsplit(":", 2)[1]) < deadline]
+            if stale:
+                self._conn.executemany("DELETE FROM sections WHERE content_hash = ? AND parser = ?", stale)
+                self._conn.commit()
+
+    def _evict(self):
+        total = self._conn.execute("SELECT COALESCE(SUM(bytes), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for content_hash, parser, size in self._conn.execute(
+                "SELECT content_hash, parser, bytes FROM entries ORDER BY last_access ASC"):
+            if total <= self.max_bytes:
+                break
+            evicted.append((content_hash, parser))
+            total -= size
+        self._conn.executemany("DELETE FROM entries WHERE content_hash = ? AND parser = ?", evicted)
+        self._conn.executemany("DELETE FROM sections WHERE content_hash = ? AND parser = ?", evicted)
+
+    def stats(self):
+        """缓存命中统计和占用情况"""
+        with self._lock:
+            count, total_bytes = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM entries"
+            ).fetchone()
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / requests if requests else 0.0,
+            "entries": count,
+            "bytes": total_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class CacheWriter:
+    """逐个写入一个文件的片段
+
+    片段压缩后按批写入临时的解析器名下，读取时看不到；commit在一个事务中把它们改到正式的键下并登记条目，
+    中途出错或超过字节上限时删除已写入的片段。内存中只保留一批压缩后的片段，与文件大小无关。
+    """
+    def __init__(self, cache, key):
+        self.cache = cache
+        self.key = key
+        self.pending = (key[0], f"{key[1]}#pending:{time.time():.0f}:{uuid.uuid4().hex}")
+        self.size = 0
+        self.dropped = False
+        self._seq = 0
+        self._batch = []
+        self._batch_bytes = 0
+
+    def add(self, section):
+        if self.dropped:
+            return
+        payload = zlib.compress(json.dumps(list(section), ensure_ascii=False).encode("utf-8"), COMPRESSION_LEVEL)
+        self.size += len(payload)
+        if self.size > self.cache.max_bytes:
+            self.abort()
+            return
+        self._batch.append((*self.pending, self._seq, payload))
+        self._seq += 1
+        self._batch_bytes += len(payload)
+        if self._batch_bytes >= WRITE_BATCH_BYTES:
+            self._flush()
+
+    def _flush(self):
+        if not self._batch:
+            return
+        with self.cache._lock:
+            self.cache._conn.executemany(
+                "INSERT INTO sections (content_hash, parser, seq, payload) VALUES (?, ?, ?, ?)", self._batch
+            )
+            self.cache._conn.commit()
+        self._batch = []
+        self._batch_bytes = 0
+
+    def commit(self):
+        """登记条目并按字节上限淘汰最久未使用的文件；超过上限的文件不缓存"""
+        if self.dropped:
+            return
+        conn = self.cache._conn
+        try:
+            self._flush()
+            with self.cache._lock:
+                try:
+                    conn.execute("BEGIN IMMEDIATE")
+                    conn.execute("DELETE FROM sections WHERE content_hash = ? AND parser = ?", self.key)
+                    conn.execute("UPDATE sections SET parser = ? WHERE content_hash = ? AND parser = ?",
+                                 (self.key[1], *self.pending))
+                    conn.execute(
+                        "INSERT OR REPLACE INTO entries (content_hash, parser, bytes, last_access) "
+                        "VALUES (?, ?, ?, ?)",
+                        (*self.key, self.size, time.time())
+                    )
+                    self.cache._evict()
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+        except Exception:
+            self.abort()
+            raise
+        self.dropped = True
+
+    def abort(self):
+        """放弃写入，删除已写入的临时片段"""
+        self.dropped = True
+        self._batch = []
+        with self.cache._lock:
+            self.cache._conn.execute("DELETE FROM sections WHERE content_hash = ? AND parser = ?", self.pending)
+            self.cache._conn.commit()
@@ -0,0 +1,120 @@
+import os
+import tempfile
+import pytest
+import document_processor
+import parse_cache
+from document_processor import DocumentProcessor
+from parse_cache import ParseCache
+
+
+class TestParseCache:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cache = ParseCache(os.path.join(self.temp_dir.name, "parsed.db"))
+        self.processor = DocumentProcessor(self.cache)
+        self.path = os.path.join(self.temp_dir.name, "a.md")
+        with open(self.path, "w", encoding="utf-8") as f:
+            f.write("# 第一章\n" + "第一章的内容。" * 100 + "\n# 第二章\n第二章的内容\n")
+    
+    def teardown_method(self):
+        self.cache.close()
+        self.temp_dir.cleanup()
+    
+    def skip_parsing_test(self, monkeypatch):
+        """测试同样内容的文件只解析一次，修改块大小后重新切分不再解析，解析器版本变化时重新解析"""
+        chunks, metadatas = self.processor.process_file_with_metadata(self.path)
+        assert self.cache.stats()["misses"] == 1
+        
+        def fail(self, file_path):
+            raise AssertionError("命中缓存时不应再解析")
+            yield
+        
+        monkeypatch.setattr(DocumentProcessor, "_parse_sections", fail)
+        copy = os.path.join(self.temp_dir.name, "b.md")
+        with open(self.path, "rb") as source, open(copy, "wb") as target:
+            target.write(source.read())
+        assert self.processor.process_file_with_metadata(copy) == (chunks, metadatas)
+        
+        monkeypatch.setattr(document_processor, "CHUNK_SIZE", 100)
+        monkeypatch.setattr(document_processor, "CHUNK_OVERLAP", 10)
+        rechunked = list(self.processor.iter_chunks(self.path))
+        assert len(rechunked) > len(chunks)
+        assert all(metadata["tokens"] <= 100 for _, metadata in rechunked)
+        assert self.cache.stats()["hits"] == 2
+        
+        monkeypatch.setattr(document_processor, "PARSER_VERSION", document_processor.PARSER_VERSION + 1)
+        with pytest.raises(AssertionError):
+            list(self.processor.iter_chunks(self.path))
+    
+    def lru_eviction_test(self):
+        """测试超过字节上限时淘汰最久未使用的文件"""
+        paths = []
+        for i in range(3):
+            paths.append(os.path.join(self.temp_dir.name, f"{i}.txt"))
+            with open(paths[-1], "w", encoding="utf-8") as f:
+                f.write(os.urandom(300).hex())
+        small = ParseCache(os.path.join(self.temp_dir.name, "small.db"), max_bytes=1000)
+        processor = DocumentProcessor(small)
+        processor.process_file(paths[0])
+        processor.process_file(paths[1])
+        processor.process_file(paths[0])
+        processor.process_file(paths[2])
+        assert small.stats()["entries"] == 2
+        
+        processor.process_file(paths[0])
+        processor.process_file(paths[1])
+        assert small.stats()["hits"] == 2
+        assert small.stats()["misses"] == 4
+        small.close()
+    
+    def streaming_write_test(self, monkeypatch):
+        """测试边解析边按批写入缓存：完整解析前读取不到，中途放弃或超过上限时不留下片段"""
+        monkeypatch.setattr(parse_cache, "WRITE_BATCH_BYTES", 1)
+        path = os.path.join(self.temp_dir.name, "long.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(2000):
+                f.write(f"第{i}行的内容，{os.urandom(8).hex()}\n")
+        monkeypatch.setattr(document_processor, "READ_BLOCK_CHARS", 1000)
+        key = self.cache.key(path, f".txt:{document_processor.PARSER_VERSION}")
+        
+        def section_rows(cache):
+            return cache._conn.execute("SELECT COUNT(*) FROM sections").fetchone()[0]
+        
+        sections = self.processor._iter_sections(path)
+        first = next(sections)
+        next(sections)
+        assert section_rows(self.cache) >= 1
+        assert self.cache.get(key) is None
+        sections.close()
+        assert section_rows(self.cache) == 0
+        
+        parsed = [first] + list(self.processor._iter_sections(path))[1:]
+        assert list(self.cache.get(key)) == parsed
+        
+        small = ParseCache(os.path.join(self.temp_dir.name, "small.db"), max_bytes=5000)
+        list(DocumentProcessor(small)._iter_sections(path))
+        assert small.stats()["entries"] == 0
+        assert section_rows(small) == 0
+        small.close()
+    
+    def batched_read_test(self, monkeypatch):
+        """测试命中时按批读取片段，读取途中条目被淘汰时重新解析并跳过已生成的片段"""
+        monkeypatch.setattr(parse_cache, "READ_BATCH_SECTIONS", 2)
+        monkeypatch.setattr(document_processor, "READ_BLOCK_CHARS", 100)
+        path = os.path.join(self.temp_dir.name, "long.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            for i in range(100):
+                f.write(f"第{i}行的内容\n")
+        parsed = list(self.processor._iter_sections(path))
+        assert len(parsed) > 6
+        
+        sections = self.processor._iter_sections(path)
+        served = [next(sections) for _ in range(3)]
+        other = ParseCache(self.cache.cache_path)
+        other._conn.execute("DELETE FROM entries")
+        other._conn.execute("DELETE FROM sections")
+        other._conn.commit()
+        other.close()
+        assert served + list(sections) == parsed
+        assert self.cache.stats()["hits"] == 1
@@ -0,0 +1,158 @@
+"""嵌入向量的量化压缩：int8标量量化和乘积量化（PQ）
+
+两种量化器都作用于已归一化的向量。检索时查询保持全精度，只对存储的编码
+做近似内积（非对称距离计算），候选结果可以再用磁盘上的全精度向量重新打分。
+"""
+import numpy as np
+
+# 打分和编码时每批处理的行数，避免为全部编码创建float32临时矩阵
+BATCH_ROWS = 16384
+# 训练时最多使用的样本行数
+MAX_TRAIN_SAMPLES = 65536
+
+
+def sample_rows(n, size, seed=0):
+    """随机抽取不超过size个升序行号，便于对内存映射做顺序读取"""
+    rng = np.random.default_rng(seed)
+    return np.sort(rng.choice(n, min(n, size), replace=False))
+
+
+class ScalarQuantizer:
+    """int8标量量化：每个维度独立的最小值和缩放系数，每行占用dim个字节"""
+    kind = "int8"
+
+    def __init__(self):
+        self.minimum = None
+        self.scale = None
+
+    @property
+    def trained(self):
+        return self.scale is not None
+
+    def train(self, vectors):
+        """根据样本统计每个维度的取值范围"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.minimum = vectors.min(axis=0)
+        span = vectors.max(axis=0) - self.minimum
+        span[span == 0] = 1.0
+        self.scale = (span / 255.0).astype(np.float32)
+
+    def encode(self, vectors):
+        """把向量量化为int8编码，超出训练范围的值截断"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        levels = np.rint((vectors - self.minimum) / self.scale)
+        return (np.clip(levels, 0, 255) - 128).astype(np.int8)
+
+    def score(self, query, codes):
+        """近似内积：q·x ≈ (q*scale)·(code+128) + q·minimum"""
+        weights = query * self.scale
+        bias = float(weights.sum() * 128.0 + query @ self.minimum)
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BATCH_ROWS):
+            batch = codes[start:start + BATCH_ROWS]
+            scores[start:start + len(batch)] = batch.astype(np.float32) @ weights
+        return scores + bias
+
+    def bytes_per_row(self):
+        return len(self.scale)
+
+    def to_arrays(self):
+        return {"method": np.array(self.kind), "minimum": self.minimum, "scale": self.scale}
+
+    def load_arrays(self, arrays):
+        self.minimum = arrays["minimum"]
+        self.scale = arrays["scale"]
+
+
+class ProductQuantizer:
+    """乘积量化：把向量切成m个子空间，每个子空间用256个质心之一的编号表示，每行占用m个字节"""
+    kind = "pq"
+    NUM_CENTROIDS = 256
+    KMEANS_ITERATIONS = 10
+
+    def __init__(self, num_subspaces=0):
+        self.num_subspaces = num_subspaces
+        # 码本，形状为 (m, 256, 子空间维度)
+        self.codebooks = None
+
+    @property
+    def trained(self):
+        return self.codebooks is not None
+
+    def _choose_subspaces(self, dim):
+        """未指定时每个子空间取8维；子空间数必须整除维度"""
+        m = self.num_subspaces or max(1, dim // 8)
+        while dim % m:
+            m -= 1
+        return m
+
+    def _split(self, vectors):
+        """(n, dim) -> (m, n, 子空间维度)"""
+        n = len(vectors)
+        m = len(self.codebooks) if self.trained else self.num_subspaces
+        return np.asarray(vectors, dtype=np.float32).reshape(n, m, -1).transpose(1, 0, 2)
+
+    def _nearest(self, subvectors, codebook):
+        """按L2距离找最近的质心编号"""
+        distances = (codebook ** 2).sum(axis=1) - 2 * subvectors @ codebook.T
+        return np.argmin(distances, axis=1)
+
+    def train(self, vectors, seed=0):
+        """对每个子空间分别做k-means"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.num_subspaces = self._choose_subspaces(vectors.shape[1])
+        rng = np.random.default_rng(seed)
+        centroids = min(self.NUM_CENTROIDS, len(vectors))
+
+        codebooks = []
+        for subvectors in self._split(vectors):
+            codebook = subvectors[rng.choice(len(subvectors), centroids, replace=False)].copy()
+            for _ in range(self.KMEANS_ITERATIONS):
+                labels = self._nearest(subvectors, codebook)
+                sums = np.zeros_like(codebook)
+                np.add.at(sums, labels, subvectors)
+                counts = np.bincount(labels, minlength=centroids)
+                filled = counts > 0
+                codebook[filled] = sums[filled] / counts[filled, None]
+            codebooks.append(codebook)
+        self.codebooks = np.stack(codebooks).astype(np.float32)
+
+    def encode(self, vectors):
+        codes = np.empty((len(vectors), len(self.codebooks)), dtype=np.uint8)
+        for start in range(0, len(vectors), BATCH_ROWS):
+            batch = self._split(vectors[start:start + BATCH_ROWS])
+            for j, subvectors in enumerate(batch):
+                codes[start:start + len(subvectors), j] = self._nearest(subvectors, self.codebooks[j])
+        return codes
+
+    def score(self, query, codes):
+        """非对称距离计算：先算查询与各子空间质心的内积表，再按编码查表求和"""
+        query_parts = query.reshape(len(self.codebooks), -1)
+        table = np.einsum("md,mkd->mk", query_parts, self.codebooks)
+        subspaces = np.arange(len(self.codebooks))
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), BATCH_ROWS):
+            batch = codes[start:start + BATCH_ROWS]
+            scores[start:start + len(batch)] = table[subspaces, batch].sum(axis=1)
+        return scores
+
+    def bytes_per_row(self):
+        return len(self.codebooks)
+
+    def to_arrays(self):
+        return {"method": np.array(self.kind), "codebooks": self.codebooks}
+
+    def load_arrays(self, arrays):
+        self.codebooks = arrays["codebooks"]
+        self.num_subspaces = len(self.codebooks)
+
+
+def create_quantizer(kind, num_subspaces=0):
+    """按配置创建量化器，kind为None时不使用量化"""
+    if kind is None:
+        return None
+    if kind == "int8":
+        return ScalarQuantizer()
+    if kind == "pq":
+        return ProductQuantizer(num_subspaces)
+    raise ValueError(f"不支持的量化方式: {kind}")
@@ -0,0 +1,61 @@
+"""进程内的读写锁"""
+from contextlib import contextmanager
+import threading
+
+
+class ReadWriteLock:
+    """读写锁：读者之间互不阻塞；写者等待进行中的读者结束，写者持有或等待期间新的读者等待
+
+    同一线程可以重入读锁或写锁，持有写锁的线程也可以再取得读锁。
+    写者只应在发布新状态的短时间内持有写锁，读者因此最多等待一次状态切换。
+    """
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = None
+        self._writer_depth = 0
+        self._local = threading.local()
+
+    @contextmanager
+    def read(self):
+        depth = getattr(self._local, "reads", 0)
+        if depth == 0:
+            with self._condition:
+                if self._writer != threading.get_ident():
+                    while self._writer is not None:
+                        self._condition.wait()
+                self._readers += 1
+        self._local.reads = depth + 1
+        try:
+            yield
+        finally:
+            self._local.reads = depth
+            if depth == 0:
+                with self._condition:
+                    self._readers -= 1
+                    if self._readers == 0:
+                        self._condition.notify_all()
+
+    @contextmanager
+    def write(self):
+        me = threading.get_ident()
+        with self._condition:
+            if self._writer == me:
+                self._writer_depth += 1
+            else:
+                while self._writer is not None:
+                    self._condition.wait()
+                self._writer = me
+                # 本线程持有的读锁不计入等待的读者
+                own_reads = 1 if getattr(self._local, "reads", 0) else 0
+                while self._readers > own_reads:
+                    self._condition.wait()
+                self._writer_depth = 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer_depth -= 1
+                if self._writer_depth == 0:
+                    self._writer = None
+                    self._condition.notify_all()
@@ -0,0 +1,99 @@
+"""多进程分片精确检索
+
+基础向量文件按行划分为若干连续分片，每个分片固定由一个常驻工作进程负责：工作进程用np.memmap
+只读映射自己的那一段文件（通过操作系统页缓存共享，不随请求传输向量），对查询打分并返回
+分片内的前k个结果，父进程再合并各分片的结果。每个请求只需传输查询向量和少量参数。
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+import numpy as np
+
+# 工作进程中BLAS只用单线程，多个分片进程并行时不会争抢CPU
+WORKER_THREAD_VARIABLES = ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS")
+# 工作进程中每个查询块得分矩阵的最大元素数
+SHARD_SCORE_ELEMENTS = 1 << 22
+
+# 工作进程中已映射的分片：(文件路径, 起始行, 结束行) -> memmap
+_mapped_shards = {}
+
+
+def top_k_matrix(scores, k):
+    """逐行选出得分最高的k列，返回按得分降序的 (列下标, 得分) 两个矩阵"""
+    n = scores.shape[1]
+    k = min(k, n)
+    if k <= 0:
+        return np.empty((len(scores), 0), dtype=np.int64), np.empty((len(scores), 0), dtype=np.float32)
+    if k < n:
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(n), scores.shape)
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    order = np.argsort(-top_scores, axis=1, kind="stable")
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _search_shard(path, dim, start, stop, queries, k, deleted):
+    """在工作进程中对一个分片打分，返回分片内前k个 (全局行号, 得分)；deleted为分片内已删除的行号"""
+    key = (path, start, stop)
+    shard = _mapped_shards.get(key)
+    if shard is None:
+        # 合并生成新一代文件后旧的映射不再使用
+        _mapped_shards.clear()
+        shard = _mapped_shards[key] = np.memmap(path, dtype=np.float32, mode="r",
+                                                offset=start * dim * 4, shape=(stop - start, dim))
+    step = max(1, SHARD_SCORE_ELEMENTS // max(1, len(shard)))
+    row_blocks, score_blocks = [], []
+    for position in range(0, len(queries), step):
+        scores = queries[position:position + step] @ shard.T
+        if deleted is not None:
+            scores[:, deleted] = -np.inf
+        rows, top_scores = top_k_matrix(scores, k)
+        row_blocks.append(rows + start)
+        score_blocks.append(top_scores)
+    return np.concatenate(row_blocks), np.concatenate(score_blocks)
+
+
+class ShardedSearcher:
+    """常驻的分片检索进程池，第i个分片总是交给第i个工作进程"""
+    def __init__(self, shards):
+        self.shards = shards
+        context = multiprocessing.get_context("spawn")
+        saved = {name: os.environ.get(name) for name in WORKER_THREAD_VARIABLES}
+        os.environ.update({name: "1" for name in WORKER_THREAD_VARIABLES})
+        try:
+            self._executors = [ProcessPoolExecutor(max_workers=1, mp_context=context) for _ in range(shards)]
+            # 工作进程在提交第一个任务时才启动，在这里启动以继承单线程设置
+            for future in [executor.submit(_warm_up) for executor in self._executors]:
+                future.result()
+        finally:
+            for name, value in saved.items():
+                if value is None:
+                    os.environ.pop(name, None)
+                else:
+                    os.environ[name] = value
+
+    def search(self, path, dim, count, queries, k, deleted_rows=None):
+        """对文件前count行做精确检索，返回每个查询前k个 (行号矩阵, 得分矩阵)，不足k个时以-inf补齐"""
+        bounds = np.linspace(0, count, self.shards + 1).astype(np.int64)
+        futures = []
+        for executor, start, stop in zip(self._executors, bounds[:-1], bounds[1:]):
+            if start == stop:
+                continue
+            deleted = None
+            if deleted_rows is not None:
+                deleted = deleted_rows[(deleted_rows >= start) & (deleted_rows < stop)] - start
+            futures.append(executor.submit(_search_shard, path, dim, int(start), int(stop), queries, k, deleted))
+        parts = [future.result() for future in futures]
+        rows = np.concatenate([part[0] for part in parts], axis=1)
+        scores = np.concatenate([part[1] for part in parts], axis=1)
+        top, top_scores = top_k_matrix(scores, k)
+        return np.take_along_axis(rows, top, axis=1), top_scores
+
+    def close(self):
+        for executor in self._executors:
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,190 @@
+"""向量存储的版本化快照格式
+
+快照是自描述的单个文件，可以在机器之间复制，也可以安全地加载来源不可信的文件（只解析JSON和原始数组，
+不使用pickle）。文件由魔数和一串帧组成，每帧为 类型(1字节) + 长度(uint64) + CRC32(uint32) + 内容：
+
+    H  头部JSON：格式版本、嵌入类型和模型、维度、行数、压缩方式
+    每批行依次为：I 块ID（int64）、V 向量（float32原始字节）、T 文本（zlib压缩的JSON）、M 元数据（zlib压缩的JSON）
+    D  文档登记表（zlib压缩的JSON）
+    E  结尾：行数和此前全部字节的SHA-256
+
+所有整数和数组均为小端序。读取时逐帧校验CRC32，结尾再校验SHA-256，内存占用只与一批行的大小有关。
+
+用法：
+    python snapshot.py export store.snapshot [--backend numpy] [--path ./vector_store]
+    python snapshot.py import store.snapshot [--backend sqlite] [--path ./vector_store.db]
+"""
+import argparse
+import hashlib
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+MAGIC = b"PRAGSNAP"
+SNAPSHOT_VERSION = 1
+FRAME_HEADER = struct.Struct("<cQI")
+# 单帧的最大字节数，拒绝声明了超大长度的损坏或恶意文件
+MAX_FRAME_BYTES = 1 << 30
+COMPRESSION_LEVEL = 6
+# 导出时每批的行数，导入时的临时内存与一批的大小成正比（1536维时每批约12MB向量）
+SNAPSHOT_BATCH_ROWS = 2048
+
+
+class SnapshotError(ValueError):
+    """快照文件损坏、版本不支持或与目标存储不兼容"""
+
+
+def _compress_json(value):
+    return zlib.compress(json.dumps(value, ensure_ascii=False).encode("utf-8"), COMPRESSION_LEVEL)
+
+
+def _decompress_json(payload):
+    try:
+        return json.loads(zlib.decompress(payload).decode("utf-8"))
+    except (zlib.error, UnicodeDecodeError, ValueError) as e:
+        raise SnapshotError(f"快照内容无法解码: {str(e)}")
+
+
+class _HashingFile:
+    """写入或读取的同时计算SHA-256"""
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        self.f.write(data)
+
+    def read(self, size):
+        data = self.f.read(size)
+        self.digest.update(data)
+        return data
+
+
+def _write_frame(f, kind, payload):
+    f.write(FRAME_HEADER.pack(kind, len(payload), zlib.crc32(payload)))
+    f.write(payload)
+
+
+def write_snapshot(path, header, batches, documents):
+    """写入快照：batches按批给出 (块ID, 归一化向量, 文本, 元数据)；先写临时文件再原子替换，返回写入的行数"""
+    temp_path = path + ".tmp"
+    rows = 0
+    try:
+        with open(temp_path, "wb") as raw:
+            f = _HashingFile(raw)
+            f.write(MAGIC)
+            _write_frame(f, b"H", json.dumps(dict(header, format_version=SNAPSHOT_VERSION,
+                                                  compression="zlib")).encode("utf-8"))
+            for ids, vectors, texts, metadatas in batches:
+                _write_frame(f, b"I", np.ascontiguousarray(ids, dtype="<i8").tobytes())
+                _write_frame(f, b"V", np.ascontiguousarray(vectors, dtype="<f4").tobytes())
+                _write_frame(f, b"T", _compress_json(list(texts)))
+                _write_frame(f, b"M", _compress_json(list(metadatas)))
+                rows += len(ids)
+            _write_frame(f, b"D", _compress_json(documents))
+            _write_frame(raw, b"E", json.dumps({"rows": rows, "sha256": f.digest.hexdigest()}).encode("utf-8"))
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return rows
+
+
+class SnapshotReader:
+    """流式读取快照：打开时读头部，batches()逐批返回行，读完后documents为文档登记表"""
+    def __init__(self, path):
+        self._raw = open(path, "rb")
+        self._f = _HashingFile(self._raw)
+        self.documents = None
+        if self._f.read(len(MAGIC)) != MAGIC:
+            self.close()
+            raise SnapshotError("不是向量存储快照文件")
+        kind, payload = self._read_frame()
+        try:
+            self.header = json.loads(payload.decode("utf-8")) if kind == b"H" else None
+        except (UnicodeDecodeError, ValueError):
+            self.header = None
+        if not isinstance(self.header, dict):
+            self.close()
+            raise SnapshotError("快照缺少头部")
+        if self.header.get("format_version", 0) > SNAPSHOT_VERSION:
+            self.close()
+            raise SnapshotError(f"不支持的快照版本: {self.header.get('format_version')}")
+
+    def _read_frame(self, hashed=True):
+        source = self._f if hashed else self._raw
+        prefix = source.read(FRAME_HEADER.size)
+        if len(prefix) < FRAME_HEADER.size:
+            raise SnapshotError("快照文件不完整")
+        kind, length, checksum = FRAME_HEADER.unpack(prefix)
+        if length > MAX_FRAME_BYTES:
+            raise SnapshotError(f"快照帧过大: {length} 字节")
+        payload = source.read(length)
+        if len(payload) < length:
+            raise SnapshotError("快照文件不完整")
+        if zlib.crc32(payload) != checksum:
+            raise SnapshotError("快照校验和不匹配，文件已损坏")
+        return kind, payload
+
+    def batches(self):
+        dim = int(self.header.get("dim") or 0)
+        rows = 0
+        while True:
+            kind, payload = self._read_frame()
+            if kind == b"D":
+                self.documents = _decompress_json(payload)
+                break
+            if kind != b"I":
+                raise SnapshotError(f"快照帧顺序错误: {kind!r}")
+            ids = np.frombuffer(payload, dtype="<i8").astype(np.int64)
+            frames = [self._read_frame() for _ in range(3)]
+            if [frame[0] for frame in frames] != [b"V", b"T", b"M"]:
+                raise SnapshotError("快照帧顺序错误")
+            vectors, texts, metadatas = frames[0][1], _decompress_json(frames[1][1]), _decompress_json(frames[2][1])
+            if dim <= 0 or len(vectors) != len(ids) * dim * 4 or len(texts) != len(ids) or len(metadatas) != len(ids):
+                raise SnapshotError("快照中一批行的长度不一致")
+            rows += len(ids)
+            yield ids, np.frombuffer(vectors, dtype="<f4").reshape(len(ids), dim), texts, metadatas
+        # 结尾帧记录的是它之前全部字节的SHA-256，自身不计入
+        digest = self._f.digest.hexdigest()
+        kind, payload = self._read_frame(hashed=False)
+        try:
+            trailer = json.loads(payload.decode("utf-8")) if kind == b"E" else {}
+        except (UnicodeDecodeError, ValueError):
+            trailer = {}
+        if not isinstance(trailer, dict) or trailer.get("sha256") != digest or trailer.get("rows") != rows:
+            raise SnapshotError("快照校验和不匹配，文件已损坏")
+
+    def close(self):
+        self._raw.close()
+
+
+def main():
+    from vector_store import create_vector_store, BACKEND_PATHS
+    parser = argparse.ArgumentParser(description="导出或导入向量存储快照")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("snapshot", help="快照文件路径")
+    parser.add_argument("--backend", choices=sorted(BACKEND_PATHS), help="向量存储后端，默认使用配置中的VECTOR_BACKEND")
+    parser.add_argument("--path", help="存储路径，默认使用该后端的配置路径")
+    args = parser.parse_args()
+
+    store = create_vector_store(args.backend, persist_directory=args.path)
+    try:
+        if args.command == "export":
+            rows = store.export_snapshot(args.snapshot)
+            print(f"已导出 {rows} 个文本块到 {args.snapshot}（{os.path.getsize(args.snapshot) / 1024 ** 2:.1f} MB）")
+        else:
+            rows = store.import_snapshot(args.snapshot)
+            print(f"已从 {args.snapshot} 导入 {rows} 个文本块")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import os
+import tempfile
+import pytest
+from vector_store import VectorStore, create_vector_store
+from snapshot import SnapshotError
+
+
+class TestSnapshot:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.store = VectorStore(use_mock=True, persist_directory=os.path.join(self.temp_dir.name, "source"))
+        self.document = os.path.join(self.temp_dir.name, "a.md")
+        with open(self.document, "w", encoding="utf-8") as f:
+            f.write("内容")
+        self.store.add_document(self.document, ["数据库索引原理", "向量检索方法", "今天天气很好"],
+                                [{"section": "索引"}, {"page": 2}, {}])
+        self.store.delete(self.store.add_texts(["已删除的文本"]))
+        self.path = os.path.join(self.temp_dir.name, "store.snapshot")
+
+    def teardown_method(self):
+        del self.store
+        self.temp_dir.cleanup()
+
+    def round_trip_test(self):
+        """测试导出的快照可以导入到其他后端，块ID、元数据和文档登记表保持不变"""
+        assert self.store.export_snapshot(self.path, batch_size=2) == 3
+        target = create_vector_store("sqlite", persist_directory=os.path.join(self.temp_dir.name, "target.db"))
+        assert target.import_snapshot(self.path) == 3
+        result = target.similarity_search_with_metadata("向量检索方法", k=1)[0]
+        assert (result["id"], result["metadata"]["page"]) == (1, 2)
+        assert target.is_document_current(self.document)
+        with pytest.raises(ValueError):
+            target.import_snapshot(self.path)
+        target.close()
+
+    def corrupted_snapshot_test(self, monkeypatch):
+        """测试损坏、截断和版本不支持的快照被拒绝，且不会留下导入了一半的数据"""
+        self.store.export_snapshot(self.path)
+        with open(self.path, "rb") as f:
+            data = bytearray(f.read())
+        target = VectorStore(persist_directory=os.path.join(self.temp_dir.name, "target"))
+
+        corrupted = data[:]
+        corrupted[len(corrupted) // 2] ^= 0xFF
+        truncated = data[:len(data) - 10]
+        for content in (corrupted, truncated, b"not a snapshot"):
+            with open(self.path, "wb") as f:
+                f.write(content)
+            with pytest.raises(SnapshotError):
+                target.import_snapshot(self.path)
+            assert target.stats()["live"] == 0
+
+        # 更新版本的程序写出的快照
+        with monkeypatch.context() as patch:
+            patch.setattr("snapshot.SNAPSHOT_VERSION", 2)
+            self.store.export_snapshot(self.path)
+        with pytest.raises(SnapshotError, match="版本"):
+            target.import_snapshot(self.path)
+        del target
@@ -0,0 +1,357 @@
+"""单文件的SQLite向量存储后端
+
+文本块、元数据列和float32向量（BLOB）保存在同一个SQLite数据库文件中，使用WAL日志：每个写操作
+（包括按文档替换文本块）是一个事务，崩溃后要么完整生效要么完全没有；读者不阻塞写者。
+FTS5全文索引保存按lexical_index.tokenize切分后的词项（中文相邻两字、英文单词），用bm25排序。
+打开时用一次顺序扫描把向量批量读入NumPy矩阵，检索在内存中做精确打分；其他进程提交的变化
+通过PRAGMA data_version发现，检索和写入前重新加载。
+"""
+from contextlib import contextmanager
+import json
+import os
+import sqlite3
+import numpy as np
+from config import SQLITE_STORE_PATH, HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K
+from chunk_metadata import FIELDS, DEFAULTS, normalize_record
+from lexical_index import tokenize, reciprocal_rank_fusion
+from sharded_search import top_k_matrix
+from vector_backends import ExternalBackend
+
+# 加载向量时每批读取的行数
+LOAD_BATCH_ROWS = 8192
+# 内存矩阵首次分配的最小行数，之后按倍数扩容
+MIN_MATRIX_CAPACITY = 1024
+
+SQL_TYPES = {"category": "TEXT", np.int32: "INTEGER", np.int64: "INTEGER", np.float64: "REAL"}
+METADATA_COLUMNS = ", ".join(FIELDS)
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS chunks (
+    id INTEGER PRIMARY KEY,
+    text TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    {", ".join(f"{field} {SQL_TYPES[kind]} NOT NULL DEFAULT {DEFAULTS[field]!r}" for field, kind in FIELDS.items())}
+);
+CREATE INDEX IF NOT EXISTS chunks_source ON chunks(source);
+CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(tokens, tokenize='unicode61 remove_diacritics 0');
+CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, entry TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+
+class SQLiteVectorStore(ExternalBackend):
+    """单个SQLite文件作为向量存储后端，persist_directory为数据库文件路径"""
+    name = "sqlite"
+
+    def __init__(self, use_mock=False, persist_directory=None):
+        path = persist_directory or SQLITE_STORE_PATH
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # 事务由_exclusive显式控制；连接在线程之间共用，所有访问都在_write_lock内
+        self._connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.executescript(SCHEMA)
+        self._clear_vectors()
+        super().__init__(use_mock, path)
+        self._load_vectors()
+        self._data_version = self._read_data_version()
+
+    def _clear_vectors(self):
+        """清空内存中的向量：与块ID一一对应（按ID升序）的矩阵行和删除标记"""
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = None
+        self._row_count = 0
+        self._alive = np.zeros(0, dtype=bool)
+        self._live = 0
+
+    def _read_data_version(self):
+        return self._connection.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_state(self):
+        state = dict(self._connection.execute("SELECT key, value FROM state"))
+        self._next_id = int(state.get("next_id", 0))
+        self._dimension = json.loads(state.get("dim", "null"))
+        self._saved_embeddings_type = state.get("embeddings_type")
+        self.documents = {key: json.loads(entry) for key, entry in
+                          self._connection.execute("SELECT key, entry FROM documents")}
+
+    def _save_state(self, documents=None):
+        self._connection.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", [
+            ("next_id", str(self._next_id)),
+            ("dim", json.dumps(self._dimension)),
+            ("embeddings_type", self._embeddings_type())
+        ])
+
+    def _save_document(self, key, entry):
+        if entry is None:
+            self._connection.execute("DELETE FROM documents WHERE key = ?", (key,))
+        else:
+            self._connection.execute("INSERT OR REPLACE INTO documents (key, entry) VALUES (?, ?)",
+                                     (key, json.dumps(entry, ensure_ascii=False)))
+
+    def _delete_state(self):
+        self._connection.execute("DELETE FROM state")
+        self._connection.execute("DELETE FROM documents")
+
+    def _load_vectors(self):
+        """一次顺序扫描把全部向量按ID升序读入内存矩阵"""
+        connection = self._connection
+        own_transaction = not connection.in_transaction
+        if own_transaction:
+            # 计数和扫描读同一个快照
+            connection.execute("BEGIN")
+        try:
+            count = connection.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+            self._clear_vectors()
+            if count == 0:
+                return
+            cursor = connection.execute("SELECT id, embedding FROM chunks ORDER BY id")
+            ids = np.empty(count, dtype=np.int64)
+            matrix = None
+            position = 0
+            while True:
+                batch = cursor.fetchmany(LOAD_BATCH_ROWS)
+                if not batch:
+                    break
+                block = np.frombuffer(b"".join(row[1] for row in batch), dtype=np.float32)
+                if matrix is None:
+                    dim = self._dimension or len(batch[0][1]) // 4
+                    matrix = np.empty((max(count, MIN_MATRIX_CAPACITY), dim), dtype=np.float32)
+                ids[position:position + len(batch)] = [row[0] for row in batch]
+                matrix[position:position + len(batch)] = block.reshape(len(batch), -1)
+                position += len(batch)
+        finally:
+            if own_transaction:
+                connection.execute("COMMIT")
+        self._ids, self._matrix, self._row_count = ids, matrix, count
+        self._alive = np.ones(count, dtype=bool)
+        self._live = count
+
+    def _reload(self):
+        self._load_state()
+        self._load_vectors()
+        self._data_version = self._read_data_version()
+
+    def _catch_up(self):
+        """其他连接提交过变化时重新加载状态和向量"""
+        if self._read_data_version() != self._data_version:
+            self._reload()
+
+    @contextmanager
+    def _exclusive(self):
+        """一个写操作一个事务；BEGIN IMMEDIATE在进程之间互斥，取得后先读入其他进程的变化"""
+        with self._write_lock:
+            if self._connection.in_transaction:
+                yield
+                return
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._catch_up()
+                yield
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                # 内存中的状态可能只更新了一部分，按数据库重新加载
+                self._reload()
+                raise
+
+    @contextmanager
+    def _reading(self):
+        with self._write_lock:
+            yield
+
+    def _maybe_refresh(self):
+        with self._write_lock:
+            self._catch_up()
+
+    def _reserve(self, rows, dim):
+        with self._write_lock:
+            if rows <= 0 or dim <= 0 or (self._matrix is not None and self._matrix.shape[1] != dim):
+                return
+            needed = self._row_count + rows
+            if self._matrix is None:
+                self._matrix = np.empty((needed, dim), dtype=np.float32)
+            elif needed > len(self._matrix):
+                matrix = np.empty((needed, dim), dtype=np.float32)
+                matrix[:self._row_count] = self._matrix[:self._row_count]
+                self._matrix = matrix
+
+    def _append_vectors(self, ids, vectors):
+        """追加已按ID升序的行，容量不足时按倍数扩容"""
+        needed = self._row_count + len(ids)
+        if self._matrix is None or self._matrix.shape[1] != vectors.shape[1]:
+            self._matrix = np.empty((max(MIN_MATRIX_CAPACITY, needed), vectors.shape[1]), dtype=np.float32)
+        elif needed > len(self._matrix):
+            matrix = np.empty((max(needed, 2 * len(self._matrix)), self._matrix.shape[1]), dtype=np.float32)
+            matrix[:self._row_count] = self._matrix[:self._row_count]
+            self._matrix = matrix
+        self._matrix[self._row_count:needed] = vectors
+        self._row_count = needed
+        self._ids = np.concatenate([self._ids, ids])
+        self._alive = np.concatenate([self._alive, np.ones(len(ids), dtype=bool)])
+        self._live += len(ids)
+
+    def _insert(self, ids, vectors, texts, metadatas):
+        order = np.argsort(ids, kind="stable")
+        if len(self._ids) and ids[order[0]] <= self._ids[-1]:
+            raise ValueError("写入的块ID必须大于已有的块ID")
+        records = [normalize_record(metadata) for metadata in metadatas]
+        placeholders = ", ".join("?" * (3 + len(FIELDS)))
+        self._connection.executemany(
+            f"INSERT INTO chunks (id, text, embedding, {METADATA_COLUMNS}) VALUES ({placeholders})",
+            [(int(i), text, vector.tobytes(), *record.values())
+             for i, text, vector, record in zip(ids, texts, vectors, records)])
+        self._connection.executemany("INSERT INTO chunks_fts (rowid, tokens) VALUES (?, ?)",
+                                     [(int(i), " ".join(tokenize(text))) for i, text in zip(ids, texts)])
+        self._append_vectors(ids[order], vectors[order])
+
+    def _live_rows(self, ids):
+        """块ID对应的未删除矩阵行号"""
+        rows = np.searchsorted(self._ids, ids)
+        found = rows < len(self._ids)
+        found[found] = self._ids[rows[found]] == ids[found]
+        rows = np.unique(rows[found])
+        return rows[self._alive[rows]]
+
+    def _remove(self, ids):
+        rows = self._live_rows(ids)
+        if len(rows) == 0:
+            return 0
+        payload = json.dumps(self._ids[rows].tolist())
+        self._connection.execute("DELETE FROM chunks WHERE id IN (SELECT value FROM json_each(?))", (payload,))
+        self._connection.execute("DELETE FROM chunks_fts WHERE rowid IN (SELECT value FROM json_each(?))", (payload,))
+        self._alive[rows] = False
+        self._live -= len(rows)
+        if self._row_count - self._live > max(MIN_MATRIX_CAPACITY, self._live):
+            self._prune()
+        return len(rows)
+
+    def _prune(self):
+        """已删除的行多于未删除的行时从内存矩阵中去掉它们"""
+        alive = self._alive[:self._row_count]
+        self._ids = self._ids[alive]
+        self._matrix = self._matrix[:self._row_count][alive]
+        self._row_count = len(self._ids)
+        self._alive = np.ones(self._row_count, dtype=bool)
+
+    def _filter_ids(self, filter):
+        """按元数据过滤条件求出块ID（升序）；普通条件在SQL中求值，数值字段的函数条件在取出的列上求值"""
+        clauses, params, functions = [], [], []
+        for field, condition in filter.items():
+            if field not in FIELDS:
+                raise ValueError(f"不支持的元数据字段: {field}")
+            if callable(condition):
+                if FIELDS[field] != "category":
+                    functions.append((field, condition))
+                    continue
+                # 字符串字段的函数在取值集合上逐个求值
+                condition = [value for (value,) in self._connection.execute(f"SELECT DISTINCT {field} FROM chunks")
+                             if condition(value)]
+            values = condition if isinstance(condition, (list, tuple, set, frozenset)) else [condition]
+            clauses.append(f"{field} IN (SELECT value FROM json_each(?))")
+            params.append(json.dumps([normalize_record({field: value})[field] for value in values],
+                                     ensure_ascii=False))
+        columns = ", ".join(["id"] + [field for field, _ in functions])
+        rows = self._connection.execute(f"SELECT {columns} FROM chunks WHERE {' AND '.join(clauses) or '1'} "
+                                        f"ORDER BY id", params).fetchall()
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        mask = np.ones(len(ids), dtype=bool)
+        for position, (field, condition) in enumerate(functions, start=1):
+            column = np.array([row[position] for row in rows], dtype=FIELDS[field])
+            mask &= np.asarray(condition(column), dtype=bool)
+        return ids[mask]
+
+    def _query(self, vectors, k, filter=None):
+        empty = (np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))
+        if self._matrix is None:
+            return [empty for _ in vectors]
+        if filter:
+            rows = self._live_rows(self._filter_ids(filter))
+            scores = vectors @ self._matrix[rows].T
+        else:
+            rows = np.flatnonzero(self._alive[:self._row_count]) if self._live < self._row_count else None
+            scores = vectors @ self._matrix[:self._row_count].T
+            if rows is not None:
+                scores = scores[:, rows]
+        top, top_scores = top_k_matrix(scores, k)
+        if rows is not None:
+            top = rows[top]
+        return [(self._ids[row_top], row_scores) for row_top, row_scores in zip(top, top_scores)]
+
+    def _lexical_ids(self, query, k, filter=None):
+        """FTS5全文检索，按bm25返回前k个块ID"""
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return np.empty(0, dtype=np.int64)
+        sql = "SELECT rowid FROM chunks_fts WHERE chunks_fts MATCH ?"
+        params = [" OR ".join('"' + term.replace('"', '""') + '"' for term in terms)]
+        if filter:
+            sql += " AND rowid IN (SELECT value FROM json_each(?))"
+            params.append(json.dumps(self._filter_ids(filter).tolist()))
+        rows = self._connection.execute(sql + " ORDER BY rank LIMIT ?", params + [k]).fetchall()
+        return np.array([row[0] for row in rows], dtype=np.int64)
+
+    def _ranked_ids(self, query, query_vector, k, filter):
+        """向量检索和FTS5检索各取候选，用倒数排名融合（RRF）合并"""
+        if not HYBRID_SEARCH:
+            return super()._ranked_ids(query, query_vector, k, filter)
+        pool = max(k, HYBRID_CANDIDATES)
+        vector_ids = self._query(query_vector, pool, filter)[0][0]
+        lexical_ids = self._lexical_ids(query, pool, filter)
+        if len(lexical_ids) == 0:
+            return vector_ids[:k]
+        return np.array(reciprocal_rank_fusion([vector_ids, lexical_ids], RRF_K)[:k], dtype=np.int64)
+
+    def lexical_search(self, query, k=4, filter=None):
+        """只用FTS5全文索引检索，不调用嵌入API"""
+        self._maybe_refresh()
+        with self._reading():
+            return self._fetch(self._lexical_ids(query, k, self._normalize_filter(filter)))[0]
+
+    def _fetch(self, ids):
+        if len(ids) == 0:
+            return [], [], np.empty((0, self._dim() or 0), dtype=np.float32)
+        rows = self._connection.execute(
+            f"SELECT id, text, {METADATA_COLUMNS} FROM chunks WHERE id IN (SELECT value FROM json_each(?))",
+            (json.dumps([int(i) for i in ids]),)).fetchall()
+        by_id = {row[0]: row for row in rows}
+        rows = [by_id[int(i)] for i in ids]
+        metadatas = [dict(zip(FIELDS, row[2:])) for row in rows]
+        vectors = self._matrix[np.searchsorted(self._ids, np.asarray(ids, dtype=np.int64))]
+        return [row[1] for row in rows], metadatas, vectors
+
+    def _rows_after(self, last_id, batch_size):
+        with self._reading():
+            return self._connection.execute(
+                f"SELECT id, embedding, text, {METADATA_COLUMNS} FROM chunks WHERE id > ? ORDER BY id LIMIT ?",
+                (last_id, batch_size)).fetchall()
+
+    def _rows(self, batch_size):
+        last_id = -1
+        while True:
+            rows = self._rows_after(last_id, batch_size)
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            vectors = np.frombuffer(b"".join(row[1] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+            yield (np.array([row[0] for row in rows], dtype=np.int64), vectors, [row[2] for row in rows],
+                   [dict(zip(FIELDS, row[3:])) for row in rows])
+
+    def _count(self):
+        return self._live
+
+    def _clear(self):
+        self._connection.execute("DELETE FROM chunks")
+        self._connection.execute("DELETE FROM chunks_fts")
+        self._clear_vectors()
+
+    def stats(self):
+        """存储统计：在外部后端的统计之外加上数据库和WAL文件的字节数"""
+        self._maybe_refresh()
+        stats = super().stats()
+        stats["file_bytes"] = sum(os.path.getsize(path) for path in (self.persist_directory,
+                                                                     self.persist_directory + "-wal")
+                                  if os.path.exists(path))
+        return stats
+
+    def close(self):
+        self._connection.close()
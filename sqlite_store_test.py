@@ -0,0 +1,61 @@
+import os
+import tempfile
+import numpy as np
+from vector_store import create_vector_store
+
+
+class TestSQLiteVectorStore:
+    def setup_method(self):
+        """在每个测试方法前设置"""
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, "store.db")
+        self.store = create_vector_store("sqlite", use_mock=True, persist_directory=self.path)
+
+    def teardown_method(self):
+        self.store.close()
+        self.temp_dir.cleanup()
+
+    def search_and_filter_test(self):
+        """测试向量检索、FTS5全文检索和元数据过滤（包括函数条件）"""
+        ids = self.store.add_texts(["数据库索引原理", "向量检索方法", "today the weather is fine"],
+                                   [{"section": "索引"}, {"page": 2}, {"page": 5}])
+        assert ids == [0, 1, 2]
+        assert self.store.similarity_search("向量检索方法", k=1) == ["向量检索方法"]
+        assert self.store.lexical_search("weather") == ["today the weather is fine"]
+        assert self.store.lexical_search("索引原理") == ["数据库索引原理"]
+        assert self.store.similarity_search("方法", k=3, filter={"page": lambda column: column > 1}) == \
+            ["向量检索方法", "today the weather is fine"]
+        result = self.store.similarity_search_with_metadata("索引", k=1, filter={"section": ["索引"]})[0]
+        assert (result["id"], result["metadata"]["page"]) == (0, -1)
+        batch = self.store.similarity_search_batch(["数据库索引原理", "向量检索方法"], k=1)
+        assert [result["ids"] for result in batch] == [[0], [1]]
+
+        assert self.store.delete([1, 7]) == 1
+        assert self.store.lexical_search("向量检索") == []
+        assert self.store.stats()["live"] == 2 and self.store.count() == 2
+
+    def transactions_and_reload_test(self):
+        """测试写操作失败时整体回滚，以及其他连接提交的变化在检索前读入"""
+        path = os.path.join(self.temp_dir.name, "a.md")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("内容")
+        self.store.add_document(path, ["第一段", "第二段"])
+
+        try:
+            with self.store._exclusive():
+                self.store._add_rows(np.ones((1, 1536), dtype=np.float32), ["不会提交"])
+                raise RuntimeError("写入中途失败")
+        except RuntimeError:
+            pass
+        assert self.store.stats()["live"] == 2
+        assert self.store.lexical_search("提交") == []
+
+        other = create_vector_store("sqlite", persist_directory=self.path)
+        assert other.is_document_current(path)
+        assert other.add_document(path, ["替换后的内容"]) == 1
+        # 本连接在检索前发现其他连接的提交并重新加载
+        assert self.store.similarity_search("替换后的内容", k=3) == ["替换后的内容"]
+        # 回滚的块ID随事务一起撤销，之后重新分配
+        assert self.store.documents[os.path.normpath(path)]["chunk_ids"] == [2]
+        assert self.store.add_texts(["新的文本块"]) == [3]
+        other.close()
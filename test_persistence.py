@@ -12,7 +12,7 @@ def test_vector_store_persistence():
     print("=== 测试向量存储持久化功能 ===")
     
     # 清理测试环境：删除现有的向量存储文件
-    vector_store_file = os.path.join(VECTOR_STORE_PATH, "vector_store.pkl")
+    vector_store_file = os.path.join(VECTOR_STORE_PATH, "manifest.json")
     if os.path.exists(vector_store_file):
         os.remove(vector_store_file)
         print(f"   清理了旧的向量存储文件: {vector_store_file}")
@@ -38,7 +38,7 @@ def test_vector_store_persistence():
     
     # 4. 检查向量存储文件是否创建
     print("\n4. 检查向量存储文件是否创建...")
-    vector_store_file = os.path.join(VECTOR_STORE_PATH, "vector_store.pkl")
+    vector_store_file = os.path.join(VECTOR_STORE_PATH, "manifest.json")
     assert os.path.exists(vector_store_file), f"向量存储文件未创建: {vector_store_file}"
     print(f"   ✅ 向量存储文件已创建: {vector_store_file}")
     file_size = os.path.getsize(vector_store_file)
@@ -0,0 +1,252 @@
+"""按token预算的流式文本切分
+
+StreamingTextSplitter按片段（PDF的一页、DOCX的一个段落等）接收文本，每个片段只编码一次，
+缓冲区凑够chunk_size个token就在预算之内最合适的段落、换行、句子或分句边界处切出一块，
+下一块从上一块结尾回退正好chunk_overlap个token开始，重叠会跨越片段边界携带到下一页。
+切分只在token的UTF-8字节长度上做向量化运算，不需要逐块重新编码；每个文本块同时给出它的token数。
+
+token由tiktoken的编码给出；编码无法加载时（未安装或离线时无法下载词表）退化为按字符计数。
+缓冲区只保留尚未切出的文本，内存占用与块大小和单个片段的大小有关，与整个文件的大小无关。
+"""
+from bisect import bisect_right
+import numpy as np
+from config import TOKENIZER_ENCODING
+
+# 切分点的优先级，在预算之内取优先级最高、其次最靠后的位置
+PARAGRAPH, LINE, SENTENCE, CLAUSE, SPACE, ANYWHERE, INVALID = 5, 4, 3, 2, 1, 0, -1
+# 中文句末和分句标点，都是3字节的UTF-8编码，按切分位置之前3个字节拼成的整数匹配
+SENTENCE_MARKS = np.array([int.from_bytes(mark.encode("utf-8"), "big") for mark in "。！？；…"], dtype=np.int64)
+CLAUSE_MARKS = np.array([int.from_bytes(mark.encode("utf-8"), "big") for mark in "，、："], dtype=np.int64)
+
+
+def _byte_table(values):
+    table = np.zeros(256, dtype=bool)
+    table[list(values)] = True
+    return table
+
+
+WHITESPACE = _byte_table(b" \t\n\r\x0b\x0c")
+ASCII_SENTENCE_MARKS = _byte_table(b".!?;")
+ASCII_CLAUSE_MARKS = _byte_table(b",:")
+CONTINUATION = _byte_table(range(0x80, 0xC0))
+NEWLINE = ord("\n")
+# 中文标点的最后一个字节，只在这些位置上检查前3个字节
+MARK_LAST_BYTES = _byte_table(int(mark) & 0xFF for mark in np.concatenate([SENTENCE_MARKS, CLAUSE_MARKS]))
+
+
+def _pair_table():
+    """按 (切分位置前一个字节, 后一个字节) 查切分优先级，后一个字节是多字节字符的中间时不能切分"""
+    table = np.full((256, 256), ANYWHERE, dtype=np.int8)
+    table[WHITESPACE[:, None] | WHITESPACE[None, :]] = SPACE
+    table[ASCII_CLAUSE_MARKS[:, None] & WHITESPACE[None, :]] = CLAUSE
+    table[ASCII_SENTENCE_MARKS[:, None] & WHITESPACE[None, :]] = SENTENCE
+    table[NEWLINE, :] = LINE
+    table[:, NEWLINE] = LINE
+    table[:, CONTINUATION] = INVALID
+    return table
+
+
+PAIR_SCORES = _pair_table()
+
+_encoding = None
+# 各编码的 token ID -> UTF-8字节长度 表
+_length_tables = {}
+
+
+def load_encoding():
+    """加载tiktoken编码，失败时返回None（按字符计数）；结果在进程内缓存"""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"无法加载tiktoken编码 {TOKENIZER_ENCODING}，按字符数切分: {str(e)}")
+            _encoding = False
+    return _encoding or None
+
+
+def _length_table(encoding):
+    """token ID到字节长度的查找表，每个编码只构建一次，之后按ID向量化查表"""
+    table = _length_tables.get(encoding.name)
+    if table is None:
+        table = np.zeros(encoding.max_token_value + 1, dtype=np.int64)
+        for token in range(len(table)):
+            try:
+                table[token] = len(encoding.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        _length_tables[encoding.name] = table
+    return table
+
+
+def _char_lengths(text):
+    """每个字符的UTF-8字节长度"""
+    code_points = np.frombuffer(text.encode("utf-32-le", "surrogatepass"), dtype=np.uint32)
+    return (1 + (code_points >= 0x80) + (code_points >= 0x800) + (code_points >= 0x10000)).astype(np.int64)
+
+
+class StreamingTextSplitter:
+    """逐片段接收文本并生成 (文本块, 元数据)，元数据取块起点所在片段的元数据，并补充文本块的token数"""
+    def __init__(self, chunk_size, chunk_overlap, encoding=None):
+        if chunk_size <= 0 or chunk_overlap < 0 or chunk_overlap >= chunk_size:
+            raise ValueError(f"块大小({chunk_size})必须大于重叠大小({chunk_overlap})")
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.encoding = encoding
+        self._reset()
+
+    def _reset(self):
+        self._data = b""
+        # 各token在_data中的结束偏移、是否只含空白，以及在该token之前切分的优先级
+        self._ends = np.empty(0, dtype=np.int64)
+        self._blank = np.empty(0, dtype=bool)
+        self._scores = np.empty(0, dtype=np.int8)
+        # 各片段的起始token下标和元数据
+        self._marks = []
+        self._metadatas = []
+
+    def token_lengths(self, text):
+        """编码一次，返回每个token的UTF-8字节长度"""
+        if self.encoding is None:
+            return _char_lengths(text)
+        tokens = np.array(self.encoding.encode_ordinary(text), dtype=np.int64)
+        return _length_table(self.encoding)[tokens]
+
+    def count_tokens(self, text):
+        return len(self.token_lengths(text))
+
+    def split_text(self, text):
+        """切分一段完整的文本，返回 [(文本块, token数)]"""
+        chunks = [(chunk, metadata["tokens"]) for chunk, metadata in self.feed(text)]
+        chunks.extend((chunk, metadata["tokens"]) for chunk, metadata in self.flush())
+        return chunks
+
+    def feed(self, text, metadata=None):
+        """追加一个片段，生成已经凑满的文本块；不足一块的尾部留在缓冲区等待后续片段"""
+        if not text:
+            return
+        lengths = self.token_lengths(text)
+        if len(lengths) == 0:
+            return
+        count = len(self._ends)
+        self._marks.append(count)
+        self._metadatas.append(dict(metadata or {}))
+        piece = text.encode("utf-8", "surrogatepass")
+        starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+        # 每个token的字节都是空白时整个token是空白
+        blank = np.logical_and.reduceat(WHITESPACE[np.frombuffer(piece, dtype=np.uint8)], starts)
+        self._ends = np.concatenate([self._ends, len(self._data) + starts + lengths])
+        self._data += piece
+        self._blank = np.concatenate([self._blank, blank])
+        # 片段衔接处前两个位置的优先级与新片段的开头有关，一并重新计算
+        redo = max(count - 2, 0)
+        self._scores = np.concatenate([self._scores[:redo], self._score(redo, len(self._ends))])
+        yield from self._split(final=False)
+
+    def flush(self):
+        """切出缓冲区中剩余的全部文本，之后的片段不再与之前的文本重叠（用于章节边界和文件结尾）"""
+        yield from self._split(final=True)
+        self._reset()
+
+    def _split(self, final):
+        count = len(self._ends)
+        start = 0
+        # 在缓冲区内只移动起点，最后一次性丢弃已切出的部分，超长片段也只复制一次
+        while count - start > self.chunk_size or (final and start < count):
+            end = self._boundary(start) if count - start > self.chunk_size else count
+            chunk = self._chunk(start, end)
+            if chunk is not None:
+                yield chunk
+            if end >= count:
+                start = end
+                break
+            start = self._overlap_start(start, end)
+        self._discard(start)
+
+    def _offset(self, index):
+        """第index个token起点的字节偏移"""
+        return int(self._ends[index - 1]) if index > 0 else 0
+
+    def _score(self, low, high):
+        """在第low到high-1个token之前切分的优先级，按前后字节查表，中文标点和空行只在少数候选位置上再检查"""
+        data = np.frombuffer(self._data, dtype=np.uint8)
+        size = len(data)
+        positions = self._ends[max(low - 1, 0):high - 1]
+        if low == 0:
+            positions = np.concatenate([[0], positions])
+        before = data[np.maximum(positions - 1, 0)]
+        after = data[np.minimum(positions, size - 1)]
+        scores = PAIR_SCORES[before, after]
+
+        def byte_at(rows, shift):
+            index = positions[rows] + shift
+            return np.where((index >= 0) & (index < size), data[np.clip(index, 0, size - 1)], 0).astype(np.int64)
+
+        # 多字节字符中间的位置保持INVALID，不参与标点和空行的升级
+        rows = np.flatnonzero(MARK_LAST_BYTES[before] & (scores != INVALID))
+        if len(rows):
+            preceding = (byte_at(rows, -3) << 16) | (byte_at(rows, -2) << 8) | before[rows]
+            marks = np.where(np.isin(preceding, SENTENCE_MARKS), SENTENCE,
+                             np.where(np.isin(preceding, CLAUSE_MARKS), CLAUSE, ANYWHERE))
+            scores[rows] = np.maximum(scores[rows], marks)
+        rows = np.flatnonzero(scores == LINE)
+        if len(rows):
+            paragraph = ((before[rows] == NEWLINE) & (byte_at(rows, -2) == NEWLINE)) | \
+                ((after[rows] == NEWLINE) & (byte_at(rows, 1) == NEWLINE))
+            scores[rows[paragraph]] = PARAGRAPH
+        scores[positions == 0] = INVALID
+        return scores
+
+    def _boundary(self, start):
+        """在预算之内找优先级最高、其次最靠后的切分点，切分点之前至少保留重叠长度并尽量不短于半块"""
+        limit = start + self.chunk_size
+        lowest = min(start + max(self.chunk_overlap + 1, self.chunk_size // 2), limit)
+        window = self._scores[lowest:limit + 1]
+        best = window.max()
+        if best == INVALID:
+            return self._char_boundary(limit, start)
+        return lowest + len(window) - 1 - int(np.argmax(window[::-1] == best))
+
+    def _overlap_start(self, start, end):
+        """下一块从结尾回退正好chunk_overlap个token开始；落在多字节字符中间时再向前回退到字符边界"""
+        if self.chunk_overlap == 0:
+            return end
+        return self._char_boundary(max(end - self.chunk_overlap, start + 1), start)
+
+    def _char_boundary(self, position, start):
+        """落在多字节字符中间时向前回退到字符边界，回退到起点仍找不到时向后前进到下一个字符边界"""
+        count = len(self._ends)
+        while position > start + 1 and CONTINUATION[self._data[self._offset(position)]]:
+            position -= 1
+        while position < count and CONTINUATION[self._data[self._offset(position)]]:
+            position += 1
+        return position
+
+    def _chunk(self, start, end):
+        """去掉两端只含空白的token，返回 (文本块, 元数据)，全是空白时返回None"""
+        nonblank = np.flatnonzero(~self._blank[start:end])
+        if len(nonblank) == 0:
+            return None
+        first, last = start + int(nonblank[0]), start + int(nonblank[-1]) + 1
+        text = self._data[self._offset(first):self._offset(last)].decode("utf-8", "surrogatepass").strip()
+        if not text:
+            return None
+        return text, dict(self._metadata_at(start), tokens=last - first)
+
+    def _metadata_at(self, index):
+        position = bisect_right(self._marks, index) - 1
+        return self._metadatas[position] if position >= 0 else {}
+
+    def _discard(self, start):
+        """丢弃起点之前的文本，只保留起点所在及之后片段的元数据"""
+        if start <= 0:
+            return
+        offset = self._offset(start)
+        self._data = self._data[offset:]
+        self._ends = self._ends[start:] - offset
+        self._blank = self._blank[start:]
+        self._scores = self._scores[start:]
+        keep = max(bisect_right(self._marks, start) - 1, 0)
+        self._marks = [max(mark - start, 0) for mark in self._marks[keep:]]
+        self._metadatas = self._metadatas[keep:]
@@ -0,0 +1,74 @@
+import pytest
+import tiktoken
+from text_splitter import StreamingTextSplitter
+
+
+def byte_encoding():
+    """离线构造的字节级tiktoken编码：每个字节一个token，另有少量合并，汉字会被切成多个token"""
+    ranks = {bytes([i]): i for i in range(256)}
+    for merged in [b"th", b"the", b" the", "数".encode("utf-8")[:2], "数".encode("utf-8")]:
+        ranks[merged] = len(ranks)
+    return tiktoken.Encoding(name="test-bytes", pat_str=r"""\s?[^\s]+|\s+""",
+                             mergeable_ranks=ranks, special_tokens={})
+
+
+class TestStreamingTextSplitter:
+    def boundary_and_overlap_test(self):
+        """测试在句子边界处切分，相邻块正好重叠chunk_overlap个token"""
+        splitter = StreamingTextSplitter(100, 20)
+        chunks = splitter.split_text("数据库的索引原理。" * 40)
+        assert len(chunks) > 1
+        for (first, tokens), (second, _) in zip(chunks, chunks[1:]):
+            assert tokens <= 100 and tokens == len(first)
+            assert first.endswith("。")
+            assert second[:20] == first[-20:]
+        assert "".join(chunk[20:] if i else chunk for i, (chunk, _) in enumerate(chunks)) == "数据库的索引原理。" * 40
+    
+    def paragraph_preferred_test(self):
+        """测试预算之内优先在空行处切分，其次是换行和句子"""
+        text = "第一段的内容。" * 8 + "\n\n" + "第二段。" * 20
+        chunks = StreamingTextSplitter(100, 10).split_text(text)
+        assert chunks[0][0] == "第一段的内容。" * 8
+    
+    def pieces_and_metadata_test(self):
+        """测试逐片段输入时重叠跨片段携带，元数据取文本块起点所在的片段，flush后不再重叠"""
+        splitter = StreamingTextSplitter(30, 5)
+        items = []
+        for page in range(1, 4):
+            items.extend(splitter.feed(f"第{page}页的内容，" * 4, {"page": page}))
+        items.extend(splitter.flush())
+        assert items[0] == ("第1页的内容，" * 4, {"page": 1, "tokens": 28})
+        # 第二块以第1页结尾的重叠部分开头，元数据仍是第1页
+        assert items[1][0].startswith("页的内容，第2页") and items[1][1]["page"] == 1
+        assert [metadata["page"] for _, metadata in items] == sorted(metadata["page"] for _, metadata in items)
+        
+        assert list(splitter.feed("新的章节", {"page": 9})) == []
+        assert list(splitter.flush()) == [("新的章节", {"page": 9, "tokens": 4})]
+    
+    def tiktoken_budget_test(self):
+        """测试按tiktoken的token预算切分：token数与重新编码一致，不会从汉字的字节中间切开"""
+        encoding = byte_encoding()
+        splitter = StreamingTextSplitter(64, 16, encoding)
+        text = "数据库索引原理。\nthe index is built once, then the search is fast. " * 30
+        chunks = splitter.split_text(text)
+        assert len(chunks) > 10
+        for chunk, tokens in chunks:
+            assert 0 < tokens <= 64
+            assert tokens >= len(encoding.encode_ordinary(chunk))
+            assert "�" not in chunk
+        assert splitter.count_tokens("数据") == 1 + len("据".encode("utf-8"))
+    
+    def cjk_without_punctuation_test(self):
+        """测试没有标点和空格的中文在字节级token上切分时只在字符边界处切开，重叠也从字符边界开始"""
+        encoding = byte_encoding()
+        for chunk_size, chunk_overlap, text in [(500, 100, "国" * 400), (64, 16, "数据库索引原理" * 50), (5, 2, "国家")]:
+            chunks = StreamingTextSplitter(chunk_size, chunk_overlap, encoding).split_text(text)
+            assert len(chunks) > 1
+            for chunk, tokens in chunks:
+                assert chunk and "�" not in chunk and chunk in text
+            assert text.startswith(chunks[0][0]) and text.endswith(chunks[-1][0])
+    
+    def invalid_sizes_test(self):
+        """测试重叠不小于块大小时报错"""
+        with pytest.raises(ValueError):
+            StreamingTextSplitter(10, 10)
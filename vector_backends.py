@@ -0,0 +1,647 @@
+"""向量存储后端的公共接口
+
+所有后端对外提供同一组方法：add_texts / delete / add_document / add_document_chunks / delete_document /
+is_document_current / similarity_search / similarity_search_with_metadata / similarity_search_batch / stats /
+reset / close，
+以及迁移使用的 export_rows / import_rows / import_document。嵌入、文档登记和按文档替换文本块的逻辑
+在VectorBackend中实现一次；VectorStore（NumPy引擎）在此之上实现自己的存储和检索，
+ExternalBackend为Chroma、SQLite等外部引擎实现通用的检索流程，它们只需提供行的写入、删除和查询。
+"""
+from contextlib import contextmanager
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import numpy as np
+from dotenv import load_dotenv
+from config import (EMBEDDING_MODEL, EMBEDDING_BASE_URL, EMBEDDING_CACHE_ENABLED, MMR_FETCH_K, MMR_LAMBDA,
+                    STREAM_EMBED_BATCH)
+from hashing_embeddings import HashingEmbeddings
+from snapshot import write_snapshot, SnapshotReader, SnapshotError, SNAPSHOT_BATCH_ROWS
+from embedding_cache import CachedEmbeddings
+from embedding_client import BatchedEmbeddings, PartialEmbeddingError
+
+# 加载.env文件
+load_dotenv()
+
+# 计算文件哈希时每次读取的字节数
+HASH_CHUNK_BYTES = 1024 * 1024
+# 外部后端的状态文件：下一个块ID、嵌入类型、维度和文档登记表
+STATE_FILE = "backend.json"
+
+
+def file_sha256(path):
+    """分块读取文件计算SHA-256，内存占用与文件大小无关"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_BYTES), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def document_fingerprint(path):
+    """源文档的指纹：大小、修改时间（纳秒）和内容哈希"""
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": file_sha256(path)}
+
+
+def prefetch_batches(items, batch_size, depth=2):
+    """在后台线程中消费迭代器并按batch_size分批，最多缓冲depth批
+
+    生产者（如解析文档）和消费者（如嵌入）重叠执行，内存占用与depth批的大小成正比。
+    生产者抛出的异常在消费方重新抛出；消费方提前退出时后台线程随之停止。
+    """
+    batches = queue.Queue(maxsize=depth)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            batch = []
+            for item in items:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    if not put(batch):
+                        return
+                    batch = []
+            if batch and not put(batch):
+                return
+            put(done)
+        except BaseException as e:
+            put(e)
+
+    thread = threading.Thread(target=produce, name="prefetch-batches", daemon=True)
+    thread.start()
+    try:
+        while True:
+            batch = batches.get()
+            if batch is done:
+                return
+            if isinstance(batch, BaseException):
+                raise batch
+            yield batch
+    finally:
+        stop.set()
+        thread.join()
+
+
+def maximal_marginal_relevance(query, candidates, k, lambda_mult=MMR_LAMBDA):
+    """最大边际相关（MMR）选择，返回选中候选的下标（按选中先后）
+
+    query和candidates都已归一化。候选之间的相似度矩阵只计算一次，之后每选一个候选
+    只用它那一行更新各候选与已选集合的最大相似度，每一步都是向量运算。
+    """
+    k = min(k, len(candidates))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+    # 各候选与已选候选的最大相似度
+    redundancy = np.full(len(candidates), -np.inf, dtype=np.float32)
+    selected = np.empty(k, dtype=np.int64)
+    scores = relevance.copy()
+    for i in range(k):
+        best = int(np.argmax(scores))
+        selected[i] = best
+        np.maximum(redundancy, similarity[best], out=redundancy)
+        scores = lambda_mult * relevance - (1 - lambda_mult) * redundancy
+        scores[selected[:i + 1]] = -np.inf
+    return selected
+
+
+def normalize_vectors(vectors):
+    """转换为float32矩阵并按行归一化"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    # 零向量保持为零，避免除零
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def migrate_store(source, target, batch_size=10000):
+    """把source中未删除的文本块（保留块ID、向量和元数据）和文档登记表复制到空的target，返回复制的块数"""
+    if target.stats()["live"]:
+        raise ValueError("迁移的目标存储必须为空")
+    # 两边的嵌入类型一致，目标存储加载时才会使用同样的嵌入模型
+    if isinstance(source._embeddings, MockEmbeddings):
+        target.embeddings = MockEmbeddings(source._dim() or 1536)
+    copied = 0
+    for ids, vectors, texts, metadatas in source.export_rows(batch_size):
+        target.import_rows(ids, vectors, texts, metadatas)
+        copied += len(ids)
+    for key, entry in source.documents.items():
+        target.import_document(key, entry)
+    return copied
+
+
+class MockEmbeddings(HashingEmbeddings):
+    """离线使用的Mock Embeddings：确定性的本地哈希嵌入，查询与相关文档的向量相似"""
+    def __init__(self, embedding_dim=1536):
+        super().__init__(dim=embedding_dim)
+
+
+class VectorBackend:
+    """向量存储后端的基类：嵌入模型、文档登记和写操作的公共流程
+
+    子类提供 _exclusive()（写操作的互斥）、_add_rows(vectors, texts, metadatas)（追加已归一化的行并返回块ID）、
+    _tombstone(ids)（删除块ID并返回删除的行数）、_save_document(key, entry)（持久化登记表的变化）和 _dim()，
+    并实现检索、统计、重置和迁移方法。
+    """
+    def __init__(self, use_mock=False):
+        # 真实的嵌入后端在第一次嵌入时才导入和创建
+        self.use_mock = use_mock
+        self._embeddings = MockEmbeddings() if use_mock else None
+        # 文档登记表：源文件 -> 指纹、文档ID和它拥有的块ID
+        self.documents = {}
+        self._next_id = 0
+
+    @property
+    def embeddings(self):
+        """嵌入模型；真实后端（OpenAI客户端和磁盘缓存）第一次使用时才创建，冷启动不导入langchain_community"""
+        if self._embeddings is None:
+            self._embeddings = self._create_embeddings()
+        return self._embeddings
+
+    @embeddings.setter
+    def embeddings(self, embeddings):
+        self._embeddings = embeddings
+
+    def _create_embeddings(self):
+        from langchain_community.embeddings import OpenAIEmbeddings
+        # 从环境变量获取API密钥
+        openai_api_key = os.getenv("OPENAI_API_KEY")
+        # 重试由BatchedEmbeddings按批次控制，这里关闭客户端自带的重试
+        embeddings = BatchedEmbeddings(OpenAIEmbeddings(
+            model=EMBEDDING_MODEL,
+            api_key=openai_api_key,
+            base_url=EMBEDDING_BASE_URL,
+            max_retries=0
+        ))
+        # 已嵌入过的文本直接从磁盘缓存读取，只有未命中的才调用API
+        if EMBEDDING_CACHE_ENABLED:
+            embeddings = CachedEmbeddings(embeddings, EMBEDDING_MODEL)
+        return embeddings
+
+    def _embeddings_type(self):
+        """当前嵌入模型类型，写入存储以便加载时切换；不为此创建真实的嵌入客户端"""
+        return "mock" if isinstance(self._embeddings, MockEmbeddings) else "real"
+
+    def _dim(self):
+        """当前存储的嵌入维度，空存储返回None"""
+        raise NotImplementedError
+
+    def _normalize(self, vectors):
+        """转换为float32矩阵并按行归一化"""
+        return normalize_vectors(vectors)
+
+    def _embed_texts(self, texts):
+        """嵌入并归一化文本；空列表返回None
+
+        API失败时抛出异常，不把Mock向量写进使用真实嵌入的存储；部分批次失败时已完成的批次在嵌入缓存中，
+        重新导入只请求失败的部分。只有以use_mock创建的存储才回退到MockEmbeddings。
+        """
+        try:
+            # 嵌入文本，本地哈希嵌入直接返回矩阵
+            if isinstance(self.embeddings, HashingEmbeddings):
+                embeddings = self.embeddings.embed_array(texts)
+            else:
+                embeddings = self.embeddings.embed_documents(texts)
+        except PartialEmbeddingError:
+            raise
+        except Exception as e:
+            if not self.use_mock:
+                raise
+            print(f"DeepSeek API调用失败: {str(e)}")
+            print("自动切换到MockEmbeddings...")
+
+            # 切换到MockEmbeddings作为回退
+            self.embeddings = MockEmbeddings(self._dim() or 1536)
+
+            # 使用MockEmbeddings嵌入文本
+            embeddings = self.embeddings.embed_documents(texts)
+
+        if len(texts) == 0:
+            return None
+        return self._normalize(embeddings)
+
+    def _fall_back_to_mock(self, error):
+        """查询嵌入失败时返回本次查询使用的MockEmbeddings，不替换存储（可能在会话之间共享）的嵌入模型"""
+        print(f"DeepSeek API调用失败: {str(error)}")
+        print("本次查询使用MockEmbeddings...")
+        return self._mock_embeddings()
+
+    def _mock_embeddings(self):
+        """回退使用的MockEmbeddings，存储本身使用MockEmbeddings时直接复用"""
+        if isinstance(self._embeddings, MockEmbeddings):
+            return self._embeddings
+        return MockEmbeddings(self._dim() or 1536)
+
+    def _maybe_compact(self):
+        """写操作之后的维护，默认不做任何事"""
+
+    def _reserve(self, rows, dim):
+        """即将写入rows行dim维向量时预先分配内存，默认不做任何事"""
+
+    def add_texts(self, texts, metadatas=None):
+        """将文本块添加到向量存储，metadatas为与文本块对应的元数据字典列表，返回新文本块的ID列表"""
+        vectors = self._embed_texts(texts)
+        if vectors is None:
+            return []
+
+        with self._exclusive():
+            ids = self._add_rows(vectors, texts, metadatas)
+
+        self._maybe_compact()
+        return ids.tolist()
+
+    def delete(self, ids):
+        """按块ID删除文本块，返回实际删除的行数"""
+        with self._exclusive():
+            removed = self._tombstone(ids)
+        self._maybe_compact()
+        return removed
+
+    def _document_key(self, path):
+        return os.path.normpath(path)
+
+    def is_document_current(self, path, content=None):
+        """判断源文档自上次索引后是否未变化
+
+        传入content（待写入的文件内容）时比较大小和内容哈希；否则先比较大小和修改时间，
+        修改时间不同但大小相同时再计算哈希确认。
+        """
+        entry = self.documents.get(self._document_key(path))
+        if entry is None or not os.path.exists(path):
+            return False
+        if content is not None:
+            return len(content) == entry["size"] and hashlib.sha256(content).hexdigest() == entry["sha256"]
+        stat = os.stat(path)
+        if stat.st_size != entry["size"]:
+            return False
+        if stat.st_mtime_ns == entry["mtime_ns"]:
+            return True
+        return file_sha256(path) == entry["sha256"]
+
+    def add_document(self, path, chunks, metadatas=None):
+        """索引一个源文档：新文本块替换该文档原有的文本块，并登记文档指纹，返回新文本块数
+
+        每个文本块的元数据会补充来源路径、文档ID和源文件修改时间；metadatas可提供页码、章节等。
+        """
+        key = self._document_key(path)
+        fingerprint = document_fingerprint(path)
+        vectors = self._embed_texts(chunks)
+
+        with self._exclusive():
+            previous = self.documents.get(key)
+            # 文档ID取首次索引时第一个块ID，重新索引时保持不变
+            document_id = previous.get("document_id", -1) if previous is not None else -1
+            if document_id < 0:
+                document_id = self._next_id
+            document_metadata = {"source": key, "document_id": document_id,
+                                 "modified_at": fingerprint["mtime_ns"] / 1e9}
+            chunk_metadatas = [dict(metadata, **document_metadata) for metadata in (metadatas or [{}] * len(chunks))]
+            if vectors is not None:
+                ids = self._add_rows(vectors, chunks, chunk_metadatas)
+            else:
+                ids = np.empty(0, dtype=np.int64)
+            if previous is not None:
+                self._tombstone(previous["chunk_ids"])
+            entry = dict(fingerprint, document_id=document_id, chunk_ids=ids.tolist())
+            self._save_document(key, entry)
+            self.documents[key] = entry
+
+        self._maybe_compact()
+        return len(ids)
+
+    def add_document_chunks(self, path, chunks, batch_size=STREAM_EMBED_BATCH):
+        """边解析边索引一个源文档，chunks为 (文本块, 元数据) 的迭代器（如DocumentProcessor.iter_chunks）
+
+        解析在后台线程中进行，每凑满一批就嵌入写入，嵌入与解析重叠执行；全部写入后再删除旧文本块并登记文档，
+        中途失败时撤销已写入的新文本块，原有文本块保持不变。替换完成前新旧文本块会短暂同时可检索。返回新文本块数。
+        """
+        key = self._document_key(path)
+        fingerprint = document_fingerprint(path)
+        document_id = None
+        added = []
+        try:
+            for batch in prefetch_batches(chunks, batch_size):
+                texts = [chunk for chunk, _ in batch]
+                vectors = self._embed_texts(texts)
+                with self._exclusive():
+                    if document_id is None:
+                        previous = self.documents.get(key)
+                        document_id = previous.get("document_id", -1) if previous is not None else -1
+                        if document_id < 0:
+                            document_id = self._next_id
+                    document_metadata = {"source": key, "document_id": document_id,
+                                         "modified_at": fingerprint["mtime_ns"] / 1e9}
+                    added.append(self._add_rows(vectors, texts,
+                                                [dict(metadata or {}, **document_metadata) for _, metadata in batch]))
+        except BaseException:
+            if added:
+                with self._exclusive():
+                    self._tombstone(np.concatenate(added))
+            raise
+
+        ids = np.concatenate(added) if added else np.empty(0, dtype=np.int64)
+        with self._exclusive():
+            previous = self.documents.get(key)
+            if document_id is None:
+                document_id = previous.get("document_id", -1) if previous is not None else -1
+            if previous is not None:
+                self._tombstone(previous["chunk_ids"])
+            entry = dict(fingerprint, document_id=document_id, chunk_ids=ids.tolist())
+            self._save_document(key, entry)
+            self.documents[key] = entry
+
+        self._maybe_compact()
+        return len(ids)
+
+    def delete_document(self, path):
+        """从存储中删除一个源文档的全部文本块，返回删除的文本块数"""
+        key = self._document_key(path)
+        with self._exclusive():
+            entry = self.documents.get(key)
+            if entry is None:
+                return 0
+            removed = self._tombstone(entry["chunk_ids"])
+            self._save_document(key, None)
+            del self.documents[key]
+        self._maybe_compact()
+        return removed
+
+    def import_document(self, key, entry):
+        """迁移时登记一个文档，entry中的块ID必须已经导入"""
+        with self._exclusive():
+            self._save_document(key, entry)
+            self.documents[key] = entry
+
+    def export_snapshot(self, path, batch_size=SNAPSHOT_BATCH_ROWS):
+        """导出为自描述的快照文件（格式见snapshot模块），返回导出的行数
+
+        导出期间写操作等待，快照是一致的时间点；行按批流式写出，不在内存中复制整个存储。
+        """
+        with self._exclusive():
+            embeddings_type = self._embeddings_type()
+            header = {"backend": self.name, "embeddings_type": embeddings_type,
+                      "embedding_model": EMBEDDING_MODEL if embeddings_type == "real" else "mock",
+                      "dim": self._dim(), "rows": self.stats()["live"], "created_at": time.time()}
+            return write_snapshot(path, header, self.export_rows(batch_size), self.documents)
+
+    def import_snapshot(self, path):
+        """把快照导入到空存储，返回导入的行数
+
+        逐帧读取并校验，内存占用只与一批行有关；任何校验失败都会清空已导入的部分并抛出SnapshotError。
+        """
+        reader = SnapshotReader(path)
+        try:
+            header = reader.header
+            if self.stats()["live"]:
+                raise ValueError("导入快照的目标存储必须为空")
+            if header.get("embeddings_type") == "mock":
+                self.embeddings = MockEmbeddings(header.get("dim") or 1536)
+            elif header.get("embedding_model") != EMBEDDING_MODEL:
+                raise SnapshotError(f"快照的嵌入模型 {header.get('embedding_model')} 与当前配置 {EMBEDDING_MODEL} 不一致")
+            # 按头部记录的行数一次分配，导入过程中不因扩容而复制已导入的向量
+            self._reserve(int(header.get("rows") or 0), int(header.get("dim") or 0))
+            rows = 0
+            try:
+                for ids, vectors, texts, metadatas in reader.batches():
+                    self.import_rows(ids, vectors, texts, metadatas)
+                    rows += len(ids)
+                for key, entry in reader.documents.items():
+                    self.import_document(key, entry)
+            except BaseException:
+                self.reset()
+                raise
+        finally:
+            reader.close()
+        return rows
+
+    def similarity_search(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K, lambda_mult=MMR_LAMBDA):
+        raise NotImplementedError
+
+    def similarity_search_with_metadata(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K,
+                                        lambda_mult=MMR_LAMBDA):
+        raise NotImplementedError
+
+    def similarity_search_batch(self, queries, k=4, filter=None):
+        raise NotImplementedError
+
+    def count(self):
+        """未删除的文本块数；比stats()轻量，可以在每次页面重新运行时调用"""
+        raise NotImplementedError
+
+    def stats(self):
+        raise NotImplementedError
+
+    def reset(self):
+        raise NotImplementedError
+
+    def close(self):
+        """释放后端持有的资源"""
+
+    def export_rows(self, batch_size=10000):
+        """按批返回未删除的行：(块ID数组, 归一化向量矩阵, 文本列表, 元数据字典列表)"""
+        raise NotImplementedError
+
+    def import_rows(self, ids, vectors, texts, metadatas):
+        """迁移时按原块ID写入一批行，块ID必须大于已有的块ID"""
+        raise NotImplementedError
+
+
+class ExternalBackend(VectorBackend):
+    """由外部引擎保存行的后端的通用实现
+
+    子类实现 _insert(ids, vectors, texts, metadatas)、_remove(ids)、_query(vectors, k, filter)
+    （每个查询返回按得分降序的 (块ID数组, 得分数组)）、_fetch(ids)（按给定顺序返回文本、元数据和向量）、
+    _rows(batch_size)、_count() 和 _clear()。下一个块ID、嵌入类型、维度和文档登记表默认保存在
+    存储目录的状态文件中，子类可以改写 _load_state/_save_state/_save_document/_delete_state。
+    过滤条件中的来源路径在传给 _query 之前已规范化。
+    """
+    name = None
+
+    def __init__(self, use_mock=False, persist_directory=None):
+        super().__init__(use_mock)
+        self.persist_directory = persist_directory
+        self._write_lock = threading.RLock()
+        self._dimension = None
+        self._load_state()
+        # 如果保存的是mock类型，但当前是real类型，切换到mock
+        if self._saved_embeddings_type == "mock" and not isinstance(self._embeddings, MockEmbeddings):
+            print(f"检测到向量存储使用的是MockEmbeddings，自动切换...")
+            self.embeddings = MockEmbeddings(self._dimension or 1536)
+
+    def _state_path(self):
+        return os.path.join(self.persist_directory, STATE_FILE)
+
+    def _load_state(self):
+        state = {}
+        if os.path.exists(self._state_path()):
+            with open(self._state_path(), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        self._next_id = state.get("next_id", 0)
+        self._dimension = state.get("dim")
+        self._saved_embeddings_type = state.get("embeddings_type")
+        self.documents = state.get("documents", {})
+
+    def _save_state(self, documents=None):
+        """原子地写入状态文件"""
+        state = {"next_id": self._next_id, "dim": self._dimension, "embeddings_type": self._embeddings_type(),
+                 "documents": self.documents if documents is None else documents}
+        temp_path = self._state_path() + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, self._state_path())
+
+    def _delete_state(self):
+        if os.path.exists(self._state_path()):
+            os.remove(self._state_path())
+
+    def _dim(self):
+        return self._dimension
+
+    @contextmanager
+    def _exclusive(self):
+        with self._write_lock:
+            yield
+
+    def _add_rows(self, vectors, texts, metadatas=None):
+        ids = np.arange(self._next_id, self._next_id + len(texts), dtype=np.int64)
+        now = time.time()
+        metadatas = [dict({"created_at": now}, **metadata) for metadata in (metadatas or [{}] * len(texts))]
+        self._write_rows(ids, vectors, texts, metadatas)
+        return ids
+
+    def _write_rows(self, ids, vectors, texts, metadatas):
+        # 先保存分配出去的块ID再写入行，写入中途崩溃只会留下未使用的块ID，不会重复分配
+        self._next_id = max(self._next_id, int(ids[-1]) + 1)
+        self._dimension = vectors.shape[1]
+        self._save_state()
+        self._insert(ids, vectors, texts, metadatas)
+
+    def _tombstone(self, ids):
+        if len(ids) == 0:
+            return 0
+        return self._remove(np.asarray(ids, dtype=np.int64))
+
+    def _save_document(self, key, entry):
+        documents = dict(self.documents)
+        if entry is None:
+            documents.pop(key, None)
+        else:
+            documents[key] = entry
+        self._save_state(documents)
+
+    def import_rows(self, ids, vectors, texts, metadatas):
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        with self._exclusive():
+            self._write_rows(ids, self._normalize(vectors), list(texts), metadatas)
+
+    def similarity_search(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K, lambda_mult=MMR_LAMBDA):
+        """根据查询检索最相似的文本块，参数与VectorStore.similarity_search相同"""
+        return [result["text"] for result in self._search(query, k, filter, mmr, fetch_k, lambda_mult)]
+
+    def similarity_search_with_metadata(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K,
+                                        lambda_mult=MMR_LAMBDA):
+        """与similarity_search相同，但每个结果为 {"id", "text", "metadata"}"""
+        return self._search(query, k, filter, mmr, fetch_k, lambda_mult)
+
+    def _embed_query(self, query):
+        try:
+            return self._normalize(self.embeddings.embed_query(query))
+        except Exception as e:
+            return self._normalize(self._fall_back_to_mock(e).embed_query(query))
+
+    def _normalize_filter(self, filter):
+        """来源路径按文档登记表的方式规范化，与VectorStore的过滤语义一致"""
+        if not filter or "source" not in filter or callable(filter["source"]):
+            return filter
+        filter = dict(filter)
+        sources = filter["source"]
+        if isinstance(sources, (list, tuple, set, frozenset)):
+            filter["source"] = [self._document_key(source) for source in sources]
+        else:
+            filter["source"] = self._document_key(sources)
+        return filter
+
+    def _ranked_ids(self, query, query_vector, k, filter):
+        """检索的候选块ID（按相关性降序），默认只用向量检索"""
+        return self._query(query_vector, k, filter)[0][0]
+
+    @contextmanager
+    def _reading(self):
+        """检索时从查询到取回结果的一致性范围，默认不加锁"""
+        yield
+
+    def _maybe_refresh(self):
+        """检索前读入其他进程的变化，默认不做任何事"""
+
+    def _search(self, query, k, filter, mmr, fetch_k, lambda_mult):
+        self._maybe_refresh()
+        if not self._count():
+            return []
+        # 嵌入查询（可能调用API）在_reading之外进行
+        query_vector = self._embed_query(query)
+        with self._reading():
+            ids = self._ranked_ids(query, query_vector, max(k, fetch_k) if mmr else k,
+                                   self._normalize_filter(filter))
+            texts, metadatas, vectors = self._fetch(ids)
+        order = np.arange(len(ids))
+        if mmr and len(ids) > 1:
+            order = maximal_marginal_relevance(query_vector[0], vectors, k, lambda_mult)
+        return [{"id": int(ids[i]), "text": texts[i], "metadata": metadatas[i]} for i in order[:k]]
+
+    def similarity_search_batch(self, queries, k=4, filter=None):
+        """批量检索多个查询，返回格式与VectorStore.similarity_search_batch相同"""
+        queries = list(queries)
+        if not queries:
+            return []
+        self._maybe_refresh()
+        if not self._count():
+            return [{"ids": [], "scores": [], "texts": []} for _ in queries]
+        try:
+            query_vectors = self.embeddings.embed_documents(queries)
+        except Exception as e:
+            query_vectors = self._fall_back_to_mock(e).embed_documents(queries)
+        results = []
+        with self._reading():
+            for ids, scores in self._query(self._normalize(query_vectors), k, self._normalize_filter(filter)):
+                texts, _, _ = self._fetch(ids)
+                results.append({"ids": ids.tolist(), "scores": scores.tolist(), "texts": texts})
+        return results
+
+    def count(self):
+        self._maybe_refresh()
+        return self._count()
+
+    def stats(self):
+        """存储统计：后端名称和行数；外部引擎直接删除行，没有待合并的已删除行"""
+        return {"backend": self.name, "live": self._count(), "dead": 0, "dead_fraction": 0.0}
+
+    def reset(self):
+        """重置向量存储"""
+        with self._exclusive():
+            self._clear()
+            self.documents = {}
+            self._next_id = 0
+            self._dimension = None
+            self._delete_state()
+
+    def export_rows(self, batch_size=10000):
+        return self._rows(batch_size)
@@ -0,0 +1,545 @@
+"""向量存储的磁盘格式
+
+目录结构（FORMAT_VERSION = 2）:
+    manifest.json          清单：格式版本、代号、维度、行数、下一个块ID、嵌入类型，原子替换写入，是唯一的提交点
+    vectors-<代号>.f32     行优先的原始float32矩阵（每行已归一化），用np.memmap只读映射
+    texts-<代号>.bin       所有文本块UTF-8编码后的拼接
+    offsets-<代号>.i64     int64偏移数组（行数+1个），第i个文本为 texts[offsets[i]:offsets[i+1]]
+    ids-<代号>.i64         每行的块ID，严格递增且永不复用
+    documents-<代号>.json  文档登记表：每个源文件的指纹和它拥有的块ID
+    tombstones-<代号>.i64  已删除（尚未从基础文件中清除）的块ID
+    log-<代号>.wal         只追加的日志段：新增、删除、文档登记变化各写入一条带CRC校验的记录并fsync
+    ivf-<代号>.npz         可选的近似最近邻索引（质心和每行所属的倒排列表）
+    quant-<代号>.npz       可选的量化器参数和每行的量化编码
+    bm25-<代号>.npz        BM25倒排索引（词项、倒排列表和每行的词项数）
+    metadata-<代号>.npz    每行的元数据列（来源、章节、页码、文档ID、时间戳）
+
+加载时只映射文件、不读取内容，冷启动时间与语料大小基本无关，
+同一份存储被多个进程打开时共享操作系统页缓存。
+变化只追加到日志段，compact()把基础文件和日志段合并为新一代文件后原子替换清单。
+多个进程写同一份存储时用目录中的write.lock文件锁互斥；其他进程通过清单的代号和日志段的长度
+发现变化，只需重新映射新一代文件或重放日志段尾部的新记录。
+格式版本1没有块ID、登记表和删除记录，加载后会被合并升级为当前版本。
+"""
+from contextlib import contextmanager
+import json
+import os
+import pickle
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:
+    # Windows没有fcntl，使用msvcrt的字节锁
+    fcntl = None
+    import msvcrt
+
+# 磁盘格式版本号，格式变化时递增
+FORMAT_VERSION = 2
+
+MANIFEST_FILE = "manifest.json"
+# 写者之间互斥的锁文件
+LOCK_FILE = "write.lock"
+# 旧版本使用的单文件pickle存储
+LEGACY_PICKLE_FILE = "vector_store.pkl"
+
+# 写文件时每批处理的行数，避免一次性复制整个矩阵
+WRITE_BATCH_ROWS = 8192
+
+# 数据文件种类及扩展名
+DATA_FILE_SUFFIXES = {"vectors": "f32", "texts": "bin", "offsets": "i64", "ids": "i64",
+                      "documents": "json", "tombstones": "i64", "log": "wal", "ivf": "npz",
+                      "quant": "npz", "bm25": "npz",
+                      "metadata": "npz"}
+
+# 日志记录头：魔数、记录类型、条目数、负载字节数、负载CRC32
+LOG_RECORD_MAGIC = b"VSL2"
+LOG_HEADER = struct.Struct("<4sBIQI")
+# 日志记录类型
+LOG_ADD = 1
+LOG_DELETE = 2
+LOG_DOCUMENT = 3
+
+# 格式版本1的日志记录头：魔数、行数、向量维度、负载字节数、负载CRC32
+LOG_RECORD_MAGIC_V1 = b"VSLG"
+LOG_HEADER_V1 = struct.Struct("<4sIIQI")
+
+
+def _lock_file(f, blocking):
+    """对打开的锁文件加排他锁，blocking=False时取不到锁返回False"""
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    f.seek(0)
+    while True:
+        try:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+            return True
+        except OSError:
+            if not blocking:
+                return False
+            time.sleep(0.05)
+
+
+def _unlock_file(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def _data_file(directory, kind, generation):
+    """返回指定代号的数据文件路径"""
+    return os.path.join(directory, f"{kind}-{generation:06d}.{DATA_FILE_SUFFIXES[kind]}")
+
+
+def _is_data_file(name):
+    """判断文件名是否为某一代的数据文件"""
+    return name.partition("-")[0] in DATA_FILE_SUFFIXES
+
+
+def write_json_atomic(path, data):
+    """先写临时文件并fsync，再原子替换目标文件"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class LazyTexts:
+    """按需解码的文本序列：磁盘部分通过偏移数组惰性读取，新增部分保存在内存列表中"""
+    def __init__(self, blob=None, offsets=None):
+        self._blob = blob
+        self._offsets = offsets
+        self._base_count = len(offsets) - 1 if offsets is not None else 0
+        self._tail = []
+
+    def __len__(self):
+        return self._base_count + len(self._tail)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("文本下标越界")
+        if index < self._base_count:
+            start, end = self._offsets[index], self._offsets[index + 1]
+            return bytes(self._blob[start:end]).decode("utf-8")
+        return self._tail[index - self._base_count]
+
+    def __iter__(self):
+        for i in range(self._base_count):
+            yield self[i]
+        yield from self._tail
+
+    def __eq__(self, other):
+        return list(self) == list(other)
+
+    def append(self, text):
+        self._tail.append(text)
+
+    def extend(self, texts):
+        self._tail.extend(texts)
+
+
+class MmapVectorStorage:
+    """基于内存映射的向量存储文件读写"""
+    def __init__(self, directory):
+        self.directory = directory
+        self.manifest_path = os.path.join(directory, MANIFEST_FILE)
+        self.manifest = None
+        # 已加载清单的文件状态，用来廉价地判断清单是否被其他进程替换
+        self._manifest_stat = None
+        # 文件锁可在同一线程内重入，锁文件只在持有期间打开
+        self._lock = threading.RLock()
+        self._lock_depth = 0
+        self._lock_handle = None
+        # 日志段中最后一条完整记录的结束位置，之后的字节视为崩溃残留
+        self._log_end = 0
+
+    def exists(self):
+        """磁盘上是否已有新格式的存储"""
+        return os.path.exists(self.manifest_path)
+
+    @contextmanager
+    def lock(self, blocking=True):
+        """写者之间的排他锁：线程之间用进程内的锁，进程之间用锁文件；产出是否取得了锁"""
+        if not self._lock.acquire(blocking=blocking):
+            yield False
+            return
+        try:
+            if self._lock_depth == 0:
+                handle = open(os.path.join(self.directory, LOCK_FILE), "a+b")
+                if not _lock_file(handle, blocking):
+                    handle.close()
+                    yield False
+                    return
+                self._lock_handle = handle
+            self._lock_depth += 1
+            try:
+                yield True
+            finally:
+                self._lock_depth -= 1
+                if self._lock_depth == 0:
+                    _unlock_file(self._lock_handle)
+                    self._lock_handle.close()
+                    self._lock_handle = None
+        finally:
+            self._lock.release()
+
+    def _stat_manifest(self):
+        try:
+            stat = os.stat(self.manifest_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _commit_manifest(self, manifest):
+        """原子替换清单，并记录它的文件状态"""
+        write_json_atomic(self.manifest_path, manifest)
+        self.manifest = manifest
+        self._manifest_stat = self._stat_manifest()
+
+    def has_new_generation(self):
+        """磁盘上的清单是否已切换到与已加载的不同的一代（或被删除）；文件状态未变时不解析清单"""
+        stat = self._stat_manifest()
+        if stat is None or self.manifest is None:
+            return (stat is None) != (self.manifest is None)
+        if stat == self._manifest_stat:
+            return False
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return manifest["generation"] != self.manifest["generation"]
+
+    def has_pending_log(self):
+        """当前代的日志段中是否有尚未读取的记录（由其他进程追加）"""
+        if self.manifest is None:
+            return False
+        try:
+            size = os.path.getsize(_data_file(self.directory, "log", self.manifest["generation"]))
+        except OSError:
+            return False
+        return size > self._log_end
+
+    @property
+    def log_end(self):
+        """已读取或写入的日志段末尾位置"""
+        return self._log_end
+
+    def load(self):
+        """映射已保存的存储，返回 (清单, 向量矩阵或None, 文本序列, 块ID数组)"""
+        stat = self._stat_manifest()
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version", 0) > FORMAT_VERSION:
+            raise ValueError(f"不支持的向量存储格式版本: {manifest.get('format_version')}")
+        self.manifest = manifest
+        self._manifest_stat = stat
+        self._log_end = 0
+
+        count = manifest["count"]
+        if count == 0:
+            return manifest, None, LazyTexts(), np.empty(0, dtype=np.int64)
+
+        generation = manifest["generation"]
+        vectors = np.memmap(_data_file(self.directory, "vectors", generation), dtype=np.float32,
+                            mode="r", shape=(count, manifest["dim"]))
+        offsets = np.memmap(_data_file(self.directory, "offsets", generation), dtype=np.int64,
+                            mode="r", shape=(count + 1,))
+        text_bytes = int(offsets[count])
+        if text_bytes > 0:
+            blob = np.memmap(_data_file(self.directory, "texts", generation), dtype=np.uint8,
+                             mode="r", shape=(text_bytes,))
+        else:
+            blob = np.empty(0, dtype=np.uint8)
+        if manifest["format_version"] >= 2:
+            ids = np.fromfile(_data_file(self.directory, "ids", generation), dtype=np.int64, count=count)
+        else:
+            ids = np.arange(count, dtype=np.int64)
+        return manifest, vectors, LazyTexts(blob, offsets), ids
+
+    def load_documents(self):
+        """读取当前代的文档登记表"""
+        path = _data_file(self.directory, "documents", self.manifest["generation"])
+        if not os.path.exists(path):
+            return {}
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def load_tombstones(self):
+        """读取当前代基础文件中已删除的块ID"""
+        path = _data_file(self.directory, "tombstones", self.manifest["generation"])
+        if not os.path.exists(path):
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(path, dtype=np.int64)
+
+    def read_log(self, start=0):
+        """按顺序读取当前日志段中从start开始的完整记录
+
+        逐条返回 ("add", 块ID, 向量矩阵, 文本列表, 元数据列表或None)、("delete", 块ID)
+        或 ("document", 文件键, 登记信息)。
+        遇到不完整或校验失败的记录即停止，该位置之后的内容会在下次追加时被覆盖。
+        """
+        self._log_end = start
+        log_path = _data_file(self.directory, "log", self.manifest["generation"])
+        if not os.path.exists(log_path):
+            return
+        if self.manifest.get("format_version", 1) < 2:
+            yield from self._read_log_v1(log_path)
+            return
+        with open(log_path, "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(LOG_HEADER.size)
+                if len(header) < LOG_HEADER.size:
+                    break
+                magic, record_type, count, payload_size, checksum = LOG_HEADER.unpack(header)
+                if magic != LOG_RECORD_MAGIC:
+                    break
+                payload = f.read(payload_size)
+                if len(payload) < payload_size or zlib.crc32(payload) != checksum:
+                    break
+                self._log_end = f.tell()
+                if record_type == LOG_ADD:
+                    yield ("add", *self._decode_add_payload(payload, count))
+                elif record_type == LOG_DELETE:
+                    yield "delete", np.frombuffer(payload, dtype=np.int64, count=count)
+                elif record_type == LOG_DOCUMENT:
+                    record = json.loads(payload.decode("utf-8"))
+                    yield "document", record["key"], record["entry"]
+
+    def _read_log_v1(self, log_path):
+        """读取格式版本1的日志段：只有新增记录，块ID即行号"""
+        next_id = self.manifest["count"]
+        with open(log_path, "rb") as f:
+            while True:
+                header = f.read(LOG_HEADER_V1.size)
+                if len(header) < LOG_HEADER_V1.size:
+                    break
+                magic, count, dim, payload_size, checksum = LOG_HEADER_V1.unpack(header)
+                payload = f.read(payload_size)
+                if magic != LOG_RECORD_MAGIC_V1 or len(payload) < payload_size or zlib.crc32(payload) != checksum:
+                    break
+                self._log_end = f.tell()
+                vectors = np.frombuffer(payload, dtype=np.float32, count=count * dim).reshape(count, dim)
+                texts, _ = self._decode_texts(payload, count, count * dim * 4)
+                yield "add", np.arange(next_id, next_id + count, dtype=np.int64), vectors, texts, None
+                next_id += count
+
+    def _decode_add_payload(self, payload, count):
+        """解析新增记录：维度、块ID、向量、各文本字节长度、文本字节，以及可选的元数据JSON"""
+        dim = struct.unpack_from("<I", payload)[0]
+        ids = np.frombuffer(payload, dtype=np.int64, count=count, offset=4)
+        position = 4 + count * 8
+        vectors = np.frombuffer(payload, dtype=np.float32, count=count * dim, offset=position).reshape(count, dim)
+        texts, position = self._decode_texts(payload, count, position + count * dim * 4)
+        metadatas = json.loads(payload[position:].decode("utf-8")) if position < len(payload) else None
+        return ids, vectors, texts, metadatas
+
+    def _decode_texts(self, payload, count, position):
+        """从position开始解析 count个uint32长度 + 文本字节，返回 (文本列表, 结束位置)"""
+        lengths = np.frombuffer(payload, dtype=np.uint32, count=count, offset=position)
+        position += count * 4
+        texts = []
+        for length in lengths:
+            texts.append(payload[position:position + length].decode("utf-8"))
+            position += int(length)
+        return texts, position
+
+    def _ensure_generation(self, dim, embeddings_type):
+        """空存储先建立一个不含基础数据的新一代；嵌入类型变化时更新清单"""
+        if self.manifest is None:
+            self.write([], [], [], dim, embeddings_type, next_id=0)
+        elif embeddings_type is not None and self.manifest.get("embeddings_type") != embeddings_type:
+            self._commit_manifest(dict(self.manifest, embeddings_type=embeddings_type))
+
+    def _append_record(self, record_type, count, payload):
+        """把一条记录追加到日志段并fsync"""
+        header = LOG_HEADER.pack(LOG_RECORD_MAGIC, record_type, count, len(payload), zlib.crc32(payload))
+        log_path = _data_file(self.directory, "log", self.manifest["generation"])
+        with open(log_path, "r+b" if os.path.exists(log_path) else "wb") as f:
+            # 覆盖上次崩溃可能留下的半条记录
+            f.seek(self._log_end)
+            f.write(header)
+            f.write(payload)
+            f.truncate()
+            f.flush()
+            os.fsync(f.fileno())
+            self._log_end = f.tell()
+
+    def append(self, ids, vectors, texts, embeddings_type, metadatas=None):
+        """把新增的块（及其元数据）作为一条记录追加到日志段，代价只与新增数据量有关"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self._ensure_generation(vectors.shape[1], embeddings_type)
+        encoded = [text.encode("utf-8") for text in texts]
+        payload = b"".join([
+            struct.pack("<I", vectors.shape[1]),
+            np.asarray(ids, dtype=np.int64).tobytes(),
+            vectors.tobytes(),
+            np.array([len(data) for data in encoded], dtype=np.uint32).tobytes(),
+            *encoded,
+            json.dumps(metadatas, ensure_ascii=False).encode("utf-8") if metadatas is not None else b""
+        ])
+        self._append_record(LOG_ADD, len(vectors), payload)
+
+    def append_delete(self, ids):
+        """记录一批块ID被删除（墓碑）"""
+        ids = np.asarray(ids, dtype=np.int64)
+        self._ensure_generation(0, None)
+        self._append_record(LOG_DELETE, len(ids), ids.tobytes())
+
+    def append_document(self, key, entry):
+        """记录文档登记表的一次变化，entry为None表示移除该文档"""
+        self._ensure_generation(0, None)
+        payload = json.dumps({"key": key, "entry": entry}, ensure_ascii=False).encode("utf-8")
+        self._append_record(LOG_DOCUMENT, 1, payload)
+
+    def write(self, vector_blocks, texts, ids, dim, embeddings_type, next_id, documents=None, deleted_ids=None,
+              metadata=None):
+        """把全部数据写成新一代文件（日志段为空），最后原子替换清单完成切换
+
+        metadata为元数据列的数组字典，与向量文件一样在清单切换之前写入。
+        """
+        generation = self._next_generation()
+
+        count = 0
+        with open(_data_file(self.directory, "vectors", generation), "wb") as f:
+            for block in vector_blocks:
+                for start in range(0, len(block), WRITE_BATCH_ROWS):
+                    rows = np.ascontiguousarray(block[start:start + WRITE_BATCH_ROWS], dtype=np.float32)
+                    f.write(rows.tobytes())
+                    count += len(rows)
+            f.flush()
+            os.fsync(f.fileno())
+
+        offsets = np.zeros(count + 1, dtype=np.int64)
+        with open(_data_file(self.directory, "texts", generation), "wb") as f:
+            position = 0
+            for i, text in enumerate(texts):
+                data = text.encode("utf-8")
+                f.write(data)
+                position += len(data)
+                offsets[i + 1] = position
+            f.flush()
+            os.fsync(f.fileno())
+
+        self._write_file(_data_file(self.directory, "offsets", generation), offsets.tobytes())
+
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) != count:
+            raise ValueError(f"块ID数量 {len(ids)} 与行数 {count} 不一致")
+        self._write_file(_data_file(self.directory, "ids", generation), ids.tobytes())
+        self._write_file(_data_file(self.directory, "documents", generation),
+                         json.dumps(documents or {}, ensure_ascii=False).encode("utf-8"))
+        self._write_file(_data_file(self.directory, "tombstones", generation),
+                         np.asarray(deleted_ids if deleted_ids is not None else [], dtype=np.int64).tobytes())
+        if metadata is not None:
+            self._save_npz(_data_file(self.directory, "metadata", generation), metadata)
+
+        manifest = {
+            "format_version": FORMAT_VERSION,
+            "generation": generation,
+            "dim": int(dim),
+            "count": count,
+            "next_id": int(next_id),
+            "embeddings_type": embeddings_type
+        }
+        self._commit_manifest(manifest)
+        self._log_end = 0
+        self.remove_stale_files()
+        return manifest
+
+    def _write_file(self, path, data):
+        with open(path, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def save_arrays(self, kind, **arrays):
+        """把附属于当前代的若干数组保存为npz文件（原子替换）"""
+        self._save_npz(_data_file(self.directory, kind, self.manifest["generation"]), arrays)
+
+    def _save_npz(self, path, arrays):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, **arrays)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def load_arrays(self, kind):
+        """读取附属于当前代的npz文件，不存在时返回None"""
+        path = _data_file(self.directory, kind, self.manifest["generation"])
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            return {name: data[name] for name in data.files}
+
+    def _next_generation(self):
+        """新一代的代号：大于清单和目录中已有的任何代号，避免覆盖仍被映射的旧文件"""
+        generation = (self.manifest or {}).get("generation", 0)
+        for name in os.listdir(self.directory):
+            rest = name.partition("-")[2]
+            if _is_data_file(name) and rest.split(".")[0].isdigit():
+                generation = max(generation, int(rest.split(".")[0]))
+        return generation + 1
+
+    def remove_stale_files(self):
+        """删除不属于当前代号的数据文件"""
+        if self.manifest is None:
+            return
+        current = {os.path.basename(_data_file(self.directory, kind, self.manifest["generation"]))
+                   for kind in DATA_FILE_SUFFIXES}
+        for name in os.listdir(self.directory):
+            if _is_data_file(name) and name not in current:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    # Windows下仍被其他进程映射的文件无法删除，留待下次清理
+                    pass
+
+    def delete(self):
+        """删除清单和全部数据文件"""
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+        self.manifest = None
+        self._manifest_stat = None
+        self._log_end = 0
+        for name in os.listdir(self.directory):
+            if _is_data_file(name):
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+
+    def legacy_pickle_path(self):
+        """旧版pickle存储的路径"""
+        return os.path.join(self.directory, LEGACY_PICKLE_FILE)
+
+    def read_legacy_pickle(self):
+        """读取旧版pickle存储，返回 (文本列表, 嵌入列表, 嵌入类型)"""
+        with open(self.legacy_pickle_path(), "rb") as f:
+            data = pickle.load(f)
+        return data["texts"], data["embeddings_list"], data.get("embeddings_type", "real")
+
+    def retire_legacy_pickle(self):
+        """迁移完成后把旧pickle重命名为备份文件"""
+        os.replace(self.legacy_pickle_path(), self.legacy_pickle_path() + ".migrated")
@@ -1,185 +1,1122 @@
-from langchain_community.embeddings import OpenAIEmbeddings
-from langchain.embeddings.base import Embeddings
+from contextlib import contextmanager
 import numpy as np
 import os
-import pickle
-from dotenv import load_dotenv
-from config import EMBEDDING_MODEL, VECTOR_STORE_PATH, EMBEDDING_BASE_URL
-
-# 加载.env文件
-load_dotenv()
+import threading
+import time
+from config import (VECTOR_STORE_PATH, VECTOR_BACKEND, CHROMA_STORE_PATH, SQLITE_STORE_PATH,
+                    COMPACT_MIN_LOG_ROWS, COMPACT_LOG_RATIO, BACKGROUND_COMPACTION,
+                    COMPACT_MIN_DEAD_ROWS, COMPACT_DEAD_RATIO,
+                    SEARCH_ENGINE, IVF_NLIST, IVF_NPROBE, IVF_MIN_TRAIN_ROWS,
+                    QUANTIZATION, PQ_SUBSPACES, QUANTIZATION_MIN_TRAIN_ROWS, RESCORE_FACTOR,
+                    HYBRID_SEARCH, HYBRID_CANDIDATES, RRF_K, MMR_FETCH_K, MMR_LAMBDA,
+                    SEARCH_SHARDS, SHARD_MIN_ROWS, STORE_REFRESH_INTERVAL)
+from vector_storage import MmapVectorStorage, LazyTexts, FORMAT_VERSION, WRITE_BATCH_ROWS
+from quantization import create_quantizer, sample_rows, MAX_TRAIN_SAMPLES
+from lexical_index import BM25Index, reciprocal_rank_fusion
+from chunk_metadata import MetadataTable
+from sharded_search import ShardedSearcher, top_k_matrix
+from rw_lock import ReadWriteLock
+from vector_backends import VectorBackend, MockEmbeddings, maximal_marginal_relevance
 
 # 确保向量存储目录存在
 os.makedirs(VECTOR_STORE_PATH, exist_ok=True)
 
-class MockEmbeddings(Embeddings):
-    """用于测试的Mock Embeddings类"""
-    def __init__(self, embedding_dim=1536):
-        self.embedding_dim = embedding_dim
+# 嵌入矩阵首次分配的最小行数，之后按倍数扩容
+MIN_MATRIX_CAPACITY = 1024
+# 批量检索时每个查询块得分矩阵的最大元素数，限制临时内存（float32约64MB）
+BATCH_SCORE_ELEMENTS = 1 << 24
+
+# 进程内共享的向量存储实例：(后端, 存储路径的绝对路径, use_mock) -> 向量存储
+_shared_stores = {}
+_shared_stores_lock = threading.Lock()
+# 各后端的默认存储路径
+BACKEND_PATHS = {"numpy": VECTOR_STORE_PATH, "chroma": CHROMA_STORE_PATH, "sqlite": SQLITE_STORE_PATH}
+
+
+def create_vector_store(backend=None, use_mock=False, persist_directory=None):
+    """按名称创建向量存储后端，默认使用配置中的VECTOR_BACKEND；外部引擎的模块在选用时才导入"""
+    backend = backend or VECTOR_BACKEND
+    if backend == "numpy":
+        return VectorStore(use_mock=use_mock, persist_directory=persist_directory)
+    if backend == "chroma":
+        from chroma_store import ChromaVectorStore
+        return ChromaVectorStore(use_mock=use_mock, persist_directory=persist_directory)
+    if backend == "sqlite":
+        from sqlite_store import SQLiteVectorStore
+        return SQLiteVectorStore(use_mock=use_mock, persist_directory=persist_directory)
+    raise ValueError(f"不支持的向量存储后端: {backend}")
+
+
+def get_shared_store(use_mock=False, persist_directory=None, backend=None):
+    """返回进程内共享的向量存储，同一后端和存储路径只加载一次，所有会话和线程共用"""
+    backend = backend or VECTOR_BACKEND
+    key = (backend, os.path.abspath(persist_directory or BACKEND_PATHS.get(backend, VECTOR_STORE_PATH)), use_mock)
+    with _shared_stores_lock:
+        store = _shared_stores.get(key)
+        if store is None:
+            store = _shared_stores[key] = create_vector_store(backend, use_mock, persist_directory)
+        return store
+
+
+class IVFIndex:
+    """IVF-Flat近似最近邻索引
+
+    用球面k-means把归一化向量划分到nlist个倒排列表，检索时只对与查询最近的
+    nprobe个列表中的行做精确打分。assignments与存储中的行一一对应，新增行只需分配列表。
+    """
+    # k-means训练时每个列表平均使用的样本数
+    SAMPLES_PER_LIST = 32
+    KMEANS_ITERATIONS = 10
+    # 分配列表时每批处理的行数
+    ASSIGN_BATCH_ROWS = 16384
+    
+    def __init__(self, nlist=0, nprobe=IVF_NPROBE):
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        # 训练时的行数，行数增长过多时重新训练
+        self.trained_rows = 0
+        # 按列表分组后的行号及每个列表的起止位置，惰性构建
+        self._lists = None
+    
+    @property
+    def trained(self):
+        return self.centroids is not None
+    
+    def sample_size(self, rows):
+        """训练rows行的存储时使用的样本行数"""
+        return min(rows, self._nlist(rows) * self.SAMPLES_PER_LIST)
+    
+    def _nlist(self, rows):
+        return min(self.nlist or max(1, int(np.sqrt(rows))), rows)
+    
+    def train(self, sample, rows, seed=0):
+        """在抽样向量上训练质心，rows为存储的总行数；之后由assign_blocks为全部行分配列表"""
+        sample = np.asarray(sample, dtype=np.float32)
+        nlist = min(self._nlist(rows), len(sample))
+        rng = np.random.default_rng(seed)
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            labels = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, sample)
+            # 空列表保留原质心
+            empty = ~sums.any(axis=1)
+            sums[empty] = centroids[empty]
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids = sums / norms
+        
+        self.centroids = centroids.astype(np.float32)
+        self.trained_rows = rows
+        self.assignments = np.empty(0, dtype=np.int32)
+        self._lists = None
+    
+    def assign_blocks(self, blocks):
+        """按行顺序逐块为全部行分配列表，不拼接整个矩阵"""
+        self.assignments = np.concatenate([self._assign(block) for block in blocks] or
+                                          [np.empty(0, dtype=np.int32)])
+        self._lists = None
+    
+    def _assign(self, vectors):
+        """为每行分配最近的质心"""
+        labels = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), self.ASSIGN_BATCH_ROWS):
+            batch = vectors[start:start + self.ASSIGN_BATCH_ROWS]
+            labels[start:start + len(batch)] = np.argmax(batch @ self.centroids.T, axis=1)
+        return labels
+    
+    def add(self, vectors):
+        """增量加入新行：只计算它们所属的列表"""
+        if len(vectors) == 0:
+            return
+        self.assignments = np.concatenate([self.assignments, self._assign(vectors)])
+        self._lists = None
+    
+    def candidates(self, query, nprobe=None):
+        """返回与查询最近的nprobe个倒排列表中的全部行号（升序）"""
+        lists = self._lists
+        if lists is None or lists[0].shape[0] != len(self.assignments):
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            lists = self._lists = (order, bounds)
+        order, bounds = lists
+        
+        nprobe = min(nprobe or self.nprobe, len(self.centroids))
+        probes = np.argpartition(-(self.centroids @ query), nprobe - 1)[:nprobe]
+        rows = np.concatenate([order[bounds[p]:bounds[p + 1]] for p in probes])
+        rows.sort()
+        return rows
     
-    def embed_documents(self, texts):
-        """返回随机向量作为文档嵌入"""
-        return [np.random.rand(self.embedding_dim).tolist() for _ in texts]
+    def to_arrays(self):
+        return {
+            "centroids": self.centroids,
+            "assignments": self.assignments,
+            "trained_rows": np.array(self.trained_rows, dtype=np.int64)
+        }
     
-    def embed_query(self, text):
-        """返回随机向量作为查询嵌入"""
-        return np.random.rand(self.embedding_dim).tolist()
+    def load_arrays(self, arrays):
+        self.centroids = arrays["centroids"]
+        self.assignments = arrays["assignments"]
+        self.trained_rows = int(arrays["trained_rows"])
+        self._lists = None
 
-class VectorStore:
-    def __init__(self, use_mock=False):
+
+class VectorStore(VectorBackend):
+    """NumPy引擎：基础数据文件内存映射，日志段中的新增行保存在内存矩阵中"""
+    name = "numpy"
+    
+    def __init__(self, use_mock=False, persist_directory=None, search_engine=None, quantization=None,
+                 search_shards=None):
         """初始化向量存储"""
-        if use_mock:
-            self.embeddings = MockEmbeddings()
-        else:
-            # 从环境变量获取API密钥
-            openai_api_key = os.getenv("OPENAI_API_KEY")
-            self.embeddings = OpenAIEmbeddings(
-                model=EMBEDDING_MODEL,
-                api_key=openai_api_key,
-                base_url=EMBEDDING_BASE_URL
-            )
-        
-        # 使用内存存储，支持持久化
-        self.texts = []
-        self.embeddings_list = []
+        super().__init__(use_mock)
+        
+        # 磁盘存储目录，默认使用配置中的路径
+        self.persist_directory = persist_directory or VECTOR_STORE_PATH
+        os.makedirs(self.persist_directory, exist_ok=True)
+        self._storage = MmapVectorStorage(self.persist_directory)
+        # 写操作（追加、合并、重置）互斥；进程之间另由存储目录中的文件锁互斥
+        self._write_lock = threading.RLock()
+        # 检索持有读锁，写操作只在发布新的内存状态时短暂持有写锁，检索不会等待嵌入和写盘
+        self._rw_lock = ReadWriteLock()
+        # 上次检查其他进程提交的变化的时间
+        self._last_refresh = 0.0
+        self._compaction_thread = None
+        
+        # 检索引擎：精确检索始终可用，作为近似检索的参照
+        self.search_engine = search_engine or SEARCH_ENGINE
+        if self.search_engine not in ("exact", "ivf"):
+            raise ValueError(f"不支持的检索引擎: {self.search_engine}")
+        # 可选的嵌入压缩，启用后检索只扫描内存中的量化编码
+        self.quantization = quantization or QUANTIZATION
+        if self.quantization not in (None, "int8", "pq"):
+            raise ValueError(f"不支持的量化方式: {self.quantization}")
+        # 精确检索的分片进程数，进程池在第一次需要时启动并常驻
+        self.search_shards = SEARCH_SHARDS if search_shards is None else search_shards
+        self._shard_searcher = None
+        self._shard_lock = threading.Lock()
+        
+        self._clear_memory()
         
         # 尝试加载已保存的向量存储
         self._load_vector_store()
     
-    def _cosine_similarity(self, a, b):
-        """计算余弦相似度"""
-        a = np.array(a)
-        b = np.array(b)
-        return np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b))
+    def _clear_memory(self):
+        """清空内存中的文本和向量"""
+        # 文本序列：已落盘部分惰性读取，新增部分在内存中
+        self.texts = LazyTexts()
+        # 基础数据文件中的向量，只读内存映射
+        self._base_vectors = None
+        # 预分配、可增长的float32嵌入矩阵，保存日志段中（尚未合并进基础文件）的向量，
+        # 行向量在插入时已归一化，只有前 self._count 行有效
+        self._matrix = None
+        self._count = 0
+        # 近似最近邻索引，仅在search_engine="ivf"时使用
+        self._ivf = self._new_ann_index()
+        # 量化器及与行一一对应的量化编码
+        self._quantizer = create_quantizer(self.quantization, PQ_SUBSPACES)
+        self._codes = None
+        # BM25倒排索引，行号与向量行一一对应
+        self._lexical = BM25Index() if HYBRID_SEARCH else None
+        # 与行一一对应的元数据列（来源、章节、页码、文档ID、时间戳）
+        self._metadata = MetadataTable()
+        # 与行一一对应的块ID（严格递增、永不复用）和删除标记
+        self._ids = np.empty(0, dtype=np.int64)
+        self._deleted = np.zeros(0, dtype=bool)
+        self._deleted_count = 0
+        self._next_id = 0
+        # 本进程中合并清除已删除行释放的字节数
+        self._reclaimed_bytes = 0
+        # 文档登记表：源文件 -> 指纹和它拥有的块ID
+        self.documents = {}
     
-    def add_texts(self, texts):
-        """将文本块添加到向量存储"""
-        try:
-            # 嵌入文本
-            embeddings = self.embeddings.embed_documents(texts)
-            
-            # 存储文本和嵌入
-            self.texts.extend(texts)
-            self.embeddings_list.extend(embeddings)
-            
-            # 保存向量存储到磁盘
-            self._save_vector_store()
-        except Exception as e:
-            print(f"DeepSeek API调用失败: {str(e)}")
-            print("自动切换到MockEmbeddings...")
+    def _new_ann_index(self):
+        """按检索引擎配置创建空的近似最近邻索引"""
+        return IVFIndex(IVF_NLIST, IVF_NPROBE) if self.search_engine == "ivf" else None
+    
+    def _vector_blocks(self):
+        """按行顺序返回所有非空的向量块（磁盘部分在前，新增部分在后）"""
+        blocks = []
+        if self._base_vectors is not None and len(self._base_vectors):
+            blocks.append(self._base_vectors)
+        if self._count:
+            blocks.append(self._matrix[:self._count])
+        return blocks
+    
+    def _dim(self):
+        """当前存储的嵌入维度，空存储返回None"""
+        blocks = self._vector_blocks()
+        return blocks[0].shape[1] if blocks else None
+    
+    def _gather_rows(self, rows):
+        """按升序行号取出向量，行号可以跨越磁盘部分和新增部分"""
+        base_rows = len(self._base_vectors) if self._base_vectors is not None else 0
+        split = np.searchsorted(rows, base_rows)
+        parts = []
+        if split > 0:
+            parts.append(self._base_vectors[rows[:split]])
+        if split < len(rows):
+            parts.append(self._matrix[rows[split:] - base_rows])
+        if len(parts) == 1:
+            return parts[0]
+        return np.concatenate(parts)
+    
+    @property
+    def embeddings_list(self):
+        """全部嵌入矩阵（每行已归一化）；同时存在磁盘和新增部分时返回拼接后的副本"""
+        blocks = self._vector_blocks()
+        if not blocks:
+            return np.empty((0, 0), dtype=np.float32)
+        if len(blocks) == 1:
+            return blocks[0]
+        return np.concatenate(blocks)
+    
+    def _append_vectors(self, vectors):
+        """将嵌入追加到矩阵末尾，容量不足时按倍数扩容"""
+        if len(vectors) == 0:
+            return
+        vectors = self._normalize(vectors)
+        n, dim = vectors.shape
+        
+        store_dim = self._dim()
+        if store_dim is not None and store_dim != dim:
+            raise ValueError(f"嵌入维度不一致: 存储为 {store_dim}，新增为 {dim}")
+        if self._matrix is None or self._matrix.shape[1] != dim:
+            self._matrix = np.empty((max(n, MIN_MATRIX_CAPACITY), dim), dtype=np.float32)
+        
+        needed = self._count + n
+        if needed > self._matrix.shape[0]:
+            capacity = max(needed, self._matrix.shape[0] * 2)
+            matrix = np.empty((capacity, dim), dtype=np.float32)
+            matrix[:self._count] = self._matrix[:self._count]
+            self._matrix = matrix
+        
+        self._matrix[self._count:needed] = vectors
+        self._count = needed
+    
+    def _top_k(self, scores, k):
+        """用argpartition选出得分最高的k个下标，并按得分降序返回；得分为-inf的（已删除）行不返回"""
+        k = min(k, len(scores))
+        if k <= 0:
+            return np.empty(0, dtype=np.int64)
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        return candidates[scores[candidates] > -np.inf]
+    
+    def _live_count(self):
+        """未删除的行数"""
+        return len(self.texts) - self._deleted_count
+    
+    def _mask_deleted(self, scores, deleted):
+        """把已删除行的得分置为-inf；合并切换期间标记数组与行数可能短暂不一致，只处理重叠部分"""
+        n = min(len(scores), len(deleted))
+        scores[:n][deleted[:n]] = -np.inf
+    
+    def _drop_deleted(self, rows, deleted):
+        """从升序行号中去掉已删除的行"""
+        n = np.searchsorted(rows, len(deleted))
+        keep = np.ones(len(rows), dtype=bool)
+        keep[:n] = ~deleted[rows[:n]]
+        return rows[keep]
+    
+    def _search_by_vector(self, query_embedding, k, exact=False, rows=None):
+        """计算余弦相似度并返回top-k下标
+
+        exact=False时：IVF索引可用则只扫描候选列表；量化器可用则在量化编码上近似打分，
+        再用全精度向量对前 k*RESCORE_FACTOR 个候选重新打分。
+        rows为过滤后的候选行号（升序）时只对这些行做精确打分。
+        """
+        query = self._normalize(query_embedding)[0]
+        if rows is not None:
+            if len(rows) == 0:
+                return rows
+            return rows[self._top_k(self._gather_rows(rows) @ query, k)]
+        # 删除标记总是先于行扩展，长度不小于行数
+        deleted = self._deleted if self._deleted_count else None
+        if not exact:
+            rows = None
+            ivf = self._ivf
+            if ivf is not None and ivf.trained:
+                rows = ivf.candidates(query)
+                if deleted is not None:
+                    rows = self._drop_deleted(rows, deleted)
+                if len(rows) < k:
+                    rows = None
             
-            # 切换到MockEmbeddings作为回退
-            self.embeddings = MockEmbeddings()
+            quantizer, codes = self._quantizer, self._codes
+            if quantizer is not None and quantizer.trained:
+                if rows is None:
+                    scores = quantizer.score(query, codes)
+                    if deleted is not None:
+                        self._mask_deleted(scores, deleted)
+                else:
+                    scores = quantizer.score(query, codes[rows])
+                if RESCORE_FACTOR <= 0:
+                    top = self._top_k(scores, k)
+                    return top if rows is None else rows[top]
+                pool = self._top_k(scores, k * RESCORE_FACTOR)
+                pool = np.sort(pool if rows is None else rows[pool])
+                return pool[self._top_k(self._gather_rows(pool) @ query, k)]
             
-            # 使用MockEmbeddings嵌入文本
-            embeddings = self.embeddings.embed_documents(texts)
+            if rows is not None:
+                scores = self._gather_rows(rows) @ query
+                return rows[self._top_k(scores, k)]
+        
+        # 基础文件足够大时由分片进程池并行打分
+        results = self._search_sharded(query[None, :], k)
+        if results is not None:
+            return results[0][0]
+        
+        # 精确检索：每个向量块一次矩阵-向量乘法
+        scores = np.concatenate([block @ query for block in self._vector_blocks()])
+        if deleted is not None:
+            self._mask_deleted(scores, deleted)
+        return self._top_k(scores, k)
+    
+    def _search_batch_by_vectors(self, query_embeddings, k, rows=None):
+        """批量精确检索：按查询块与全部向量（或过滤后的候选行）做矩阵-矩阵乘法，返回每个查询的 (行号, 得分)"""
+        queries = self._normalize(query_embeddings)
+        if rows is not None:
+            blocks = [self._gather_rows(rows)] if len(rows) else []
+            deleted = None
+        else:
+            results = self._search_sharded(queries, k)
+            if results is not None:
+                return results
+            blocks = self._vector_blocks()
+        n = sum(len(block) for block in blocks)
+        if rows is None:
+            deleted = self._deleted[:n] if self._deleted_count else None
+        k = min(k, n)
+        if k <= 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)) for _ in queries]
+        
+        results = []
+        step = max(1, BATCH_SCORE_ELEMENTS // n)
+        for start in range(0, len(queries), step):
+            query_block = queries[start:start + step]
+            scores = np.empty((len(query_block), n), dtype=np.float32)
+            position = 0
+            for block in blocks:
+                scores[:, position:position + len(block)] = query_block @ block.T
+                position += len(block)
+            if deleted is not None and len(deleted) == n:
+                scores[:, deleted] = -np.inf
             
-            # 存储文本和嵌入
+            top, top_scores = top_k_matrix(scores, k)
+            for top_rows, row_scores in zip(top, top_scores):
+                found = row_scores > -np.inf
+                top_rows = top_rows[found]
+                results.append((top_rows if rows is None else rows[top_rows], row_scores[found]))
+        return results
+    
+    def _search_sharded(self, queries, k):
+        """用分片进程池精确检索基础文件中的行，日志段中的行在本进程打分后合并；不适用时返回None"""
+        base = self._base_vectors
+        if self.search_shards <= 1 or getattr(base, "filename", None) is None or len(base) < SHARD_MIN_ROWS:
+            return None
+        base_rows = len(base)
+        deleted = self._deleted if self._deleted_count else None
+        deleted_rows = np.flatnonzero(deleted[:base_rows]) if deleted is not None else None
+        try:
+            # 工作进程按文件名映射分片，请求中只传输查询向量
+            rows, scores = self._sharded_searcher().search(base.filename, base.shape[1], base_rows,
+                                                           queries, k, deleted_rows)
+        except Exception as e:
+            print(f"分片检索失败，改为在本进程中检索: {str(e)}")
+            return None
+        
+        count = self._count
+        if count:
+            log_scores = queries @ self._matrix[:count].T
+            if deleted is not None and len(deleted) >= base_rows + count:
+                log_scores[:, deleted[base_rows:base_rows + count]] = -np.inf
+            log_rows, log_scores = top_k_matrix(log_scores, k)
+            rows = np.concatenate([rows, log_rows + base_rows], axis=1)
+            scores = np.concatenate([scores, log_scores], axis=1)
+            top, scores = top_k_matrix(scores, k)
+            rows = np.take_along_axis(rows, top, axis=1)
+        
+        results = []
+        for query_rows, query_scores in zip(rows, scores):
+            found = query_scores > -np.inf
+            results.append((query_rows[found], query_scores[found]))
+        return results
+    
+    def _sharded_searcher(self):
+        """常驻的分片检索进程池，第一次使用时启动"""
+        if self._shard_searcher is None:
+            with self._shard_lock:
+                if self._shard_searcher is None:
+                    self._shard_searcher = ShardedSearcher(self.search_shards)
+        return self._shard_searcher
+    
+    def close(self):
+        """关闭分片检索进程池"""
+        with self._shard_lock:
+            if self._shard_searcher is not None:
+                self._shard_searcher.close()
+                self._shard_searcher = None
+    
+    def _update_ann_index(self, vectors):
+        """在写锁内把新增行加入已训练的IVF索引"""
+        if self._ivf is not None and self._ivf.trained:
+            self._ivf.add(vectors)
+    
+    def _maybe_train_ann_index(self):
+        """行数首次达到阈值时训练IVF索引并持久化；在读写锁之外调用"""
+        if self._ivf is not None and not self._ivf.trained and len(self.texts) >= IVF_MIN_TRAIN_ROWS:
+            self._train_ann_index()
+            self._save_ann_index()
+    
+    def _train_ann_index(self):
+        """训练一个新的IVF索引并换入
+
+        调用方持有_write_lock，期间不会有行增减或合并；只在读锁内抽样并取出向量块的引用，
+        k-means和分配列表不持有读写锁，检索不等待训练，训练完成后在写锁内换入。
+        """
+        ivf = self._new_ann_index()
+        with self._rw_lock.read():
+            n = len(self.texts)
+            sample = self._gather_rows(sample_rows(n, ivf.sample_size(n)))
+            blocks = self._vector_blocks()
+        ivf.train(sample, n)
+        ivf.assign_blocks(blocks)
+        with self._rw_lock.write():
+            self._ivf = ivf
+    
+    def _save_ann_index(self):
+        """把IVF索引保存到当前代的数据文件旁边"""
+        if self._ivf is not None and self._ivf.trained:
+            self._storage.save_arrays("ivf", **self._ivf.to_arrays())
+    
+    def _load_ann_index(self):
+        """加载当前代的IVF索引，并为日志段中的行分配列表"""
+        self._ivf = self._new_ann_index()
+        if self._ivf is None:
+            return
+        arrays = self._storage.load_arrays("ivf")
+        if arrays is not None and len(arrays["assignments"]) <= len(self.texts):
+            self._ivf.load_arrays(arrays)
+            covered = len(self._ivf.assignments)
+            if covered < len(self.texts):
+                self._ivf.add(self._gather_rows(np.arange(covered, len(self.texts))))
+        # 索引文件缺失时由_map_storage在写锁之外训练，训练完成前使用精确检索
+    
+    def _update_quantizer(self, vectors):
+        """为新增行计算量化编码；行数首次达到阈值时训练量化器并持久化"""
+        quantizer = self._quantizer
+        if quantizer is None:
+            return
+        if quantizer.trained:
+            self._codes = np.concatenate([self._codes, quantizer.encode(vectors)])
+        elif len(self.texts) >= QUANTIZATION_MIN_TRAIN_ROWS:
+            self._train_quantizer()
+            self._save_quantizer()
+    
+    def _train_quantizer(self):
+        """在抽样向量上训练量化器，再逐块编码全部行"""
+        n = len(self.texts)
+        self._quantizer.train(self._gather_rows(sample_rows(n, MAX_TRAIN_SAMPLES)))
+        self._codes = np.concatenate([self._quantizer.encode(block) for block in self._vector_blocks()])
+    
+    def _save_quantizer(self):
+        """把量化器参数和编码保存到当前代的数据文件旁边"""
+        if self._quantizer is not None and self._quantizer.trained:
+            self._storage.save_arrays("quant", codes=self._codes, **self._quantizer.to_arrays())
+    
+    def _load_quantizer(self):
+        """加载当前代的量化编码，并为日志段中的行补充编码"""
+        self._quantizer = create_quantizer(self.quantization, PQ_SUBSPACES)
+        self._codes = None
+        if self._quantizer is None:
+            return
+        arrays = self._storage.load_arrays("quant")
+        n = len(self.texts)
+        if arrays is not None and str(arrays["method"]) == self._quantizer.kind and len(arrays["codes"]) <= n:
+            self._quantizer.load_arrays(arrays)
+            codes = arrays["codes"]
+            if len(codes) < n:
+                codes = np.concatenate([codes, self._quantizer.encode(self._gather_rows(np.arange(len(codes), n)))])
+            self._codes = codes
+        elif n >= QUANTIZATION_MIN_TRAIN_ROWS:
+            self._train_quantizer()
+            self._save_quantizer()
+    
+    def _save_lexical_index(self, live=None):
+        """把BM25倒排索引保存到当前代的数据文件旁边"""
+        if self._lexical is not None:
+            self._storage.save_arrays("bm25", **self._lexical.to_arrays(live))
+    
+    def _load_lexical_index(self):
+        """加载当前代的BM25倒排索引，并为日志段中的行补充索引；索引文件缺失时重建并保存"""
+        if not HYBRID_SEARCH:
+            self._lexical = None
+            return
+        lexical = BM25Index()
+        arrays = self._storage.load_arrays("bm25")
+        if arrays is not None and len(arrays["lengths"]) <= len(self.texts):
+            lexical.load_arrays(arrays)
+            lexical.add(self.texts[lexical.count:])
+            self._lexical = lexical
+        else:
+            lexical.add(self.texts[:])
+            self._lexical = lexical
+            if lexical.count:
+                self._save_lexical_index()
+    
+    def _hybrid_search(self, query, query_embedding, k, rows=None):
+        """向量检索和BM25检索各取候选，用倒数排名融合（RRF）合并后返回前k个行号"""
+        if self._lexical is None:
+            return self._search_by_vector(query_embedding, k, rows=rows)
+        pool = max(k, HYBRID_CANDIDATES)
+        vector_rows = self._search_by_vector(query_embedding, pool, rows=rows)
+        lexical_rows = self._lexical_rows(query, pool, rows)
+        if len(lexical_rows) == 0:
+            return vector_rows[:k]
+        return reciprocal_rank_fusion([vector_rows, lexical_rows], RRF_K)[:k]
+    
+    def _lexical_rows(self, query, k, rows=None):
+        """BM25检索的行号，rows为过滤后的候选行号时只返回其中的行"""
+        if rows is None:
+            excluded = self._deleted if self._deleted_count else None
+        else:
+            excluded = np.ones(len(self.texts), dtype=bool)
+            excluded[rows] = False
+        return self._lexical.search(query, k, excluded)[0]
+    
+    def _filter_rows(self, filter):
+        """按元数据过滤条件求出候选行号（升序，已去掉删除的行）；没有过滤条件时返回None"""
+        if not filter:
+            return None
+        filter = dict(filter)
+        if "source" in filter and not callable(filter["source"]):
+            sources = filter["source"]
+            if isinstance(sources, (list, tuple, set, frozenset)):
+                filter["source"] = [self._document_key(source) for source in sources]
+            else:
+                filter["source"] = self._document_key(sources)
+        n = len(self.texts)
+        mask = self._metadata.mask(filter)[:n] & ~self._deleted[:n]
+        return np.flatnonzero(mask)
+    
+    def lexical_search(self, query, k=4, filter=None):
+        """只用BM25倒排索引检索，不调用嵌入API"""
+        self._maybe_refresh()
+        with self._rw_lock.read():
+            if self._lexical is None:
+                return []
+            return [self.texts[i] for i in self._lexical_rows(query, k, self._filter_rows(filter))]
+    
+    def ann_recall(self, k=10, num_queries=100, seed=0):
+        """以精确检索为参照，评估近似检索（IVF和/或量化）的recall@k、平均延迟和每行内存占用
+
+        从存储中随机抽取向量作为查询，并从两边结果中去掉查询行本身。
+        """
+        n = len(self.texts)
+        ivf_ready = self._ivf is not None and self._ivf.trained
+        quantizer_ready = self._quantizer is not None and self._quantizer.trained
+        if not (ivf_ready or quantizer_ready) or n <= k:
+            return None
+        rng = np.random.default_rng(seed)
+        query_rows = np.sort(rng.choice(n, min(num_queries, n), replace=False))
+        queries = self._gather_rows(query_rows)
+        
+        hits = 0
+        exact_seconds = ann_seconds = 0.0
+        for row, query in zip(query_rows, queries):
+            started = time.perf_counter()
+            exact = self._search_by_vector(query, k + 1, exact=True)
+            exact_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            approx = self._search_by_vector(query, k + 1)
+            ann_seconds += time.perf_counter() - started
+            exact = [i for i in exact if i != row][:k]
+            approx = [i for i in approx if i != row][:k]
+            hits += len(set(exact) & set(approx))
+        report = {
+            f"recall@{k}": hits / (k * len(query_rows)),
+            "exact_ms": exact_seconds * 1000 / len(query_rows),
+            "ann_ms": ann_seconds * 1000 / len(query_rows),
+            "float32_bytes_per_row": self._dim() * 4
+        }
+        if ivf_ready:
+            report.update(nprobe=self._ivf.nprobe, nlist=len(self._ivf.centroids))
+        if quantizer_ready:
+            report.update(quantization=self._quantizer.kind,
+                          code_bytes_per_row=self._quantizer.bytes_per_row(),
+                          rescore_factor=RESCORE_FACTOR)
+        return report
+    
+    def _add_rows(self, vectors, texts, metadatas=None):
+        """在写锁内追加一批已归一化的向量：先写磁盘日志段，再更新内存，返回分配的块ID"""
+        ids = np.arange(self._next_id, self._next_id + len(texts), dtype=np.int64)
+        now = time.time()
+        metadatas = [dict({"created_at": now}, **metadata) for metadata in (metadatas or [{}] * len(texts))]
+        self._save_vector_store(ids, vectors, texts, metadatas)
+        self._apply_rows(ids, vectors, texts, metadatas)
+        return ids
+    
+    def _apply_rows(self, ids, vectors, texts, metadatas):
+        """把已写入日志段的一批行加入内存状态（本进程写入或从其他进程的日志记录重放）"""
+        with self._rw_lock.write():
+            self._next_id = max(self._next_id, int(ids[-1]) + 1 if len(ids) else 0)
+            # 先扩展ID、删除标记和元数据，这些数组总不短于行数
+            self._ids = np.concatenate([self._ids, ids])
+            self._deleted = np.concatenate([self._deleted, np.zeros(len(ids), dtype=bool)])
+            self._metadata.append(metadatas, len(texts))
+            self._append_vectors(vectors)
             self.texts.extend(texts)
-            self.embeddings_list.extend(embeddings)
-            
-            # 保存向量存储到磁盘
-            self._save_vector_store()
+            if self._lexical is not None:
+                self._lexical.add(texts)
+            self._update_ann_index(vectors)
+            self._update_quantizer(vectors)
+        self._maybe_train_ann_index()
+    
+    def _tombstone(self, ids):
+        """在写锁内把块ID标记为已删除并记录到日志段，返回实际删除的行数"""
+        rows = self._live_rows(ids)
+        if len(rows) == 0:
+            return 0
+        try:
+            self._storage.append_delete(self._ids[rows])
+        except Exception as e:
+            raise Exception(f"保存向量存储失败: {str(e)}")
+        self._mark_deleted(rows)
+        return len(rows)
+    
+    def _live_rows(self, ids):
+        """块ID对应的未删除行号"""
+        ids = np.asarray(ids, dtype=np.int64)
+        rows = np.searchsorted(self._ids, ids)
+        found = rows < len(self._ids)
+        found[found] = self._ids[rows[found]] == ids[found]
+        rows = np.unique(rows[found])
+        return rows[~self._deleted[rows]]
     
-    def similarity_search(self, query, k=4):
-        """根据查询检索最相似的文本块"""
-        if not self.texts:
+    def _mark_deleted(self, rows):
+        # 原地置位，代价只与删除的行数有关
+        with self._rw_lock.write():
+            self._deleted[rows] = True
+            self._deleted_count += len(rows)
+    
+    def similarity_search(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K, lambda_mult=MMR_LAMBDA):
+        """根据查询检索最相似的文本块
+
+        filter为 {元数据字段: 条件}，先求出匹配的行再只对这些行打分，例如
+        {"source": "uploads/a.pdf"}、{"page": [1, 2]} 或 {"created_at": lambda column: column > t}。
+        mmr=True时先取fetch_k个候选，再用最大边际相关选出k个互不重复的文本块。
+        """
+        return self._search(query, k, filter, mmr, fetch_k, lambda_mult,
+                            lambda rows: [self.texts[i] for i in rows])
+    
+    def similarity_search_with_metadata(self, query, k=4, filter=None, mmr=False, fetch_k=MMR_FETCH_K,
+                                        lambda_mult=MMR_LAMBDA):
+        """与similarity_search相同，但每个结果为 {"id", "text", "metadata"}"""
+        return self._search(query, k, filter, mmr, fetch_k, lambda_mult, lambda rows: [
+            {"id": int(self._ids[row]), "text": self.texts[row], "metadata": metadata}
+            for row, metadata in zip(rows, self._metadata.rows(rows))
+        ])
+    
+    def _search(self, query, k, filter, mmr, fetch_k, lambda_mult, collect):
+        """嵌入查询后在读锁内检索，并由collect把行号转换为结果，行号和文本总来自同一份状态"""
+        self._maybe_refresh()
+        try:
+            # 嵌入查询（可能调用API）在读锁之外进行
+            query_embedding = self.embeddings.embed_query(query)
+        except Exception as e:
+            self._fall_back_to_mock(e)
+            query_embedding = None
+        with self._rw_lock.read():
+            return collect(self._search_rows(query, query_embedding, k, filter, mmr, fetch_k, lambda_mult))
+    
+    def _search_rows(self, query, query_embedding, k, filter=None, mmr=False, fetch_k=MMR_FETCH_K,
+                     lambda_mult=MMR_LAMBDA):
+        """检索最相似的行号，嵌入失败（query_embedding为None）时依次回退到BM25检索和MockEmbeddings"""
+        if not self._live_count():
             return []
+        rows = self._filter_rows(filter)
+        
+        if query_embedding is not None:
+            try:
+                # 向量检索与BM25检索融合
+                if mmr:
+                    candidates = self._hybrid_search(query, query_embedding, max(k, fetch_k), rows)
+                    return list(self._mmr_rows(query_embedding, candidates, k, lambda_mult))
+                
+                # 返回前k个结果
+                return list(self._hybrid_search(query, query_embedding, k, rows))
+            except Exception as e:
+                self._fall_back_to_mock(e)
+        
+        # 嵌入服务不可用时BM25检索仍能给出有意义的结果
+        if self._lexical is not None:
+            lexical_rows = self._lexical_rows(query, k, rows)
+            if len(lexical_rows):
+                return list(lexical_rows)
         
         try:
-            # 嵌入查询
-            query_embedding = self.embeddings.embed_query(query)
-            
-            # 计算相似度
-            similarities = [
-                (text, self._cosine_similarity(query_embedding, emb))
-                for text, emb in zip(self.texts, self.embeddings_list)
-            ]
+            # 使用MockEmbeddings嵌入查询
+            query_embedding = self._mock_embeddings().embed_query(query)
             
-            # 按相似度排序
-            similarities.sort(key=lambda x: x[1], reverse=True)
+            if mmr:
+                candidates = self._search_by_vector(query_embedding, max(k, fetch_k), rows=rows)
+                return list(self._mmr_rows(query_embedding, candidates, k, lambda_mult))
             
             # 返回前k个结果
-            return [text for text, _ in similarities[:k]]
+            return list(self._search_by_vector(query_embedding, k, rows=rows))
+        except Exception as e2:
+            # 如果仍然失败，返回默认结果
+            print(f"MockEmbeddings也失败了: {str(e2)}")
+            # 返回前k个未删除（且满足过滤条件）的文本块作为默认结果
+            if rows is None:
+                rows = np.flatnonzero(~self._deleted[:len(self.texts)])
+            return list(rows[:k])
+    
+    def _mmr_rows(self, query_embedding, rows, k, lambda_mult=MMR_LAMBDA):
+        """对候选行做MMR重新排序，返回选中的k个行号"""
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) <= 1:
+            return rows[:k]
+        # 按升序取出全精度向量，再恢复候选的原始顺序
+        order = np.argsort(rows)
+        candidates = np.empty((len(rows), self._dim()), dtype=np.float32)
+        candidates[order] = self._gather_rows(rows[order])
+        query = self._normalize(query_embedding)[0]
+        return rows[maximal_marginal_relevance(query, candidates, k, lambda_mult)]
+    
+    def similarity_search_batch(self, queries, k=4, filter=None):
+        """批量检索多个查询：一次嵌入调用，矩阵-矩阵乘法打分
+
+        返回与queries一一对应的列表，每项为 {"ids": 块ID, "scores": 余弦相似度, "texts": 文本}，按得分降序。
+        filter与similarity_search相同，所有查询共用一次过滤结果。
+        """
+        queries = list(queries)
+        if not queries:
+            return []
+        self._maybe_refresh()
+        if not self._live_count():
+            return [{"ids": [], "scores": [], "texts": []} for _ in queries]
+        
+        try:
+            query_embeddings = self.embeddings.embed_documents(queries)
         except Exception as e:
-            print(f"DeepSeek API调用失败: {str(e)}")
-            print("自动切换到MockEmbeddings...")
-            
-            # 切换到MockEmbeddings作为回退
-            self.embeddings = MockEmbeddings()
-            
-            try:
-                # 使用MockEmbeddings嵌入查询
-                query_embedding = self.embeddings.embed_query(query)
-                
-                # 计算相似度
-                similarities = [
-                    (text, self._cosine_similarity(query_embedding, emb))
-                    for text, emb in zip(self.texts, self.embeddings_list)
-                ]
-                
-                # 按相似度排序
-                similarities.sort(key=lambda x: x[1], reverse=True)
-                
-                # 返回前k个结果
-                return [text for text, _ in similarities[:k]]
-            except Exception as e2:
-                # 如果仍然失败，返回默认结果
-                print(f"MockEmbeddings也失败了: {str(e2)}")
-                # 返回前k个文本块作为默认结果
-                return self.texts[:min(k, len(self.texts))]
+            query_embeddings = self._fall_back_to_mock(e).embed_documents(queries)
+        
+        with self._rw_lock.read():
+            ids = self._ids
+            return [
+                {"ids": ids[rows].tolist(), "scores": scores.tolist(), "texts": [self.texts[i] for i in rows]}
+                for rows, scores in self._search_batch_by_vectors(query_embeddings, k, self._filter_rows(filter))
+            ]
     
     def reset(self):
         """重置向量存储"""
-        self.texts = []
-        self.embeddings_list = []
-        
-        # 删除保存的向量存储文件
-        self._delete_vector_store()
+        with self._exclusive():
+            with self._rw_lock.write():
+                self._clear_memory()
+            
+            # 删除保存的向量存储文件
+            self._delete_vector_store()
+    
+    def export_rows(self, batch_size=WRITE_BATCH_ROWS):
+        """按批返回未删除的行：(块ID数组, 归一化向量矩阵, 文本列表, 元数据字典列表)
+
+        导出期间持有读锁，合并不会替换正在读取的文件，写入要等到导出结束才能发布。
+        """
+        with self._rw_lock.read():
+            rows = np.flatnonzero(~self._deleted[:len(self.texts)])
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                yield (self._ids[batch], self._gather_rows(batch), [self.texts[i] for i in batch],
+                       self._metadata.rows(batch))
+    
+    def import_rows(self, ids, vectors, texts, metadatas):
+        """迁移时按原块ID写入一批行，块ID必须大于已有的块ID"""
+        ids = np.asarray(ids, dtype=np.int64)
+        if len(ids) == 0:
+            return
+        order = np.argsort(ids, kind="stable")
+        ids, vectors = ids[order], self._normalize(vectors)[order]
+        texts, metadatas = [texts[i] for i in order], [metadatas[i] for i in order]
+        with self._exclusive():
+            # 块ID与行号按同样的顺序递增，按ID查找行依赖这一点
+            if len(self._ids) and ids[0] <= self._ids[-1]:
+                raise ValueError("导入的块ID必须大于已有的块ID")
+            self._save_vector_store(ids, vectors, texts, metadatas)
+            self._apply_rows(ids, vectors, texts, metadatas)
+        self._maybe_compact()
     
-    def _save_vector_store(self):
-        """将向量存储保存到磁盘"""
+    def _save_vector_store(self, ids, vectors, texts, metadatas=None):
+        """把新增的向量、文本和元数据追加到磁盘日志段"""
         try:
-            # 保存嵌入模型类型和向量数据
-            data = {
-                "texts": self.texts,
-                "embeddings_list": self.embeddings_list,
-                "embeddings_type": "mock" if isinstance(self.embeddings, MockEmbeddings) else "real"
-            }
-            file_path = os.path.join(VECTOR_STORE_PATH, "vector_store.pkl")
-            with open(file_path, "wb") as f:
-                pickle.dump(data, f)
+            self._storage.append(ids, vectors, texts, self._embeddings_type(), metadatas)
         except Exception as e:
             raise Exception(f"保存向量存储失败: {str(e)}")
     
+    def _save_document(self, key, entry):
+        """把文档登记表的变化追加到磁盘日志段"""
+        try:
+            self._storage.append_document(key, entry)
+        except Exception as e:
+            raise Exception(f"保存向量存储失败: {str(e)}")
+    
+    def compact(self, background=False):
+        """把基础文件和日志段合并为新一代文件并原子切换；background=True时在后台线程执行"""
+        if background:
+            if self._compaction_thread is None or not self._compaction_thread.is_alive():
+                self._compaction_thread = threading.Thread(target=self._compact_safely, daemon=True)
+                self._compaction_thread.start()
+            return self._compaction_thread
+        
+        with self._exclusive():
+            if not self._storage.exists():
+                return
+            n = len(self.texts)
+            live = ~self._deleted[:n]
+            reclaimed = self._dead_bytes()
+            try:
+                # 行数比训练时增长太多时重新训练质心
+                if self._ivf is not None and self._ivf.trained and n > 4 * self._ivf.trained_rows:
+                    self._train_ann_index()
+                # 已删除的行不写入新一代文件，IVF列表分配和量化编码按同样的行过滤
+                self._storage.write(self._live_blocks(live), (self.texts[i] for i in np.flatnonzero(live)),
+                                    self._ids[live], self._dim() or self._storage.manifest["dim"],
+                                    self._embeddings_type(), self._next_id, self._live_documents(live),
+                                    metadata=self._metadata.to_arrays(live))
+                if self._ivf is not None and self._ivf.trained:
+                    arrays = self._ivf.to_arrays()
+                    arrays["assignments"] = self._ivf.assignments[live]
+                    self._storage.save_arrays("ivf", **arrays)
+                if self._quantizer is not None and self._quantizer.trained:
+                    self._storage.save_arrays("quant", codes=self._codes[live], **self._quantizer.to_arrays())
+                self._save_lexical_index(live)
+            except Exception as e:
+                raise Exception(f"合并向量存储失败: {str(e)}")
+            self._map_storage()
+            self._reclaimed_bytes += reclaimed
+    
+    def _live_blocks(self, live):
+        """按批返回未删除行的向量，避免一次性复制整个矩阵"""
+        start = 0
+        for block in self._vector_blocks():
+            for offset in range(0, len(block), WRITE_BATCH_ROWS):
+                rows = block[offset:offset + WRITE_BATCH_ROWS]
+                yield rows[live[start + offset:start + offset + len(rows)]]
+            start += len(block)
+    
+    def _live_documents(self, live):
+        """登记表中只保留仍然存在的块ID"""
+        dead_ids = set(self._ids[:len(live)][~live].tolist())
+        if not dead_ids:
+            return self.documents
+        return {key: dict(entry, chunk_ids=[i for i in entry["chunk_ids"] if i not in dead_ids])
+                for key, entry in self.documents.items()}
+    
+    def _dead_bytes(self):
+        """已删除行在磁盘上占用的字节数：向量、文本、偏移和块ID"""
+        dead_rows = np.flatnonzero(self._deleted[:len(self.texts)])
+        if len(dead_rows) == 0:
+            return 0
+        text_bytes = sum(len(self.texts[i].encode("utf-8")) for i in dead_rows)
+        return len(dead_rows) * (self._dim() * 4 + 16) + text_bytes
+    
+    def count(self):
+        """未删除的行数，不计算已删除行占用的字节数"""
+        self._maybe_refresh()
+        return self._live_count()
+    
+    def stats(self):
+        """存储统计：未删除/已删除行数、已删除行占用的字节数和合并已释放的字节数"""
+        with self._rw_lock.read():
+            total = len(self.texts)
+            return {
+                "backend": self.name,
+                "live": total - self._deleted_count,
+                "dead": self._deleted_count,
+                "dead_fraction": self._deleted_count / total if total else 0.0,
+                "dead_bytes": self._dead_bytes(),
+                "reclaimed_bytes": self._reclaimed_bytes,
+                "log_rows": self._count
+            }
+    
+    def _compact_safely(self):
+        """后台合并的线程入口，失败只打印错误，日志段中的数据不受影响"""
+        try:
+            self.compact()
+        except Exception as e:
+            print(str(e))
+    
+    def _maybe_compact(self):
+        """日志段行数或已删除行数超过阈值时触发合并，使合并的摊还代价与变化的数据量成正比"""
+        base_rows = len(self._base_vectors) if self._base_vectors is not None else 0
+        if (self._count >= max(COMPACT_MIN_LOG_ROWS, COMPACT_LOG_RATIO * base_rows)
+                or self._deleted_count >= max(COMPACT_MIN_DEAD_ROWS, COMPACT_DEAD_RATIO * len(self.texts))):
+            self.compact(background=BACKGROUND_COMPACTION)
+    
+    def _map_storage(self):
+        """映射磁盘上的基础文件并重放日志段，内存中只保留映射和日志段中的数据"""
+        manifest, vectors, texts, ids = self._storage.load()
+        documents = self._storage.load_documents()
+        id_blocks = [ids]
+        deleted_blocks = [self._storage.load_tombstones()]
+        log_blocks = []
+        metadata = MetadataTable()
+        arrays = self._storage.load_arrays("metadata")
+        if arrays is not None and len(arrays["page"]) == len(ids):
+            metadata.load_arrays(arrays)
+        else:
+            # 旧版本的存储没有元数据列，使用默认值
+            metadata.append(None, len(ids))
+        for record in self._storage.read_log():
+            if record[0] == "add":
+                _, log_ids, log_vectors, log_texts, log_metadatas = record
+                id_blocks.append(log_ids)
+                log_blocks.append(log_vectors)
+                texts.extend(log_texts)
+                metadata.append(log_metadatas, len(log_texts))
+            elif record[0] == "delete":
+                deleted_blocks.append(record[1])
+            else:
+                _, key, entry = record
+                if entry is None:
+                    documents.pop(key, None)
+                else:
+                    documents[key] = entry
+        matrix = np.concatenate(log_blocks) if log_blocks else None
+        ids = np.concatenate(id_blocks)
+        deleted = np.isin(ids, np.concatenate(deleted_blocks))
+        
+        # 在写锁内一次性替换引用，检索线程不会看到新旧混合的状态
+        with self._rw_lock.write():
+            self._ids, self._deleted, self._deleted_count = ids, deleted, int(deleted.sum())
+            self._metadata = metadata
+            self._base_vectors, self._matrix, self.texts = vectors, matrix, texts
+            self._count = len(matrix) if matrix is not None else 0
+            self._next_id = max(manifest.get("next_id", 0), int(ids[-1]) + 1 if len(ids) else 0)
+            self.documents = documents
+            self._load_ann_index()
+            self._load_quantizer()
+            self._load_lexical_index()
+        self._maybe_train_ann_index()
+        return manifest
+    
+    @contextmanager
+    def _exclusive(self):
+        """写操作的互斥：进程内用写锁，进程之间用文件锁；取得锁后先读入其他进程提交的变化"""
+        with self._write_lock, self._storage.lock():
+            self._catch_up()
+            yield
+    
+    def _catch_up(self):
+        """在写锁和文件锁内读入其他进程提交的变化，返回是否有变化"""
+        storage = self._storage
+        if not storage.exists():
+            if storage.manifest is None:
+                return False
+            # 其他进程重置了存储
+            with self._rw_lock.write():
+                self._clear_memory()
+            storage.manifest = None
+            return True
+        if storage.manifest is None or storage.has_new_generation():
+            self._map_storage()
+            return True
+        if not storage.has_pending_log():
+            return False
+        # 同一代的日志段只重放尾部新增的记录
+        for record in storage.read_log(storage.log_end):
+            if record[0] == "add":
+                _, ids, vectors, texts, metadatas = record
+                self._apply_rows(ids, vectors, texts, metadatas)
+            elif record[0] == "delete":
+                self._mark_deleted(self._live_rows(record[1]))
+            else:
+                _, key, entry = record
+                if entry is None:
+                    self.documents.pop(key, None)
+                else:
+                    self.documents[key] = entry
+        return True
+    
+    def refresh(self, blocking=True):
+        """读入其他进程提交的变化：新一代文件重新映射，日志段只重放尾部的新记录，返回是否有变化
+
+        blocking=False时如果本进程其他线程或其他进程正在写入，直接返回False，继续使用当前状态。
+        """
+        if not self._write_lock.acquire(blocking=blocking):
+            return False
+        try:
+            with self._storage.lock(blocking) as locked:
+                return locked and self._catch_up()
+        finally:
+            self._write_lock.release()
+    
+    def _maybe_refresh(self):
+        """检索前按间隔检查其他进程的变化；有变化且无人写入时才读入，检索从不等待写入"""
+        now = time.monotonic()
+        if now - self._last_refresh < STORE_REFRESH_INTERVAL:
+            return
+        self._last_refresh = now
+        storage = self._storage
+        if storage.has_new_generation() or storage.has_pending_log():
+            try:
+                self.refresh(blocking=False)
+            except Exception as e:
+                print(f"读取向量存储的更新失败: {str(e)}")
+    
     def _load_vector_store(self):
-        """从磁盘加载向量存储"""
+        """从磁盘加载向量存储，必要时迁移旧版pickle存储"""
+        with self._write_lock, self._storage.lock():
+            self._load_locked()
+    
+    def _load_locked(self):
+        """在写锁和文件锁内加载，避免读到其他进程写了一半的新一代文件"""
         try:
-            file_path = os.path.join(VECTOR_STORE_PATH, "vector_store.pkl")
-            if os.path.exists(file_path):
-                with open(file_path, "rb") as f:
-                    data = pickle.load(f)
-                    self.texts = data["texts"]
-                    self.embeddings_list = data["embeddings_list"]
-                    
-                    # 检查保存的嵌入模型类型
-                    embeddings_type = data.get("embeddings_type", "real")
-                    
-                    # 如果保存的是mock类型，但当前是real类型，切换到mock
-                    if embeddings_type == "mock" and not isinstance(self.embeddings, MockEmbeddings):
-                        print(f"检测到向量存储使用的是MockEmbeddings，自动切换...")
-                        self.embeddings = MockEmbeddings()
+            if self._storage.exists():
+                manifest = self._map_storage()
+                embeddings_type = manifest.get("embeddings_type", "real")
+                # 旧格式没有块ID和登记表，合并一次升级为当前格式
+                if manifest.get("format_version", 1) < FORMAT_VERSION:
+                    self.compact()
+            elif os.path.exists(self._storage.legacy_pickle_path()):
+                embeddings_type = self._migrate_legacy_pickle()
+            else:
+                return
+            
+            # 如果保存的是mock类型，但当前是real类型，切换到mock
+            if embeddings_type == "mock" and not isinstance(self._embeddings, MockEmbeddings):
+                print(f"检测到向量存储使用的是MockEmbeddings，自动切换...")
+                self.embeddings = MockEmbeddings(self._dim() or 1536)
         except Exception as e:
             print(f"加载向量存储失败: {str(e)}")
             # 加载失败时使用空存储
-            self.texts = []
-            self.embeddings_list = []
+            self._clear_memory()
+    
+    def _migrate_legacy_pickle(self):
+        """把旧版pickle存储导入为内存映射格式，返回其嵌入类型"""
+        texts, embeddings_list, embeddings_type = self._storage.read_legacy_pickle()
+        self._clear_memory()
+        self._append_vectors(embeddings_list)
+        self.texts.extend(texts)
+        if self.texts:
+            n = len(self.texts)
+            self._storage.write(self._vector_blocks(), self.texts, np.arange(n, dtype=np.int64), self._dim(),
+                                embeddings_type, n)
+            self._map_storage()
+        self._storage.retire_legacy_pickle()
+        print(f"已将旧版pickle向量存储迁移为内存映射格式，共 {len(self.texts)} 个文本块")
+        return embeddings_type
     
     def _delete_vector_store(self):
         """删除磁盘上的向量存储文件"""
         try:
-            file_path = os.path.join(VECTOR_STORE_PATH, "vector_store.pkl")
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            self._storage.delete()
+            if os.path.exists(self._storage.legacy_pickle_path()):
+                os.remove(self._storage.legacy_pickle_path())
         except Exception as e:
             print(f"删除向量存储失败: {str(e)}")
\ No newline at end of file
@@ -1,4 +1,21 @@
-from vector_store import VectorStore
+import os
+import pickle
+import tempfile
+import numpy as np
+import pytest
+from vector_store import VectorStore, get_shared_store
+
+
+class FixedEmbeddings:
+    """按文本返回固定向量的嵌入，便于验证检索排序"""
+    def __init__(self, vectors):
+        self.vectors = vectors
+    
+    def embed_documents(self, texts):
+        return [self.vectors[text] for text in texts]
+    
+    def embed_query(self, text):
+        return self.vectors[text]
 
 class TestVectorStore:
     def setup_method(self):
@@ -68,4 +85,489 @@ class TestVectorStore:
         # 测试重置后搜索结果为空
         query = "测试查询"
         results = self.vector_store.similarity_search(query)
-        assert results == []
\ No newline at end of file
+        assert results == []
+    
+    def top_k_order_test(self):
+        """测试矩阵检索按余弦相似度降序返回top-k"""
+        self.vector_store.reset()
+        self.vector_store.embeddings = FixedEmbeddings({
+            "a": [1.0, 0.0, 0.0],
+            "b": [0.7, 0.7, 0.0],
+            "c": [0.0, 0.0, 5.0],
+            "d": [-1.0, 0.1, 0.0],
+            "q": [2.0, 0.1, 0.0],
+        })
+        self.vector_store.add_texts(["a", "b", "c", "d"])
+        
+        # 行向量在插入时已归一化
+        norms = np.linalg.norm(self.vector_store.embeddings_list, axis=1)
+        assert np.allclose(norms, 1.0)
+        assert self.vector_store.embeddings_list.dtype == np.float32
+        
+        assert self.vector_store.similarity_search("q", k=2) == ["a", "b"]
+        assert self.vector_store.similarity_search("q", k=10) == ["a", "b", "c", "d"]
+        self.vector_store.reset()
+    
+    def mmap_reload_and_legacy_migration_test(self):
+        """测试内存映射格式的重新加载以及旧版pickle的迁移"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vectors = {"甲": [1.0, 0.0], "乙": [0.0, 1.0], "q": [0.9, 0.1]}
+            with open(os.path.join(temp_dir, "vector_store.pkl"), "wb") as f:
+                pickle.dump({
+                    "texts": ["甲", "乙"],
+                    "embeddings_list": [vectors["甲"], vectors["乙"]],
+                    "embeddings_type": "real"
+                }, f)
+            
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            assert list(store.texts) == ["甲", "乙"]
+            assert os.path.exists(os.path.join(temp_dir, "manifest.json"))
+            assert not os.path.exists(os.path.join(temp_dir, "vector_store.pkl"))
+            
+            store.embeddings = FixedEmbeddings(vectors)
+            store.add_texts(["乙"])
+            
+            reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+            reloaded.embeddings = FixedEmbeddings(vectors)
+            assert isinstance(reloaded._base_vectors, np.memmap)
+            assert len(reloaded.texts) == 3
+            assert reloaded.similarity_search("q", k=1) == ["甲"]
+            del store, reloaded
+    
+    def append_only_log_and_compact_test(self):
+        """测试新增数据只追加到日志段、崩溃残留被忽略，以及compact合并"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vectors = {"一": [1.0, 0.0], "二": [0.0, 1.0], "三": [0.6, 0.8]}
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.embeddings = FixedEmbeddings(vectors)
+            store.add_texts(["一"])
+            store.add_texts(["二"])
+            
+            log_files = [name for name in os.listdir(temp_dir) if name.endswith(".wal")]
+            assert len(log_files) == 1
+            log_path = os.path.join(temp_dir, log_files[0])
+            
+            # 模拟写入过程中崩溃留下的半条记录
+            with open(log_path, "ab") as f:
+                f.write(b"VSL2\x01")
+            
+            reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+            reloaded.embeddings = FixedEmbeddings(vectors)
+            assert list(reloaded.texts) == ["一", "二"]
+            reloaded.add_texts(["三"])
+            assert list(VectorStore(use_mock=True, persist_directory=temp_dir).texts) == ["一", "二", "三"]
+            
+            reloaded.compact()
+            assert not any(name.endswith(".wal") for name in os.listdir(temp_dir))
+            compacted = VectorStore(use_mock=True, persist_directory=temp_dir)
+            assert isinstance(compacted.embeddings_list, np.memmap)
+            assert list(compacted.texts) == ["一", "二", "三"]
+            del store, reloaded, compacted
+    
+    def document_registry_test(self):
+        """测试未变化的文档被跳过、变化的文档只替换自己的文本块、删除文档后不再被检索到"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            vectors = {"甲1": [1.0, 0.0, 0.0], "甲2": [0.9, 0.1, 0.0], "乙1": [0.0, 1.0, 0.0],
+                       "甲3": [0.0, 0.0, 1.0], "查": [0.9, 0.1, 0.4]}
+            store = VectorStore(use_mock=True, persist_directory=os.path.join(temp_dir, "store"))
+            store.embeddings = FixedEmbeddings(vectors)
+            path_a = os.path.join(temp_dir, "a.txt")
+            path_b = os.path.join(temp_dir, "b.txt")
+            with open(path_a, "w", encoding="utf-8") as f:
+                f.write("甲")
+            with open(path_b, "w", encoding="utf-8") as f:
+                f.write("乙")
+            
+            assert not store.is_document_current(path_a)
+            assert store.add_document(path_a, ["甲1", "甲2"]) == 2
+            store.add_document(path_b, ["乙1"])
+            assert store.is_document_current(path_a)
+            assert store.is_document_current(path_a, "甲".encode("utf-8"))
+            assert not store.is_document_current(path_a, "甲丙".encode("utf-8"))
+            
+            # 修改文档后只替换它自己的文本块
+            with open(path_a, "w", encoding="utf-8") as f:
+                f.write("甲丙")
+            assert not store.is_document_current(path_a)
+            store.add_document(path_a, ["甲3"])
+            assert store.similarity_search("查", k=4) == ["甲3", "乙1"]
+            
+            reloaded = VectorStore(use_mock=True, persist_directory=os.path.join(temp_dir, "store"))
+            reloaded.embeddings = FixedEmbeddings(vectors)
+            assert reloaded.is_document_current(path_a)
+            assert reloaded.delete_document(path_b) == 1
+            assert reloaded.similarity_search("乙1", k=4) == ["甲3"]
+            
+            # 合并后登记表和删除标记仍然有效
+            reloaded.compact()
+            compacted = VectorStore(use_mock=True, persist_directory=os.path.join(temp_dir, "store"))
+            compacted.embeddings = FixedEmbeddings(vectors)
+            assert set(compacted.documents) == {os.path.normpath(path_a)}
+            assert compacted.similarity_search("乙1", k=4) == ["甲3"]
+            assert compacted.add_texts(["乙1"]) == [4]
+            del store, reloaded, compacted
+    
+    def ivf_search_recall_test(self):
+        """测试IVF近似检索：增量插入、持久化以及相对精确检索的召回率"""
+        rng = np.random.default_rng(0)
+        centers = rng.normal(size=(20, 16))
+        data = centers[rng.integers(0, 20, 1200)] + 0.05 * rng.normal(size=(1200, 16))
+        vectors = {f"t{i}": row.tolist() for i, row in enumerate(data)}
+        
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir, search_engine="ivf")
+            store.embeddings = FixedEmbeddings(vectors)
+            import vector_store as vector_store_module
+            original = vector_store_module.IVF_MIN_TRAIN_ROWS
+            vector_store_module.IVF_MIN_TRAIN_ROWS = 1000
+            try:
+                store.add_texts([f"t{i}" for i in range(1000)])
+                assert store._ivf.trained
+                store.add_texts([f"t{i}" for i in range(1000, 1200)])
+                assert len(store._ivf.assignments) == 1200
+                
+                report = store.ann_recall(k=5, num_queries=50)
+                assert report["recall@5"] >= 0.9
+                
+                reloaded = VectorStore(use_mock=True, persist_directory=temp_dir, search_engine="ivf")
+                assert reloaded._ivf.trained
+                assert len(reloaded._ivf.assignments) == 1200
+                reloaded.embeddings = FixedEmbeddings(vectors)
+                assert reloaded.similarity_search("t7", k=1) == ["t7"]
+                del reloaded
+            finally:
+                vector_store_module.IVF_MIN_TRAIN_ROWS = original
+            del store
+    
+    def ivf_training_does_not_block_search_test(self, monkeypatch):
+        """测试训练IVF索引时检索不等待训练完成，训练期间使用精确检索"""
+        import threading
+        import vector_store as vector_store_module
+        monkeypatch.setattr(vector_store_module, "IVF_MIN_TRAIN_ROWS", 300)
+        rng = np.random.default_rng(2)
+        vectors = {f"t{i}": row.tolist() for i, row in enumerate(rng.normal(size=(300, 8)))}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir, search_engine="ivf")
+            store.embeddings = FixedEmbeddings(vectors)
+            store.add_texts([f"t{i}" for i in range(299)])
+            results = []
+            train = vector_store_module.IVFIndex.train
+            
+            def train_while_searching(ivf, sample, rows, seed=0):
+                searcher = threading.Thread(target=lambda: results.append(store.similarity_search("t5", k=1)))
+                searcher.start()
+                searcher.join(timeout=10)
+                assert not searcher.is_alive(), "检索被IVF训练阻塞"
+                train(ivf, sample, rows, seed)
+            
+            monkeypatch.setattr(vector_store_module.IVFIndex, "train", train_while_searching)
+            store.add_texts(["t299"])
+            assert results == [["t5"]]
+            assert store._ivf.trained and len(store._ivf.assignments) == 300
+            del store
+    
+    def quantized_search_recall_test(self):
+        """测试int8和PQ量化检索：编码持久化、内存占用以及重新打分后的召回率"""
+        rng = np.random.default_rng(1)
+        centers = rng.normal(size=(30, 32))
+        data = centers[rng.integers(0, 30, 1500)] + 0.3 * rng.normal(size=(1500, 32))
+        vectors = {f"t{i}": row.tolist() for i, row in enumerate(data)}
+        import vector_store as vector_store_module
+        original = vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS
+        vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS = 1000
+        try:
+            for kind in ("int8", "pq"):
+                with tempfile.TemporaryDirectory() as temp_dir:
+                    store = VectorStore(use_mock=True, persist_directory=temp_dir, quantization=kind)
+                    store.embeddings = FixedEmbeddings(vectors)
+                    store.add_texts([f"t{i}" for i in range(1000)])
+                    store.add_texts([f"t{i}" for i in range(1000, 1500)])
+                    assert len(store._codes) == 1500
+                    
+                    report = store.ann_recall(k=5, num_queries=50)
+                    assert report["code_bytes_per_row"] < report["float32_bytes_per_row"]
+                    assert report["recall@5"] >= 0.8, (kind, report)
+                    
+                    reloaded = VectorStore(use_mock=True, persist_directory=temp_dir, quantization=kind)
+                    assert reloaded._quantizer.trained
+                    assert len(reloaded._codes) == 1500
+                    reloaded.embeddings = FixedEmbeddings(vectors)
+                    assert reloaded.similarity_search("t3", k=1) == ["t3"]
+                    del store, reloaded
+        finally:
+            vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS = original
+    
+    def delete_and_compact_test(self):
+        """测试按ID删除后检索不到已删除的行，以及合并清除已删除行并统计释放的字节数"""
+        rng = np.random.default_rng(2)
+        data = rng.normal(size=(1200, 16))
+        vectors = {f"t{i}": row.tolist() for i, row in enumerate(data)}
+        import vector_store as vector_store_module
+        original = vector_store_module.IVF_MIN_TRAIN_ROWS, vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS
+        vector_store_module.IVF_MIN_TRAIN_ROWS = vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS = 1000
+        try:
+            with tempfile.TemporaryDirectory() as temp_dir:
+                store = VectorStore(use_mock=True, persist_directory=temp_dir, search_engine="ivf",
+                                    quantization="int8")
+                store.embeddings = FixedEmbeddings(vectors)
+                ids = store.add_texts([f"t{i}" for i in range(1200)])
+                assert store.delete(ids[:600:2]) == 300
+                assert store.delete(ids[:4:2]) == 0
+                stats = store.stats()
+                assert (stats["live"], stats["dead"]) == (900, 300)
+                assert store.count() == 900
+                assert stats["dead_bytes"] > 0
+                assert store.similarity_search("t0", k=1) != ["t0"]
+                assert store.similarity_search("t1", k=1) == ["t1"]
+                
+                store.compact()
+                stats = store.stats()
+                assert (stats["live"], stats["dead"], stats["dead_bytes"]) == (900, 0, 0)
+                assert stats["reclaimed_bytes"] > 0
+                assert len(store._ivf.assignments) == len(store._codes) == 900
+                
+                reloaded = VectorStore(use_mock=True, persist_directory=temp_dir, search_engine="ivf",
+                                       quantization="int8")
+                reloaded.embeddings = FixedEmbeddings(vectors)
+                assert len(reloaded.texts) == 900
+                assert "t0" not in set(reloaded.texts)
+                assert reloaded.similarity_search("t1", k=1) == ["t1"]
+                assert reloaded.add_texts(["t0"]) == [1200]
+                del store, reloaded
+        finally:
+            vector_store_module.IVF_MIN_TRAIN_ROWS, vector_store_module.QUANTIZATION_MIN_TRAIN_ROWS = original
+    
+    def similarity_search_batch_test(self):
+        """测试批量检索与逐个检索的结果一致，并跳过已删除的行"""
+        rng = np.random.default_rng(3)
+        data = rng.normal(size=(300, 8))
+        vectors = {f"t{i}": row.tolist() for i, row in enumerate(data)}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.embeddings = FixedEmbeddings(vectors)
+            ids = store.add_texts([f"t{i}" for i in range(200)])
+            store.compact()
+            store.add_texts([f"t{i}" for i in range(200, 300)])
+            store.delete(ids[:10])
+            
+            queries = [f"t{i}" for i in range(0, 300, 7)]
+            results = store.similarity_search_batch(queries, k=5)
+            assert len(results) == len(queries)
+            for query, result in zip(queries, results):
+                assert result["texts"] == store.similarity_search(query, k=5)
+                assert result["scores"] == sorted(result["scores"], reverse=True)
+                assert not set(result["ids"]) & set(ids[:10])
+            assert results[-1]["texts"][0] == queries[-1]
+            assert results[-1]["scores"][0] == pytest.approx(1.0, abs=1e-5)
+            del store
+    
+    def hybrid_search_test(self):
+        """测试BM25与向量检索融合、重新加载和合并后的倒排索引，以及嵌入API不可用时的词法检索"""
+        vectors = {"苹果手机的电池续航": [1.0, 0.0], "香蕉富含钾元素": [0.9, 0.1], "今天的天气": [0.0, 1.0],
+                   "电池": [0.0, 1.0]}
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.embeddings = FixedEmbeddings(vectors)
+            ids = store.add_texts(["苹果手机的电池续航", "香蕉富含钾元素", "今天的天气"])
+            # 向量检索认为“今天的天气”最相似，词法检索把包含“电池”的文本块融合到前面
+            assert store.similarity_search("电池", k=3)[0] == "苹果手机的电池续航"
+            assert store.lexical_search("电池") == ["苹果手机的电池续航"]
+            
+            store.delete(ids[:1])
+            store.compact()
+            reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+            assert os.path.exists(os.path.join(temp_dir, f"bm25-{reloaded._storage.manifest['generation']:06d}.npz"))
+            assert reloaded.lexical_search("电池") == []
+            assert reloaded.lexical_search("钾元素") == ["香蕉富含钾元素"]
+            
+            # 嵌入API不可用时退回词法检索
+            class FailingEmbeddings:
+                def embed_query(self, text):
+                    raise RuntimeError("嵌入服务不可用")
+            reloaded.embeddings = FailingEmbeddings()
+            assert reloaded.similarity_search("天气", k=2) == ["今天的天气"]
+            del store, reloaded
+    
+    def mock_embeddings_search_test(self):
+        """测试离线的MockEmbeddings是确定性的，检索结果有意义"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.add_texts([
+                "这是关于Python的测试文本",
+                "这是关于Java的测试文本",
+                "这是关于数据库索引的说明"
+            ])
+            assert store.similarity_search("数据库索引", k=1) == ["这是关于数据库索引的说明"]
+            assert store.similarity_search("Python", k=1) == ["这是关于Python的测试文本"]
+            
+            # 向量只由文本决定，重新加载后的查询与已保存的向量一致
+            reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+            query = reloaded.embeddings.embed_query("这是关于Java的测试文本")
+            assert list(reloaded._search_by_vector(query, 1)) == [1]
+            del store, reloaded
+    
+    def metadata_filter_test(self):
+        """测试元数据随文本块持久化，过滤检索只返回满足条件的文本块"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            first = os.path.join(temp_dir, "first.txt")
+            second = os.path.join(temp_dir, "second.txt")
+            for path in (first, second):
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(path)
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.add_document(first, ["数据库索引的原理", "数据库事务"], [{"page": 1}, {"page": 2}])
+            store.add_document(second, ["数据库索引的使用"], [{"section": "使用"}])
+            
+            assert store.similarity_search("数据库索引", k=3, filter={"source": second}) == ["数据库索引的使用"]
+            assert store.similarity_search("数据库索引", k=3, filter={"page": 2}) == ["数据库事务"]
+            assert store.similarity_search("数据库索引", k=3, filter={"source": "不存在"}) == []
+            results = store.similarity_search_with_metadata("数据库索引", k=1, filter={"source": first})
+            assert results[0]["text"] == "数据库索引的原理"
+            assert results[0]["metadata"]["page"] == 1
+            assert results[0]["metadata"]["document_id"] == results[0]["id"]
+            assert results[0]["metadata"]["created_at"] > 0
+            batch = store.similarity_search_batch(["数据库索引"], k=3, filter={"section": "使用"})
+            assert batch[0]["texts"] == ["数据库索引的使用"]
+            
+            # 日志重放和压缩后元数据不变
+            for compact in (False, True):
+                if compact:
+                    store.delete_document(first)
+                    store.compact()
+                reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+                results = reloaded.similarity_search_with_metadata("数据库", k=3, filter={"section": "使用"})
+                assert [result["text"] for result in results] == ["数据库索引的使用"]
+                assert results[0]["metadata"]["source"] == os.path.normpath(second)
+                del reloaded
+            del store
+    
+    def mmr_search_test(self):
+        """测试MMR跳过与已选结果几乎相同的文本块"""
+        vectors = {
+            "索引原理": [1.0, 0.0, 0.0],
+            "索引原理（重叠）": [0.99, 0.14, 0.0],
+            "索引的使用": [0.7, 0.0, 0.71],
+            "无关内容": [0.0, 1.0, 0.0],
+            "查询": [1.0, 0.0, 0.1]
+        }
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=temp_dir)
+            store.embeddings = FixedEmbeddings(vectors)
+            store.add_texts(["索引原理", "索引原理（重叠）", "索引的使用", "无关内容"])
+            assert store.similarity_search("查询", k=2) == ["索引原理", "索引原理（重叠）"]
+            assert store.similarity_search("查询", k=2, mmr=True, fetch_k=4) == ["索引原理", "索引的使用"]
+            # lambda_mult=1时退化为按相关性排序
+            assert store.similarity_search("查询", k=2, mmr=True, fetch_k=4, lambda_mult=1.0) == ["索引原理", "索引原理（重叠）"]
+            del store
+    
+    def sharded_search_test(self, monkeypatch):
+        """测试分片进程池的检索结果与本进程精确检索一致（含已删除行和日志段中的行）"""
+        monkeypatch.setattr("vector_store.SHARD_MIN_ROWS", 1)
+        with tempfile.TemporaryDirectory() as temp_dir:
+            rng = np.random.default_rng(0)
+            texts = [f"文本{i}" for i in range(220)]
+            vectors = {text: rng.standard_normal(16).tolist() for text in texts + ["查询1", "查询2", "查询3"]}
+            store = VectorStore(use_mock=True, persist_directory=temp_dir, search_shards=3)
+            store.embeddings = FixedEmbeddings(vectors)
+            ids = store.add_texts(texts[:200])
+            store.compact()
+            store.delete(ids[:50:3])
+            store.add_texts(texts[200:])
+            queries = store.embeddings.embed_documents(["查询1", "查询2", "查询3"])
+            
+            sharded = store._search_batch_by_vectors(queries, 10)
+            assert store._shard_searcher is not None
+            store.search_shards = 0
+            expected = store._search_batch_by_vectors(queries, 10)
+            for (rows, scores), (expected_rows, expected_scores) in zip(sharded, expected):
+                assert rows.tolist() == expected_rows.tolist()
+                assert np.allclose(scores, expected_scores)
+            store.search_shards = 3
+            assert list(store._search_by_vector(queries[0], 5, exact=True)) == expected[0][0][:5].tolist()
+            store.close()
+            del store
+    
+    def multi_process_refresh_test(self):
+        """测试两个实例（模拟两个进程）写同一份存储时，另一方只重放日志尾部或重新映射新一代文件"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            writer = VectorStore(use_mock=True, persist_directory=temp_dir)
+            reader = VectorStore(use_mock=True, persist_directory=temp_dir)
+            ids = writer.add_texts(["第一段关于数据库的文本", "第二段关于网络的文本"])
+            assert reader.refresh()
+            assert list(reader.texts) == list(writer.texts)
+            assert not reader.refresh()
+            
+            writer.compact()
+            base = reader._base_vectors
+            assert reader.refresh()
+            assert reader._base_vectors is not base
+            assert reader._storage.manifest["generation"] == writer._storage.manifest["generation"]
+            
+            # 写入前先读入对方的变化，块ID不会冲突、日志记录不会互相覆盖
+            reader_ids = reader.add_texts(["第三段关于缓存的文本"])
+            assert reader_ids[0] > max(ids)
+            writer.delete(ids[:1])
+            assert reader.refresh()
+            assert reader.lexical_search("数据库") == []
+            assert reader.lexical_search("缓存") == ["第三段关于缓存的文本"]
+            assert writer.lexical_search("缓存") == ["第三段关于缓存的文本"]
+            reloaded = VectorStore(use_mock=True, persist_directory=temp_dir)
+            assert reloaded.stats()["live"] == 2
+            
+            writer.reset()
+            assert reader.refresh()
+            assert len(reader.texts) == 0
+            del writer, reader, reloaded
+    
+    def shared_store_test(self):
+        """测试共享实例在进程内只创建一次，检索在并发写入时不出错"""
+        import threading
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = get_shared_store(use_mock=True, persist_directory=temp_dir)
+            assert get_shared_store(use_mock=True, persist_directory=temp_dir) is store
+            store.add_texts(["初始文本"])
+            errors = []
+            
+            def search():
+                try:
+                    for _ in range(50):
+                        assert store.similarity_search("文本", k=2)
+                except Exception as e:
+                    errors.append(e)
+            
+            thread = threading.Thread(target=search)
+            thread.start()
+            for i in range(20):
+                store.add_texts([f"新增文本{i}"])
+            store.compact()
+            thread.join()
+            assert not errors
+            store.close()
+    
+    def add_document_chunks_test(self):
+        """测试边解析边索引：分批写入并替换旧文本块，解析中途失败时撤销新文本块、保留原有文本块"""
+        with tempfile.TemporaryDirectory() as temp_dir:
+            store = VectorStore(use_mock=True, persist_directory=os.path.join(temp_dir, "store"))
+            path = os.path.join(temp_dir, "a.txt")
+            with open(path, "w", encoding="utf-8") as f:
+                f.write("甲")
+            store.add_document(path, ["旧的文本块"])
+            
+            chunks = ((f"第{i}段", {"page": i // 2 + 1}) for i in range(5))
+            assert store.add_document_chunks(path, chunks, batch_size=2) == 5
+            entry = store.documents[os.path.normpath(path)]
+            assert entry["chunk_ids"] == [1, 2, 3, 4, 5]
+            assert entry["document_id"] == 0
+            assert store.similarity_search("旧的文本块", k=10, filter={"page": [3]}) == ["第4段"]
+            assert "旧的文本块" not in store.similarity_search("旧的文本块", k=10)
+            
+            def broken():
+                yield "新的文本块", {}
+                yield "另一个文本块", {}
+                raise RuntimeError("解析失败")
+            
+            with pytest.raises(RuntimeError):
+                store.add_document_chunks(path, broken(), batch_size=1)
+            assert store.documents[os.path.normpath(path)] == entry
+            assert store.stats()["live"] == 5
+            store.close()